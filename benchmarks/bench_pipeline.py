@@ -0,0 +1,212 @@
+# Lib
+import argparse
+import copy
+import json
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from collections import defaultdict
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+# App
+import methylprep
+from methylprep.files import IdatDataset, Manifest, get_sample_sheet
+from methylprep.files.synthetic import write_synthetic_dataset
+from methylprep.models import Channel, parse_sample_sheet_into_idat_datasets
+from methylprep.processing import SampleDataContainer, run_pipeline, consolidate_values_for_sheet
+from methylprep.processing.profiling import RunProfiler, read_profile
+
+
+__all__ = ['bench_stages', 'bench_run_pipeline', 'run_suite', 'save_results', 'compare_results', 'SUITES']
+
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+# SampleDataContainer's profiler stages, and the functions each one times
+SAMPLE_STAGES = {
+    'channel_switch': 'infer_type_I_probes',
+    'sigset': 'SigSet',
+    'poobah': '_pval_sesame_preprocess',
+    'noob': 'preprocess_noob',
+    'dye_bias': 'nonlinear_dye_bias_correction',
+}
+STAGE_SAMPLES = 3 # samples of each array type for the stage benchmarks; consolidating uses them all
+# arrays for the stage benchmarks; (array, samples) for the full run_pipeline benchmarks.
+SUITES = {
+    'quick': {'arrays': ['27k'], 'pipelines': [('27k', 10)]},
+    'full': {'arrays': ['27k', '450k', 'epic', 'mouse'],
+        'pipelines': [('27k', 10), ('27k', 100), ('27k', 1000), ('450k', 10), ('450k', 100)]},
+}
+
+
+def synthetic_dataset(data_dir, array_type, n_samples):
+    """The synthetic dataset's manifest filepath; it is written once, then kept in data_dir for later runs."""
+    manifest_path = Path(data_dir, f'synthetic_{array_type}_manifest.csv.gz')
+    sheet_path = Path(data_dir, 'samplesheet.csv')
+    if manifest_path.exists() and sheet_path.exists() and len(pd.read_csv(sheet_path)) == n_samples:
+        return manifest_path
+    return write_synthetic_dataset(data_dir, array_type, n_samples)
+
+
+def _summary(times):
+    return {'min': round(min(times), 4), 'median': round(statistics.median(times), 4), 'repeat': len(times)}
+
+
+def _timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def bench_stages(array_type, data_root, repeat=3):
+    """Times each pipeline stage for one array type, on STAGE_SAMPLES synthetic samples: reading an IDAT, loading the
+    manifest, each of SAMPLE_STAGES, consolidating the beta values of all samples, and exporting a sample's csv."""
+    data_dir = Path(data_root, f'{array_type}_{STAGE_SAMPLES}')
+    manifest_path = synthetic_dataset(data_dir, array_type, STAGE_SAMPLES)
+    results = {}
+    green_idat = sorted(data_dir.rglob('*_Grn.idat'))[0]
+    results['idat'] = _summary(_timed(lambda: IdatDataset(green_idat, Channel.GREEN), repeat))
+    manifest_times = _timed(lambda: Manifest(array_type, manifest_path, verbose=False), repeat)
+    results['manifest'] = _summary(manifest_times)
+    manifest = Manifest(array_type, manifest_path, verbose=False)
+
+    # the per-sample stages are timed with the same profiler as run_pipeline(profile=True)
+    idat_datasets = parse_sample_sheet_into_idat_datasets(get_sample_sheet(data_dir), bit='float32')
+    stage_times = defaultdict(list)
+    containers = []
+    for idat_dataset_pair in idat_datasets:
+        for _ in range(repeat):
+            profiler = RunProfiler()
+            # channel switching changes the IDAT values, so each repeat starts from a copy.
+            container = SampleDataContainer(copy.deepcopy(idat_dataset_pair), manifest=manifest, pval=True,
+                profiler=profiler)
+            container.process_all()
+            for record in profiler.records:
+                stage_times[record['stage']].append(record['wall_s'])
+        container.profiler = None
+        containers.append(container)
+    for stage in SAMPLE_STAGES:
+        if stage_times.get(stage):
+            results[stage] = _summary(stage_times[stage])
+
+    results['consolidate'] = _summary(_timed(lambda: consolidate_values_for_sheet(containers,
+        postprocess_func_colname='beta_value', poobah=True, exclude_rs=True), repeat))
+    with tempfile.TemporaryDirectory() as export_dir:
+        export_path = str(Path(export_dir, 'sample_processed.csv'))
+        results['export'] = _summary(_timed(lambda: containers[0].export(export_path), repeat))
+    return results
+
+
+def bench_run_pipeline(array_type, n_samples, data_root, repeat=1):
+    """Times a full run_pipeline (betas, with the per-sample csv exports) on n_samples synthetic samples."""
+    source_dir = Path(data_root, f'{array_type}_{n_samples}')
+    manifest_path = synthetic_dataset(source_dir, array_type, n_samples)
+    times, peaks = [], []
+    for _ in range(repeat):
+        with tempfile.TemporaryDirectory() as data_dir:
+            for item in source_dir.iterdir(): # outputs go into data_dir, so start from the inputs only
+                (shutil.copytree if item.is_dir() else shutil.copy)(item, Path(data_dir, item.name))
+            start = time.perf_counter()
+            run_pipeline(data_dir, manifest_filepath=str(manifest_path), betas=True, export=True, profile=True)
+            times.append(time.perf_counter() - start)
+            run_record = [record for record in read_profile(data_dir) if record['stage'] == 'run'][-1]
+            peaks.append(run_record['peak_rss_mb'])
+    return {**_summary(times), 'per_sample': round(min(times) / n_samples, 4),
+        'peak_rss_mb': max(peaks) if None not in peaks else None}
+
+
+def _environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=Path(__file__).resolve().parent,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'methylprep': methylprep.__version__, 'commit': commit, 'python': platform.python_version(),
+        'numpy': np.__version__, 'pandas': pd.__version__,
+        'machine': platform.machine(), 'processor': platform.processor(),
+        'date': datetime.now().isoformat(timespec='seconds')}
+
+
+def run_suite(arrays, pipelines, data_root, repeat=3):
+    """Runs the stage benchmarks for each array type and the run_pipeline benchmarks; returns the results as a dict."""
+    results = {'environment': _environment(), 'stages': {}, 'run_pipeline': {}}
+    for array_type in arrays:
+        print(f"stages: {array_type}", flush=True)
+        results['stages'][array_type] = bench_stages(array_type, data_root, repeat=repeat)
+    for array_type, n_samples in pipelines:
+        print(f"run_pipeline: {array_type} x {n_samples}", flush=True)
+        results['run_pipeline'][f'{array_type} x {n_samples}'] = bench_run_pipeline(array_type, n_samples, data_root)
+    return results
+
+
+def save_results(results, results_dir=RESULTS_DIR):
+    """Saves results as results_dir/<version>-<commit>-<date>.json, for compare_results() in later versions."""
+    environment = results['environment']
+    stamp = environment['date'].replace(':', '').replace('-', '')
+    filepath = Path(results_dir, f"{environment['methylprep']}-{environment['commit'] or 'local'}-{stamp}.json")
+    filepath.parent.mkdir(parents=True, exist_ok=True)
+    filepath.write_text(json.dumps(results, indent=2))
+    return filepath
+
+
+def _flatten(results):
+    flat = {f'{array_type} {stage}': result['min']
+        for array_type, stages in results['stages'].items() for stage, result in stages.items()}
+    flat.update({f'run_pipeline {name}': result['min'] for name, result in results['run_pipeline'].items()})
+    return flat
+
+
+def compare_results(old, new, threshold=0.1):
+    """A text table of the benchmarks in both result files (or dicts), with the ratio of their fastest times.
+    Those more than threshold slower are marked '!'."""
+    old, new = [json.loads(Path(results).read_text()) if not isinstance(results, dict) else results
+        for results in (old, new)]
+    old_times, new_times = _flatten(old), _flatten(new)
+    names = [name for name in new_times if name in old_times]
+    width = max([len(name) for name in names] + [9])
+    old_version, new_version = old['environment']['methylprep'], new['environment']['methylprep']
+    lines = [f"{'benchmark':<{width}}  {old_version:>10}  {new_version:>10}  {'ratio':>6}"]
+    for name in names:
+        ratio = new_times[name] / old_times[name] if old_times[name] else float('nan')
+        flag = ' !' if ratio > 1 + threshold else ''
+        lines.append(f"{name:<{width}}  {old_times[name]:>10.4f}  {new_times[name]:>10.4f}  {ratio:>6.2f}{flag}")
+    return '\n'.join(lines)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Times each processing stage and full run_pipeline runs on synthetic IDATs.")
+    parser.add_argument('--suite', choices=list(SUITES), default='quick',
+        help='which arrays and run_pipeline sizes to run')
+    parser.add_argument('--arrays', nargs='*', help='array types for the stage benchmarks (overrides the suite)')
+    parser.add_argument('--samples', nargs='*', type=int, help='run_pipeline sizes (overrides the suite)')
+    parser.add_argument('--pipeline_array', default='27k',
+        help='array type of the run_pipeline benchmarks, with --samples')
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='runs of each stage')
+    parser.add_argument('--data_dir', default=Path(tempfile.gettempdir(), 'methylprep_benchmarks'),
+        help='where the synthetic datasets are written, and kept for later runs')
+    parser.add_argument('--results_dir', default=RESULTS_DIR, help='where the results json is saved')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+        help='compare two saved results files, without running anything')
+    args = parser.parse_args(args)
+    if args.compare:
+        print(compare_results(*args.compare))
+        return
+    suite = SUITES[args.suite]
+    arrays = suite['arrays'] if args.arrays is None else args.arrays
+    pipelines = suite['pipelines'] if args.samples is None else [(args.pipeline_array, n) for n in args.samples]
+    results = run_suite(arrays, pipelines, args.data_dir, repeat=args.repeat)
+    for name, seconds in _flatten(results).items():
+        print(f"{name:<32} {seconds:.4f}s")
+    print(f"saved {save_results(results, args.results_dir)}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
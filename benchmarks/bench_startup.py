@@ -0,0 +1,60 @@
+# Lib
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+
+__all__ = ['time_command', 'loaded_modules', 'STARTUP_COMMANDS', 'DEFERRED_MODULES']
+
+# what is timed: each runs in a fresh interpreter, so nothing is cached in memory between repeats.
+STARTUP_COMMANDS = {
+    'import methylprep': [sys.executable, '-c', 'import methylprep'],
+    'methylprep --help': [sys.executable, '-m', 'methylprep', '--help'],
+    'python (baseline)': [sys.executable, '-c', 'pass'],
+}
+# modules that `import methylprep` should not load; these are imported when first used.
+DEFERRED_MODULES = ['methylprep.download', 'statsmodels', 'scipy.stats', 'bs4', 'ftplib', 'requests']
+
+
+def time_command(command, repeat=5):
+    """Runs command repeat times; returns the wall times, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def loaded_modules(names=DEFERRED_MODULES):
+    """Which of names are in sys.modules after a fresh `import methylprep`."""
+    code = f"import sys, methylprep; print(','.join(m for m in {list(names)!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return [name for name in result.stdout.strip().split(',') if name]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Times `import methylprep` and CLI startup.")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='runs of each command')
+    parser.add_argument('--json', action='store_true', help='print results as json')
+    args = parser.parse_args(args)
+    results = {}
+    for name, command in STARTUP_COMMANDS.items():
+        times = time_command(command, repeat=args.repeat)
+        results[name] = {'min': round(min(times), 3), 'median': round(statistics.median(times), 3)}
+    results['deferred modules loaded by import'] = loaded_modules()
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return results
+    for name, result in results.items():
+        if isinstance(result, dict):
+            print(f"{name:<20} min {result['min']:.3f}s  median {result['median']:.3f}s")
+    print(f"deferred modules loaded by import: {', '.join(results['deferred modules loaded by import']) or 'none'}")
+    return results
+
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
 # Lib
+import importlib
 from logging import NullHandler, getLogger
 import warnings
 warnings.simplefilter(action='ignore', category=FutureWarning)
@@ -7,9 +8,9 @@ from .files import get_sample_sheet, get_sample_sheet_s3
 from .processing import (
     run_pipeline,
     make_pipeline,
-    consolidate_values_for_sheet
+    consolidate_values_for_sheet,
+    load_values,
     )
-from .download import run_series, run_series_list, convert_miniml, build_composite_dataset
 from .models import ArrayType, parse_sample_sheet_into_idat_datasets
 from .files import Manifest
 from .version import __version__
@@ -19,6 +20,17 @@ getLogger(__name__).addHandler(NullHandler())
 #import numpy as np
 #np.seterr(all='raise') -- for debugging overflow / underflow somewhere
 
+# the download functions (and their ftp, http, and archive dependencies) are only imported when first used.
+_DOWNLOAD_FUNCTIONS = ['run_series', 'run_series_list', 'convert_miniml', 'build_composite_dataset']
+
+
+def __getattr__(name):
+    if name == 'download':
+        return importlib.import_module('.download', __name__)
+    if name in _DOWNLOAD_FUNCTIONS:
+        return getattr(importlib.import_module('.download', __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 __all__ = [
     'ArrayType',
     'Manifest',
@@ -27,6 +39,7 @@ __all__ = [
     'get_sample_sheet',
     'parse_sample_sheet_into_idat_datasets',
     'consolidate_values_for_sheet',
+    'load_values',
     'run_series',
     'run_series_list',
     'convert_miniml',
@@ -7,14 +7,8 @@ import sys
 from .files import get_sample_sheet
 from .models import ArrayType
 from .processing import run_pipeline
-from .download import (
-    run_series,
-    run_series_list,
-    convert_miniml,
-    build_composite_dataset,
-    search,
-    pipeline_find_betas_any_source
-    )
+from .processing.profiling import read_profile, summarize_profile, PROFILE_FILENAME
+# the download subcommands import methylprep.download (and its ftp/http dependencies) when they run.
 
 LOGGER = logging.getLogger(__name__)
 
@@ -156,6 +150,14 @@ def cli_process(cmd_args):
         help='If specified, samples will be processed and saved in batches no greater than the specified batch size'
     )
 
+    parser.add_argument(
+        '--max_memory',
+        required=False,
+        type=str,
+        help=("A memory budget, like 16GB or 500MB. If specified, the batch size is chosen automatically to fit, "
+              "and later batches are made smaller if memory use goes over budget.")
+    )
+
     parser.add_argument(
         '-u', '--uncorrected',
         required=False,
@@ -224,7 +226,70 @@ def cli_process(cmd_args):
         '-f', '--file_format',
         required=False,
         default='pickle',
-        help='Specify `parquet` instead of default `pickle`'
+        help=('Specify `parquet`, `feather` (Arrow IPC, memory-mappable), or `npy` (memory-mappable blocks of each '
+              'matrix) instead of default `pickle`')
+    )
+
+    parser.add_argument(
+        '--quantize_betas',
+        required=False,
+        action='store_true',
+        default=False,
+        help=('If specified, beta_values are saved as 16-bit fixed-point integers instead of float32 (half the size). '
+              'methylprep.load_values() decodes them.')
+    )
+
+    parser.add_argument(
+        '--masked_uint16',
+        required=False,
+        action='store_true',
+        default=False,
+        help=('If specified, meth/unmeth intensity files stay uint16 when probes are masked, with 65535 marking '
+              'missing values, instead of switching to float32. methylprep.load_values() restores the NaNs.')
+    )
+
+    parser.add_argument(
+        '--deferred_masking',
+        required=False,
+        action='store_true',
+        default=False,
+        help=('If specified, poobah and quality-masked probes are kept in the beta/m/noob files, and the p-values '
+              '(uint8) and quality mask (bits) are saved alongside, so '
+              'methylprep.load_values(..., poobah_sig=, quality_mask=) can apply any threshold on read.')
+    )
+
+    parser.add_argument(
+        '--by_position',
+        required=False,
+        action='store_true',
+        default=False,
+        help=('With `--file_format parquet`, orders probes by chromosome and MAPINFO, with one or more row groups '
+              'per chromosome, so region queries read only the row groups they need.')
+    )
+
+    parser.add_argument(
+        '--row_group_size',
+        required=False,
+        type=int,
+        default=100000,
+        help='With `--file_format parquet`, the maximum number of probes per row group.'
+    )
+
+    parser.add_argument(
+        '--parquet_compression',
+        required=False,
+        default='snappy',
+        help='With `--file_format parquet`, the compression codec: snappy (default), zstd, gzip, or none.'
+    )
+
+    parser.add_argument(
+        '--export_format',
+        required=False,
+        choices=['csv', 'csv.gz', 'parquet', 'feather', 'dataset'],
+        default=None,
+        help=('File type of the per-sample processed exports: csv (default, or matching `--file_format parquet` or '
+              '`feather`), csv.gz, parquet, or feather (Arrow IPC). `dataset` writes one long-format parquet dataset '
+              'of all samples to processed_dataset/ instead of per-sample files.')
     )
 
     parser.add_argument(
@@ -243,6 +308,35 @@ def cli_process(cmd_args):
         help='If specified, processing to RETAIN all probes that would otherwise be excluded using the quality_mask sketchy-probe list from sesame. --minfi processing does not use a quality_mask.'
     )
 
+    parser.add_argument(
+        '--resume',
+        required=False,
+        action='store_true',
+        default=False,
+        help=('If specified, batches that finished in a previous, interrupted run (with the same --batch_size '
+              'and other settings) are skipped, and their saved parts are merged with the remaining batches. '
+              'Progress is tracked in _run_journal.json in data_dir.')
+    )
+
+    parser.add_argument(
+        '--append',
+        required=False,
+        action='store_true',
+        default=False,
+        help=('If specified, only samples that are not already in the output files in data_dir are processed, '
+              'and their results are appended to the existing beta_values, noob_meth_values, '
+              'sample_sheet_meta_data, control_probes, etc. files.')
+    )
+
+    parser.add_argument(
+        '--profile',
+        required=False,
+        action='store_true',
+        default=False,
+        help=('If specified, records the wall time, CPU time, and memory of each processing stage, per batch and '
+              'per sample, in methylprep_profile.jsonl in data_dir, and prints a summary at the end.')
+    )
+
     parser.add_argument(
         '-a', '--all',
         required=False,
@@ -283,6 +377,7 @@ def cli_process(cmd_args):
         betas=args.betas,
         m_value=args.m_value,
         batch_size=args.batch_size,
+        max_memory=args.max_memory,
         save_uncorrected=args.uncorrected,
         export=args.no_export, # flag flips here
         meta_data_frame=args.no_meta_export, # flag flips here
@@ -293,8 +388,21 @@ def cli_process(cmd_args):
         quality_mask=(not args.no_quality_mask),
         sesame=(not args.minfi), # default 'sesame' method can be turned off using --minfi,
         pneg_ecdf=args.pneg_ecdf,
-        file_format=args.file_format
-    )
+        file_format=args.file_format,
+        resume=args.resume,
+        append=args.append,
+        quantize_betas=args.quantize_betas,
+        masked_uint16=args.masked_uint16,
+        deferred_masking=args.deferred_masking,
+        by_position=args.by_position,
+        row_group_size=args.row_group_size,
+        parquet_compression=args.parquet_compression,
+        export_format=args.export_format,
+        profile=args.profile,
+    )
+    if args.profile:
+        print(summarize_profile(read_profile(args.data_dir)))
+        print(f"Profile of each stage saved to {Path(args.data_dir, PROFILE_FILENAME)}")
 
 
 def cli_beta_bakery(cmd_args):
@@ -377,6 +485,7 @@ def cli_beta_bakery(cmd_args):
     else:
         args.clean = True
     delattr(args,'no_clean')
+    from .download import pipeline_find_betas_any_source
     pipeline_find_betas_any_source(**vars(args))
 
 
@@ -446,6 +555,7 @@ def cli_download(cmd_args):
         print("Missing parameter: either --id or --list are required")
         return
 
+    from .download import run_series, run_series_list
     if args.id:
         if args.batch_size:
             run_series(args.id, args.data_dir, dict_only=args.dict_only, batch_size=args.batch_size,
@@ -516,6 +626,7 @@ based on the associated meta data."""
     args = parser.parse_args(cmd_args)
     if not args.id:
         raise KeyError("You must supply a GEO id like `GSE123456`.")
+    from .download import convert_miniml
     convert_miniml(
         args.id,
         data_dir=args.data_dir,
@@ -580,6 +691,7 @@ def cli_composite(cmd_args):
     args = parser.parse_args(cmd_args)
     if not args.list:
         raise KeyError("You must supply a filepath to a list GEO ids")
+    from .download import build_composite_dataset
     build_composite_dataset(
         args.list,
         data_dir=args.data_dir,
@@ -672,6 +784,7 @@ def cli_alert(cmd_args):
         default=''
     )
     args = parser.parse_args(cmd_args)
+    from .download import search
     search(args.keyword)
 
 def cli_app():
@@ -90,6 +90,29 @@ CONTROL_COLUMNS = (
 )
 
 
+class ProbePositions():
+    """Positions of a sample's probes in target, a manifest's list of probe names (-1 for probes not in it).
+
+    Samples of one array type nearly always have the same probes, in the same order. So the names are looked up
+    for the first sample, and later samples whose probe names equal those reuse its positions; comparing the names
+    (which are the manifest's own string objects) is much faster than looking them up again."""
+
+    def __init__(self, target):
+        self.target = target
+        self.__probes = None
+        self.__positions = None
+
+    def get(self, probes):
+        """The positions of probes (an Index of probe names) in target, as an integer array. None if target has
+        duplicate names, so positions are ambiguous."""
+        if not self.target.is_unique:
+            return None
+        if self.__probes is None or not (probes is self.__probes or probes.equals(self.__probes)):
+            self.__positions = self.target.get_indexer(probes)
+            self.__probes = probes
+        return self.__positions
+
+
 class Manifest():
     """Provides an object interface to an Illumina array manifest file.
 
@@ -106,6 +129,9 @@ class Manifest():
 
     __genome_df = None
     __probe_type_subsets = None # apparently not used anywhere in methylprep
+    __quality_mask = None
+    __probe_order = None
+    __probe_positions = None
 
     def __init__(self, array_type, filepath_or_buffer=None, on_lambda=False, verbose=True):
         array_str_to_class = dict(zip(list(ARRAY_FILENAME.keys()), list(ARRAY_TYPE_MANIFEST_FILENAMES.keys())))
@@ -314,6 +340,48 @@ class Manifest():
         data_types['AddressB_ID'] = 'Int64' #'float64'
         return data_types
 
+    def get_quality_mask(self):
+        """sesame's quality mask for this array, as (index, masked): the probe names in SigSet order (the
+        manifest's probes without 'rs' probes, then the snp probes) and a boolean array, True for masked probes.
+        Matched to the probe names once per Manifest, so applying it to each sample needs no string matching.
+        Returns None if sesame has no quality mask for this array type."""
+        if self.__quality_mask is None:
+            from ..models.sketchy_probes import quality_mask_probes, QUALITY_MASK_ARRAYS
+            if self.array_type not in QUALITY_MASK_ARRAYS:
+                return None
+            probe_names = self.data_frame.index
+            index = probe_names[~probe_names.str.startswith('rs')].append(pd.Index(self.snp_data_frame['IlmnID']))
+            self.__quality_mask = (index, index.isin(quality_mask_probes(QUALITY_MASK_ARRAYS[self.array_type])))
+        return self.__quality_mask
+
+    def get_probe_order(self):
+        """The canonical (sorted) order of the probes in each sample's processed data: the manifest's probes and
+        snp probes, without the mouse array's mouse-specific probes (these are kept separately). Samples with all
+        of these probes share this one Index object, so consolidating them into matrices needs no realignment."""
+        if self.__probe_order is None:
+            probes = self.data_frame
+            if self.array_type == ArrayType.ILLUMINA_MOUSE and 'design' in probes.columns:
+                probes = probes[~probes['design'].isin(['Multi', 'Random'])]
+            names = probes.index[~probes.index.str.startswith('rs')].append(pd.Index(self.snp_data_frame['IlmnID']))
+            self.__probe_order = names.drop_duplicates().sort_values().rename('IlmnID')
+        return self.__probe_order
+
+    def get_probe_positions(self, name):
+        """A ProbePositions for matching each sample's probes to this manifest's 'quality_mask' index (see
+        get_quality_mask) or its 'probe_order' (see get_probe_order). Kept per Manifest, so every sample processed
+        with it reuses the positions found for the first. None if there is no quality mask for this array type."""
+        if self.__probe_positions is None:
+            self.__probe_positions = {}
+        if name not in self.__probe_positions:
+            if name == 'quality_mask':
+                quality_mask = self.get_quality_mask()
+                self.__probe_positions[name] = ProbePositions(quality_mask[0]) if quality_mask is not None else None
+            elif name == 'probe_order':
+                self.__probe_positions[name] = ProbePositions(self.get_probe_order())
+            else:
+                raise ValueError(f"name must be 'quality_mask' or 'probe_order'; you said {name}")
+        return self.__probe_positions[name]
+
     def get_probe_details(self, probe_type, channel=None):
         """used by infer_channel_switch. Given a probe type (I, II, SnpI, SnpII, Control) and a channel (Channel.RED | Channel.GREEN),
         this will return info needed to map probes to their names (e.g. cg0031313 or rs00542420), which are NOT in the idat files."""
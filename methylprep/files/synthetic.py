@@ -0,0 +1,271 @@
+# Lib
+import gzip
+import logging
+import struct
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from ..utils.progress_bar import * # checks environment and imports tqdm appropriately.
+# App
+from ..models import ArrayType, ControlType
+from .idat import IdatSectionCode, DEFAULT_IDAT_FILE_ID, DEFAULT_IDAT_VERSION
+from .manifests import Manifest, MANIFEST_COLUMNS, MOUSE_MANIFEST_COLUMNS
+
+
+__all__ = ['write_idat', 'write_synthetic_manifest', 'write_synthetic_samples', 'write_synthetic_dataset',
+    'IDAT_PROBE_COUNTS']
+
+LOGGER = logging.getLogger(__name__)
+
+# probes per IDAT file in real files, which ArrayType.from_probe_count() recognizes; addresses that are not in
+# the manifest pad the synthetic IDATs up to these counts, as unused bead types do in real ones.
+IDAT_PROBE_COUNTS = {
+    ArrayType.ILLUMINA_27K: 55300,
+    ArrayType.ILLUMINA_450K: 622399,
+    ArrayType.ILLUMINA_EPIC: 1051815,
+    ArrayType.ILLUMINA_EPIC_PLUS: 1055583,
+    ArrayType.ILLUMINA_MOUSE: 315639,
+}
+# the share of infinium type I probes (two addresses each) and of non-CpG (ch) probes, about as in real manifests
+TYPE_I_SHARE = {
+    ArrayType.ILLUMINA_27K: 1.0,
+    ArrayType.ILLUMINA_450K: 0.279,
+    ArrayType.ILLUMINA_EPIC: 0.164,
+    ArrayType.ILLUMINA_EPIC_PLUS: 0.164,
+    ArrayType.ILLUMINA_MOUSE: 0.07,
+}
+CH_SHARE = {ArrayType.ILLUMINA_450K: 0.0064, ArrayType.ILLUMINA_EPIC: 0.0034, ArrayType.ILLUMINA_EPIC_PLUS: 0.0034}
+# control probes other than NEGATIVE, and how many of each; NEGATIVE controls fill the rest of the array's num_controls.
+CONTROL_PROBES = {ControlType.NORM_A: 24, ControlType.NORM_C: 24, ControlType.NORM_G: 24, ControlType.NORM_T: 24,
+    ControlType.STAINING: 4, ControlType.EXTENSION: 4, ControlType.HYBRIDIZATION: 3, ControlType.TARGET_REMOVAL: 2,
+    ControlType.BISULFITE_CONVERSION_I: 12, ControlType.BISULFITE_CONVERSION_II: 4, ControlType.SPECIFICITY_I: 12,
+    ControlType.SPECIFICITY_II: 3, ControlType.NON_POLYMORPHIC: 4, ControlType.RESTORATION: 1}
+FIRST_SENTRIX_ID = 200000000000
+
+
+def _string(text):
+    # IDAT strings are prefixed by their length in bytes, 7 bits per byte (see utils.parsing.read_string)
+    encoded = text.encode('utf-8')
+    length, prefix = len(encoded), bytearray()
+    while True:
+        byte, length = length % 128, length // 128
+        prefix.append(byte | 128 if length else byte)
+        if not length:
+            return bytes(prefix) + encoded
+
+
+def write_idat(filepath, illumina_ids, means, std_devs=None, n_beads=None, barcode='', chip_type='BeadChip',
+    run_info=(('1/1/2020 12:00:00 PM', 'Scan', '', 'Synthetic', '1.0'),)):
+    """Writes an unencrypted version 3 IDAT file, with every section IdatDataset reads (and the ones its
+    verbose=True meta data reads). A filepath ending in .gz is gzipped.
+
+    illumina_ids -- the probe addresses, usually sorted, as in real IDATs.
+    means, std_devs -- intensities, as uint16; std_devs default to 10% of means.
+    n_beads -- beads per probe, as uint8 (default: 12)."""
+    count = len(illumina_ids)
+    std_devs = np.asarray(means) * 0.1 if std_devs is None else std_devs
+    n_beads = np.full(count, 12) if n_beads is None else n_beads
+    sections = {
+        IdatSectionCode.NUM_SNPS_READ: struct.pack('<i', count),
+        IdatSectionCode.ILLUMINA_ID: np.asarray(illumina_ids, '<i4').tobytes(),
+        IdatSectionCode.STD_DEV: np.asarray(np.clip(std_devs, 0, 65535), '<u2').tobytes(),
+        IdatSectionCode.MEAN: np.asarray(np.clip(means, 0, 65535), '<u2').tobytes(),
+        IdatSectionCode.NUM_BEADS: np.asarray(np.clip(n_beads, 0, 255), '<u1').tobytes(),
+        IdatSectionCode.MID_BLOCK: struct.pack('<i', count) + np.asarray(illumina_ids, '<i4').tobytes(),
+        IdatSectionCode.RUN_INFO: struct.pack('<L', len(run_info))
+            + b''.join(_string(text) for entry in run_info for text in entry),
+        IdatSectionCode.RED_GREEN: struct.pack('<i', 0),
+        IdatSectionCode.MOSTLY_NULL: _string(''),
+        IdatSectionCode.BARCODE: _string(barcode),
+        IdatSectionCode.CHIP_TYPE: _string(chip_type),
+        IdatSectionCode.MOSTLY_A: _string(''),
+    }
+    position = 16 + 10 * len(sections) # the header: file type, version, section count, and (code, offset) per section
+    header = DEFAULT_IDAT_FILE_ID.encode() + struct.pack('<q', DEFAULT_IDAT_VERSION) + struct.pack('<i', len(sections))
+    for code, data in sections.items():
+        header += struct.pack('<H', code.value) + struct.pack('<q', position)
+        position += len(data)
+    contents = header + b''.join(sections.values())
+    if str(filepath).endswith('.gz'):
+        with gzip.open(filepath, 'wb') as idat_file:
+            idat_file.write(contents)
+    else:
+        Path(filepath).write_bytes(contents)
+
+
+def write_synthetic_manifest(filepath, array_type, seed=0):
+    """Writes a manifest for array_type (any ArrayType but CUSTOM) in the format Manifest reads: its num_probes
+    cg/ch/rs probes, with type I and II designs, addresses, colors and positions, then [Controls] with its
+    num_controls control probes. Mouse manifests also have the `design` column, with a few Multi and Random
+    probes. A filepath ending in .gz is gzipped. Returns the filepath."""
+    array_type = ArrayType(array_type)
+    if array_type not in IDAT_PROBE_COUNTS:
+        raise ValueError(f"Synthetic manifests are made for one of {[str(a) for a in IDAT_PROBE_COUNTS]}, "
+                         f"not {array_type}")
+    rng = np.random.default_rng(seed)
+    num_probes, num_controls, num_snps = array_type.num_probes, array_type.num_controls, (array_type.num_snps or 0)
+    prefix = np.where(rng.random(num_probes) < CH_SHARE.get(array_type, 0), 'ch', 'cg').astype(object)
+    names = prefix + pd.Series(np.arange(num_probes)).map('{:08d}'.format).values
+    if num_snps:
+        names[-num_snps:] = [f'rs{i:07d}' for i in range(num_snps)]
+    design = np.where(rng.random(num_probes) < TYPE_I_SHARE[array_type], 'I', 'II')
+    design[prefix == 'ch'] = 'II' # as in real manifests
+    is_type_I = design == 'I'
+    # addresses are 8 digits, unique, and not in probe order
+    addresses = rng.permutation(np.arange(10000000, 99999999, 37))[:num_probes + is_type_I.sum() + num_controls]
+    address_b = np.full(num_probes, None, dtype=object)
+    address_b[is_type_I] = addresses[num_probes:num_probes + is_type_I.sum()]
+    chromosomes = np.array([str(c) for c in range(1, 23)] + ['X', 'Y'])
+    probes = pd.DataFrame({
+        'IlmnID': names,
+        'AddressA_ID': addresses[:num_probes],
+        'AddressB_ID': address_b,
+        'Infinium_Design_Type': design,
+        'Color_Channel': np.where(is_type_I, np.where(rng.random(num_probes) < 0.65, 'Red', 'Grn'), None),
+        'design': np.select([rng.random(num_probes) < 0.02, rng.random(num_probes) < 0.005], ['Multi', 'Random'],
+            'Canonical'),
+        'Genome_Build': 'mm10' if array_type == ArrayType.ILLUMINA_MOUSE else '37',
+        'CHR': rng.choice(chromosomes, num_probes),
+        'MAPINFO': rng.integers(10000, 250000000, num_probes),
+        'Strand': rng.choice(['F', 'R'], num_probes),
+        'OLD_Genome_Build': 'mm9' if array_type == ArrayType.ILLUMINA_MOUSE else '36',
+    })
+    probes['OLD_CHR'], probes['OLD_Strand'] = probes['CHR'], probes['Strand']
+    probes['OLD_MAPINFO'] = probes['MAPINFO'] - 1000
+    columns = MOUSE_MANIFEST_COLUMNS if array_type == ArrayType.ILLUMINA_MOUSE else MANIFEST_COLUMNS
+
+    control_types = [control_type.value for control_type, count in CONTROL_PROBES.items() for _ in range(count)]
+    control_types = (control_types + [ControlType.NEGATIVE.value] * num_controls)[:num_controls]
+    controls = pd.DataFrame({
+        'Address_ID': addresses[num_probes + is_type_I.sum():],
+        'Control_Type': control_types,
+        'Color': rng.choice(['Red', 'Green', 'Blue', 'Purple', 'Black'], num_controls),
+        'Extended_Type': [f'{control_type}_{i}' for i, control_type in enumerate(control_types)],
+    })
+    opener = gzip.open if str(filepath).endswith('.gz') else open
+    with opener(filepath, 'wt') as manifest_file:
+        probes[list(columns)].to_csv(manifest_file, index=False)
+        manifest_file.write('[Controls]' + ',' * (len(columns) - 1) + '\n')
+        controls.to_csv(manifest_file, index=False, header=False)
+    return filepath
+
+
+def _probe_profile(manifest, seed):
+    """Each probe's typical beta value and total signal, shared by all samples: mostly unmethylated or methylated
+    CpGs, some in between, with a log-normal total intensity."""
+    rng = np.random.default_rng([seed, 0])
+    num_probes = len(manifest.data_frame)
+    kind = rng.choice(3, num_probes, p=[0.45, 0.4, 0.15])
+    betas = np.choose(kind, [rng.beta(1.5, 15, num_probes), rng.beta(15, 1.5, num_probes), rng.beta(4, 4, num_probes)])
+    totals = rng.lognormal(8.6, 0.6, num_probes)
+    return betas, totals
+
+
+def _idat_layout(manifest):
+    """The IDAT addresses (sorted, padded to the array's IDAT probe count) and the position in them of each probe's
+    A and B address, and of each control probe."""
+    probes = manifest.data_frame
+    address_a = probes['AddressA_ID'].to_numpy(dtype='int64')
+    is_type_I = (probes['Infinium_Design_Type'] == 'I').to_numpy()
+    address_b = probes['AddressB_ID'][is_type_I].to_numpy(dtype='int64')
+    control_addresses = manifest.control_data_frame.index.to_numpy(dtype='int64')
+    used = np.unique(np.concatenate([address_a, address_b, control_addresses]))
+    padding = IDAT_PROBE_COUNTS.get(manifest.array_type, 0) - len(used)
+    if padding > 0:
+        unused = np.setdiff1d(np.arange(1000000, 1000000 + len(used) + padding), used)[:padding]
+        used = np.concatenate([used, unused])
+        used.sort()
+    return (used, np.searchsorted(used, address_a), is_type_I, np.searchsorted(used, address_b),
+        np.searchsorted(used, control_addresses))
+
+
+def _control_signal(control_types, channel, background, rng):
+    # normalization controls are bright in their own channel only; NEGATIVE controls are background.
+    bright = rng.lognormal(9.0, 0.3, len(control_types))
+    own = ControlType.normalization_red() if channel == 'Red' else ControlType.normalization_green()
+    other = ControlType.normalization_green() if channel == 'Red' else ControlType.normalization_red()
+    signal = np.where(np.isin(control_types, own), bright, rng.lognormal(8.0, 0.5, len(control_types)))
+    return np.where(np.isin(control_types, other + (ControlType.NEGATIVE.value,)), background, signal)
+
+
+def write_synthetic_samples(data_dir, manifest, n_samples, seed=0, first_sample=0, sample_sheet=True):
+    """Writes a pair of IDATs (Grn and Red) for each of n_samples samples of the array in manifest (a Manifest; its
+    probe and control addresses are used, so any real or synthetic manifest works), in data_dir/<Sentrix_ID>/,
+    and a samplesheet.csv of them.
+
+    Intensities are realistic, without being from real samples:
+        - each probe has a beta value and total signal (see _probe_profile), which vary a little by sample;
+        - about 0.5% of probes in each sample fail (signal near background), for poobah to catch;
+        - out-of-band and NEGATIVE control intensities are background noise, higher in red; the red channel
+          is brighter than green by a dye bias that varies by sample;
+        - each probe's beads (about 14) and standard deviation are drawn to match its mean.
+    Sample n only depends on seed and n, so a dataset can be extended with first_sample=<samples so far>
+    (with sample_sheet=False, or the sheet lists only the new samples). Returns the sample sheet DataFrame."""
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    array_type = manifest.array_type
+    betas, totals = _probe_profile(manifest, seed)
+    ids, at_a, is_type_I, at_b, at_controls = _idat_layout(manifest)
+    red_type_I = (manifest.data_frame['Color_Channel'][is_type_I] == 'Red').to_numpy()
+    type_II = ~is_type_I
+    control_types = manifest.control_data_frame['Control_Type'].to_numpy()
+    # 8 samples on each EPIC chip (one column), 12 on the others (two)
+    rows, columns = (8, 1) if array_type in (ArrayType.ILLUMINA_EPIC, ArrayType.ILLUMINA_EPIC_PLUS) else (6, 2)
+    samples = []
+    for sample_num in tqdm(range(first_sample, first_sample + n_samples), desc='Writing synthetic samples',
+                           disable=n_samples < 10):
+        rng = np.random.default_rng([seed, 1, sample_num])
+        sentrix_id = str(FIRST_SENTRIX_ID + seed * 10**6 + sample_num // (rows * columns))
+        slot = sample_num % (rows * columns)
+        position = f'R{slot // columns + 1:02d}C{slot % columns + 1:02d}'
+        scale = rng.lognormal(0, 0.2)
+        dye_bias = rng.lognormal(0.15, 0.1) # red / green
+        logit = np.log(betas / (1 - betas)) + rng.normal(0, 0.3, len(betas))
+        sample_betas = 1 / (1 + np.exp(-logit))
+        sample_totals = totals * scale * rng.lognormal(0, 0.15, len(totals))
+        failed = rng.random(len(totals)) < 0.005
+        sample_totals[failed] = rng.normal(300, 60, failed.sum()).clip(50)
+        meth, unmeth = sample_betas * sample_totals, (1 - sample_betas) * sample_totals
+
+        green = rng.normal(250 * scale, 60 * scale, len(ids))
+        red = rng.normal(400 * scale, 90 * scale, len(ids))
+        green[at_a[type_II]], red[at_a[type_II]] = meth[type_II], unmeth[type_II] * dye_bias
+        for channel, intensities, in_channel, bias in (('Red', red, red_type_I, dye_bias),
+                                                       ('Grn', green, ~red_type_I, 1.0)):
+            intensities[at_a[is_type_I][in_channel]] = unmeth[is_type_I][in_channel] * bias
+            intensities[at_b[in_channel]] = meth[is_type_I][in_channel] * bias
+        if len(at_controls):
+            green[at_controls] = _control_signal(control_types, 'Grn', green[at_controls], rng)
+            red[at_controls] = _control_signal(control_types, 'Red', red[at_controls], rng) * dye_bias
+
+        sample_dir = Path(data_dir, sentrix_id)
+        sample_dir.mkdir(exist_ok=True)
+        for channel, intensities in (('Grn', green), ('Red', red)):
+            means = intensities.clip(1, 65535).round()
+            n_beads = rng.poisson(14, len(ids)).clip(3, 255)
+            std_devs = np.sqrt((0.12 * means) ** 2 + 40 ** 2) * rng.lognormal(0, 0.2, len(ids))
+            write_idat(Path(sample_dir, f'{sentrix_id}_{position}_{channel}.idat'), ids, means,
+                std_devs=std_devs.round(), n_beads=n_beads, barcode=sentrix_id, chip_type=f'BeadChip {array_type}')
+        samples.append({'Sample_Name': f'Sample_{sample_num + 1}', 'Sentrix_ID': sentrix_id,
+                        'Sentrix_Position': position})
+    samples = pd.DataFrame(samples, columns=['Sample_Name', 'Sentrix_ID', 'Sentrix_Position'])
+    if sample_sheet:
+        samples.to_csv(Path(data_dir, 'samplesheet.csv'), index=False)
+    return samples
+
+
+def write_synthetic_dataset(data_dir, array_type, n_samples, seed=0, manifest_filepath=None):
+    """Writes a synthetic manifest (or uses manifest_filepath, such as a real one), n_samples samples of IDATs, and
+    their samplesheet.csv into data_dir, so the pipeline can be tested at scale without downloading anything:
+        manifest_filepath = write_synthetic_dataset(data_dir, 'epic', 1000)
+        run_pipeline(data_dir, manifest_filepath=manifest_filepath, betas=True)
+    Returns the manifest's filepath."""
+    array_type = ArrayType(array_type)
+    Path(data_dir).mkdir(parents=True, exist_ok=True)
+    if manifest_filepath is None:
+        manifest_filepath = write_synthetic_manifest(Path(data_dir, f'synthetic_{array_type}_manifest.csv.gz'),
+                                                     array_type, seed=seed)
+    manifest = Manifest(array_type, manifest_filepath, verbose=False)
+    write_synthetic_samples(data_dir, manifest, n_samples, seed=seed)
+    LOGGER.info(f"Wrote {n_samples} synthetic {array_type} samples to {data_dir}")
+    return manifest_filepath
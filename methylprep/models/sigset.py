@@ -188,10 +188,14 @@ class SigSet():
     }
     # after __init__, SigSet will have class variables for each of the keys in subsets above.
 
-    def __init__(self, sample, green_idat, red_idat, manifest, debug=False):
+    def __init__(self, sample, green_idat, red_idat, manifest, debug=False, cached_subsets=None):
         """ green_idat has .probe_means and .meta as main functions
         and for extra info, use extra kwargs:
         red= m.files.IdatDataset('9247377093_R02C01_Red.idat', m.models.Channel.RED, verbose=True, std_dev=True, nbeads=True)
+
+        cached_subsets -- a dict of probe subset dataframes (and ctrl_green/ctrl_red) saved from an earlier SigSet
+            of the same idats and manifest (see processing.stage_cache);
+            these are used instead of decoding the idats again.
         """
         self.debug = debug
         snps_read = {green_idat.n_snps_read, red_idat.n_snps_read}
@@ -244,6 +248,12 @@ class SigSet():
         fg_red   439223 |vs| ibR 439279 (incl 40 + 16 SNPs) --(flattened)--> 528482
         """
 
+        if cached_subsets is not None:
+            for name, value in cached_subsets.items():
+                setattr(self, name, value)
+            self.starting_probe_counts = {subset: getattr(self, subset).shape[0] for subset in self.subsets.keys()}
+            return
+
         if debug: print('DEBUG comparing [manifest probe_IDs vs idat probe_means]')
 
         for subset, decoder_parts in self.subsets.items():
@@ -1,33 +1,46 @@
-import numpy as np
+# Lib
+from functools import lru_cache
 import pandas as pd
-from pathlib import Path
 try:
     from importlib import resources # py >= 3.7
 except ImportError: # py < 3.7
+    resources = None
     import pkg_resources
-    loader = pkg_resources.resource_filename
+# App
+from .arrays import ArrayType
 pkg_namespace = 'methylprep.models'
 
-try:
-    if pkg_resources:
-        # resource_filename context manager does not support "with"
-        probe_filepath = loader(pkg_namespace, 'qualityMask450.txt.gz')
-        qualityMask450 = pd.read_csv(probe_filepath)['x']
-        probe_filepath = loader(pkg_namespace, 'qualityMaskEPIC.txt.gz')
-        qualityMaskEPIC = pd.read_csv(probe_filepath)['x']
-        probe_filepath = loader(pkg_namespace, 'qualityMaskEPICPLUS.txt.gz')
-        qualityMaskEPICPLUS = pd.read_csv(probe_filepath)['x']
-        probe_filepath = loader(pkg_namespace, 'qualityMaskmouse.txt.gz')
-        qualityMaskmouse = pd.read_csv(probe_filepath)['x']
-except:
-    with resources.path(pkg_namespace, 'qualityMask450.txt.gz') as probe_filepath:
-        qualityMask450 = pd.read_csv(probe_filepath)['x']
-    with resources.path(pkg_namespace, 'qualityMaskEPIC.txt.gz') as probe_filepath:
-        qualityMaskEPIC = pd.read_csv(probe_filepath)['x']
-    with resources.path(pkg_namespace, 'qualityMaskEPICPLUS.txt.gz') as probe_filepath:
-        qualityMaskEPICPLUS = pd.read_csv(probe_filepath)['x']
-    with resources.path(pkg_namespace, 'qualityMaskmouse.txt.gz') as probe_filepath:
-        qualityMaskmouse = pd.read_csv(probe_filepath)['x']
+# sesame's quality masks (probes to exclude) for each array. Each file is only read the first time it is used,
+# so `import methylprep` does not read all four.
+QUALITY_MASK_FILES = {
+    'qualityMask450': 'qualityMask450.txt.gz',
+    'qualityMaskEPIC': 'qualityMaskEPIC.txt.gz',
+    'qualityMaskEPICPLUS': 'qualityMaskEPICPLUS.txt.gz',
+    'qualityMaskmouse': 'qualityMaskmouse.txt.gz',
+}
+# array types that have a quality mask --> QUALITY_MASK_FILES name
+QUALITY_MASK_ARRAYS = {
+    ArrayType.ILLUMINA_450K: 'qualityMask450',
+    ArrayType.ILLUMINA_EPIC: 'qualityMaskEPIC',
+    ArrayType.ILLUMINA_EPIC_PLUS: 'qualityMaskEPICPLUS', # probe names were renamed to match epic+
+    ArrayType.ILLUMINA_MOUSE: 'qualityMaskmouse',
+}
+
+
+@lru_cache(maxsize=None)
+def quality_mask_probes(name):
+    """Returns a Series of the probe names in one of the QUALITY_MASK_FILES, like 'qualityMaskEPIC'."""
+    if resources is None:
+        return pd.read_csv(pkg_resources.resource_filename(pkg_namespace, QUALITY_MASK_FILES[name]))['x']
+    with resources.path(pkg_namespace, QUALITY_MASK_FILES[name]) as probe_filepath:
+        return pd.read_csv(probe_filepath)['x']
+
+
+def __getattr__(name):
+    # qualityMask450, qualityMaskEPIC, etc. can still be imported from here; these load on first access.
+    if name in QUALITY_MASK_FILES:
+        return quality_mask_probes(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 """
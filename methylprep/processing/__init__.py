@@ -1,11 +1,15 @@
 from .pipeline import SampleDataContainer, run_pipeline, make_pipeline
 from .preprocess import preprocess_noob
 from .postprocess import consolidate_values_for_sheet
+from .matrix_store import MatrixStore
+from .load import load_values
 
 __all__ = [
     'SampleDataContainer',
     'preprocess_noob',
     'run_pipeline',
     'make_pipeline,',
-    'consolidate_values_for_sheet'
+    'consolidate_values_for_sheet',
+    'MatrixStore',
+    'load_values',
 ]
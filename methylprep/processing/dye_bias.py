@@ -274,7 +274,7 @@ def nonlinear_dye_bias_correction(container, debug=False):
     #oobG = fit_func_green(container.oobG[unmeth].astype('float32').copy()) # v1.5.0+ uses noob version now, if available.
 
     if len(container.ctrl_red) == 0 or len(container.ctrl_green) == 0:
-        pass # not correcting these if missing; sesame had this caveat too
+        ctrl_red = ctrl_green = None # not correcting these if missing; sesame had this caveat too
     else:
         # THIS IS NOT SAVED BELOW... yet.
         ctrl_red = fit_func_red(container.ctrl_red['mean_value'].astype('float32').copy()).round()
@@ -368,8 +368,9 @@ def nonlinear_dye_bias_correction(container, debug=False):
     container.check_for_probe_loss(f"dye_bias - {noob}") # looking for probes that got dropped by accident.
 
     # CONTROLS are pulled directly from manifest; not updated
-    container.ctrl_green = container.ctrl_green.assign(noob=ctrl_green)
-    container.ctrl_red = container.ctrl_red.assign(noob=ctrl_red)
+    if ctrl_green is not None: # 27k manifests have no control probes
+        container.ctrl_green = container.ctrl_green.assign(noob=ctrl_green)
+        container.ctrl_red = container.ctrl_red.assign(noob=ctrl_red)
 
     container._SigSet__dye_bias_corrected = True
 
@@ -0,0 +1,108 @@
+# Lib
+import logging
+import numpy as np
+import pandas as pd
+
+
+__all__ = ['encode_betas', 'encode_intensities', 'decode_values', 'encode_pvalues', 'encode_quality_mask',
+    'pvalue_mask', 'BETA_SCALE', 'UINT16_NAN', 'PVALUE_SCALE', 'UINT8_NAN']
+
+LOGGER = logging.getLogger(__name__)
+
+# beta values in [0, 1] are saved as round(beta * BETA_SCALE) in a uint16, a step of 1.5e-5 -- finer than the
+# 3 decimals that exported CSVs keep. The largest uint16 is reserved for missing (NaN) values.
+BETA_SCALE = 65534
+UINT16_NAN = 65535
+# output matrices where a uint16 column is a fixed-point encoded beta value (betas are otherwise always floats)
+FIXED_POINT_FILE_TYPES = ('beta_values', 'mouse_beta_values')
+# intensity matrices that may be saved as uint16 with UINT16_NAN for missing (e.g. quality-masked) probes
+INTENSITY_FILE_TYPES = ('meth_values', 'unmeth_values', 'noob_meth_values', 'noob_unmeth_values',
+    'mouse_noob_meth_values', 'mouse_noob_unmeth_values')
+# with run_pipeline(deferred_masking=True), poobah p-values are saved as floor(p * PVALUE_SCALE) in a uint8 (so
+# 0-253 are exact steps of 0.001, and 254 means p >= 0.254), with UINT8_NAN for missing p-values. That is enough to
+# apply any poobah_sig up to 0.254 (with 3 decimals) later, exactly as `p >= poobah_sig` would.
+PVALUE_SCALE = 1000
+PVALUE_CODE_MAX = 254
+UINT8_NAN = 255
+# the side matrices saved with deferred_masking=True
+PVALUE_CODES_FILE = 'poobah_codes'
+QUALITY_MASK_FILE = 'quality_mask_values'
+
+
+def encode_betas(df):
+    """Returns a uint16 copy of a beta value dataframe: fixed-point betas, with UINT16_NAN for missing values."""
+    values = df.to_numpy(dtype='float32')
+    missing = np.isnan(values)
+    encoded = np.rint(np.clip(values, 0, 1) * BETA_SCALE)
+    encoded[missing] = UINT16_NAN
+    return pd.DataFrame(encoded.astype('uint16'), index=df.index, columns=df.columns)
+
+
+def encode_intensities(df):
+    """Returns a uint16 copy of an intensity dataframe, with UINT16_NAN for missing values. Intensities are
+    rounded and clipped to 0-65534 (the IDAT maximum is 65535, so only fully saturated probes change)."""
+    values = df.to_numpy(dtype='float32')
+    missing = np.isnan(values)
+    encoded = np.rint(np.clip(values, 0, UINT16_NAN - 1))
+    encoded[missing] = UINT16_NAN
+    return pd.DataFrame(encoded.astype('uint16'), index=df.index, columns=df.columns)
+
+
+def encode_pvalues(df):
+    """Returns a uint8 copy of a p-value dataframe: floor(p * PVALUE_SCALE), clipped to PVALUE_CODE_MAX, with
+    UINT8_NAN for missing values. (A small tolerance keeps float32 p-values like 0.049 from flooring to 48.)"""
+    values = df.to_numpy(dtype='float64')
+    missing = np.isnan(values)
+    encoded = np.floor(np.clip(values, 0, 1) * PVALUE_SCALE + 1e-3)
+    encoded = np.minimum(encoded, PVALUE_CODE_MAX)
+    encoded[missing] = UINT8_NAN
+    return pd.DataFrame(encoded.astype('uint8'), index=df.index, columns=df.columns)
+
+
+def encode_quality_mask(df):
+    """Returns a boolean copy of a quality_mask dataframe, True where a probe is masked (quality_mask is 0).
+    Probes without a quality_mask value (NaN) are not masked, as in consolidate_values_for_sheet."""
+    return pd.DataFrame(df.to_numpy() == 0, index=df.index, columns=df.columns)
+
+
+def pvalue_mask(codes, poobah_sig):
+    """Returns a boolean array, True where the encoded p-values (see encode_pvalues) are >= poobah_sig.
+    poobah_sig is rounded up to 3 decimals; it cannot be above PVALUE_CODE_MAX / PVALUE_SCALE."""
+    threshold = int(np.ceil(poobah_sig * PVALUE_SCALE - 1e-6))
+    if threshold > PVALUE_CODE_MAX:
+        raise ValueError(f"poobah_sig above {PVALUE_CODE_MAX / PVALUE_SCALE} cannot be applied to saved p-value codes")
+    codes = np.asarray(codes)
+    return (codes >= threshold) & (codes != UINT8_NAN)
+
+
+def decode_values(df, file_stem, dtype='float32'):
+    """Decodes any uint16 encoded columns of a saved output matrix back to floats, with NaN for missing values.
+    Columns that are not encoded (or files of other types) are returned as-is.
+
+    Intensity matrices are only decoded if they contain UINT16_NAN, so uint16 files without missing values
+    keep their integer dtype (as before masked_uint16)."""
+    if file_stem in FIXED_POINT_FILE_TYPES:
+        scale = BETA_SCALE
+    elif file_stem in INTENSITY_FILE_TYPES:
+        scale = None
+    else:
+        return df
+    encoded = [col for col, col_dtype in df.dtypes.items() if col_dtype == 'uint16']
+    if scale is None and not any((df[col].to_numpy() == UINT16_NAN).any() for col in encoded):
+        return df
+    if encoded == []:
+        return df
+    if len(encoded) == df.shape[1]:
+        return pd.DataFrame(_decode(df.to_numpy(), scale, dtype), index=df.index, columns=df.columns)
+    df = df.copy()
+    for col in encoded:
+        df[col] = _decode(df[col].to_numpy(), scale, dtype)
+    return df
+
+
+def _decode(values, scale=None, dtype='float32'):
+    decoded = values.astype(dtype)
+    if scale is not None:
+        decoded /= scale
+    decoded[values == UINT16_NAN] = np.nan
+    return decoded
@@ -0,0 +1,181 @@
+# Lib
+import gzip
+import logging
+import re
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+__all__ = ['ExportWriter', 'DatasetWriter', 'write_export', 'EXPORT_FORMATS', 'DATASET_DIRNAME']
+
+LOGGER = logging.getLogger(__name__)
+
+# export_format --> file extension of the per-sample `_processed` file
+EXPORT_FORMATS = {
+    'csv': 'csv',
+    'csv.gz': 'csv.gz',
+    'parquet': 'parquet',
+    'feather': 'feather', # Arrow IPC file
+}
+# export_format='dataset' writes all samples to one long-format parquet dataset in this folder,
+# instead of per-sample files.
+DATASET_DIRNAME = 'processed_dataset'
+
+
+def write_export(data_frame, output_path, export_format='csv', overlay=None, rows_per_chunk=100000):
+    """Writes one sample's processed data_frame to output_path, rows_per_chunk probes at a time.
+
+    overlay -- optional dataframe of values to write in place of data_frame's (like DataFrame.update: only
+        non-missing values replace), used to restore the quality-masked probes' noob values in exports.
+    Missing quality_mask values are written as 1.
+
+    Only one chunk is copied (to apply the overlay) at a time, so data_frame is never modified or deep-copied.
+    """
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError(f"export_format must be one of {list(EXPORT_FORMATS)}")
+    chunks = (_with_overlay(data_frame.iloc[start:start+rows_per_chunk], overlay)
+        for start in range(0, max(len(data_frame), 1), rows_per_chunk))
+    if export_format in ('csv', 'csv.gz'):
+        opener = gzip.open if export_format == 'csv.gz' else open
+        kwargs = {'compresslevel': 6} if export_format == 'csv.gz' else {'newline': ''}
+        with opener(output_path, 'wt', **kwargs) as export_file:
+            for num, chunk in enumerate(chunks):
+                chunk.to_csv(export_file, header=(num == 0))
+        return
+    import pyarrow as pa
+    writer = None
+    schema = None
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=True, schema=schema)
+            if writer is None:
+                schema = table.schema
+                if export_format == 'parquet':
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(output_path, table.schema)
+                else:
+                    writer = pa.ipc.new_file(output_path, table.schema,
+                                             options=pa.ipc.IpcWriteOptions(compression='lz4'))
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _with_overlay(chunk, overlay=None):
+    columns = [col for col in (overlay.columns if overlay is not None else []) if col in chunk.columns]
+    if columns == [] and 'quality_mask' not in chunk.columns:
+        return chunk
+    chunk = chunk.copy()
+    if columns:
+        chunk.update(overlay[columns].reindex(chunk.index))
+    if 'quality_mask' in chunk.columns:
+        chunk['quality_mask'] = chunk['quality_mask'].fillna(1)
+    return chunk
+
+
+class ExportWriter():
+    """Writes per-sample export files on background threads, so processing the next sample does not wait for
+    the last one's file. Writing (CSV formatting, compression, parquet encoding) mostly happens outside the GIL.
+
+    submit() blocks once max_pending files are queued, to bound how many samples' data wait in memory.
+    wait() blocks until every submitted file is written, and raises the first error, if any.
+    """
+
+    def __init__(self, max_workers=2, max_pending=4):
+        self.max_pending = max_pending
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='methylprep-export')
+        self._pending = []
+
+    def submit(self, func, *args, **kwargs):
+        while len(self._pending) >= self.max_pending:
+            self._pending.pop(0).result()
+        self._pending.append(self._executor.submit(func, *args, **kwargs))
+
+    def wait(self):
+        pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def shutdown(self):
+        try:
+            self.wait()
+        finally:
+            self._executor.shutdown(wait=True)
+
+
+class DatasetWriter():
+    """Writes every sample's processed data to one long-format parquet dataset, partitioned by batch:
+
+        data_dir/processed_dataset/batch=1/part-0.parquet
+        data_dir/processed_dataset/batch=2/part-0.parquet ...
+
+    Columns are sample_id, IlmnID, then the per-sample export columns (noob_meth, noob_unmeth, beta_value, m_value,
+    poobah_pval, quality_mask, ...) as float32, with nulls for missing values. sample_id and IlmnID are
+    dictionary-encoded, and each sample is one row group, so a scan can skip other samples by their row group
+    statistics. Read it with
+    pd.read_parquet('processed_dataset') or pyarrow.dataset.dataset('processed_dataset', partitioning='hive').
+
+    Samples are written in order on one background thread. An existing dataset is replaced, unless keep_existing
+    is True (for resume, where finished batches' partitions are kept, or append, where new batches are numbered
+    after the existing ones).
+    """
+
+    def __init__(self, data_dir, compression='snappy', keep_existing=False, append=False):
+        self.path = Path(data_dir, DATASET_DIRNAME)
+        self.compression = compression
+        if self.path.exists() and not (keep_existing or append):
+            shutil.rmtree(self.path)
+        existing = [int(match.group(1)) for match in
+            (re.match(r'batch=(\d+)$', part.name) for part in self.path.glob('batch=*')) if match]
+        self.batch_offset = max(existing, default=0) if append else 0
+        self._export_writer = ExportWriter(max_workers=1)
+        self._writers = {}
+
+    def partition_file(self, batch_num):
+        """path of a batch's parquet file, relative to data_dir (for the run journal)."""
+        return f"{DATASET_DIRNAME}/batch={batch_num + self.batch_offset}/part-0.parquet"
+
+    def write_sample(self, batch_num, sample_id, data_frame, overlay=None):
+        self._export_writer.submit(self._write_sample, batch_num, sample_id, data_frame, overlay)
+
+    def _write_sample(self, batch_num, sample_id, data_frame, overlay=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        chunk = _with_overlay(data_frame, overlay)
+        num_probes = len(chunk)
+        columns = {
+            'sample_id': pa.DictionaryArray.from_arrays(np.zeros(num_probes, dtype='int32'), pa.array([sample_id])),
+            'IlmnID': pa.array(chunk.index.astype(str)).dictionary_encode(),
+        }
+        for column in chunk.columns:
+            # float32 for every sample; columns without missing values may have been downcast to integers.
+            columns[column] = pa.array(chunk[column].to_numpy(dtype='float32'), from_pandas=True)
+        table = pa.table(columns)
+        if batch_num not in self._writers:
+            partition = Path(self.path.parent, self.partition_file(batch_num))
+            partition.parent.mkdir(parents=True, exist_ok=True)
+            self._writers[batch_num] = pq.ParquetWriter(partition, table.schema, compression=self.compression,
+                use_dictionary=['sample_id', 'IlmnID'], write_statistics=True)
+        writer = self._writers[batch_num]
+        if not table.schema.equals(writer.schema):
+            table = table.select(writer.schema.names).cast(writer.schema)
+        writer.write_table(table)
+
+    def close_batch(self, batch_num):
+        """Finishes the batch's partition file, once all of its samples are written."""
+        self._export_writer.submit(self._close_batch, batch_num)
+        self._export_writer.wait()
+
+    def _close_batch(self, batch_num):
+        writer = self._writers.pop(batch_num, None)
+        if writer is not None:
+            writer.close()
+
+    def shutdown(self):
+        for batch_num in list(self._writers):
+            self.close_batch(batch_num)
+        self._export_writer.shutdown()
@@ -0,0 +1,109 @@
+# Lib
+import json
+import logging
+import os
+from pathlib import Path
+
+
+__all__ = ['RunJournal']
+
+LOGGER = logging.getLogger(__name__)
+
+JOURNAL_FILENAME = '_run_journal.json'
+
+
+class RunJournal():
+    """Records which batches of a run_pipeline job have finished, and the files each batch wrote into data_dir.
+
+    Arguments:
+        data_dir {path-like} -- the run_pipeline data_dir; the journal is stored here as `_run_journal.json`.
+        settings {dict} -- processing settings that change output files (batch_size, file_format, estimators, etc).
+            A journal written with different settings is not reused when resuming.
+
+    Notes:
+        The journal is rewritten after every batch (via a temp file + rename), so a job killed mid-batch
+        leaves a journal describing only the batches that fully finished. run_pipeline(resume=True) skips those
+        batches, as long as every artifact they recorded still exists on disk, and then merges the batch parts.
+    """
+
+    def __init__(self, data_dir, settings=None):
+        self.path = Path(data_dir, JOURNAL_FILENAME)
+        self.settings = settings or {}
+        self.batches = {}
+
+    @classmethod
+    def load(cls, data_dir, settings=None):
+        """Reads an existing journal from data_dir. Returns an empty journal if none exists, or if the journal
+        was written with different processing settings (a warning explains why nothing will be skipped)."""
+        journal = cls(data_dir, settings)
+        if not journal.path.exists():
+            LOGGER.info(f"No run journal found in {data_dir}; processing all batches.")
+            return journal
+        try:
+            with open(journal.path, 'r') as f:
+                contents = json.load(f)
+        except (ValueError, OSError) as e:
+            LOGGER.warning(f"Could not read {journal.path} ({e}); processing all batches.")
+            return journal
+        if contents.get('settings') != journal.settings:
+            LOGGER.warning(f"{journal.path.name} was written with different processing settings; "
+                           "processing all batches.")
+            return journal
+        journal.batches = {int(batch_num): batch for batch_num, batch in contents.get('batches', {}).items()}
+        return journal
+
+    def save(self):
+        contents = {
+            'settings': self.settings,
+            'batches': {str(batch_num): batch for batch_num, batch in self.batches.items()},
+        }
+        temp_path = self.path.with_suffix('.tmp')
+        with open(temp_path, 'w') as f:
+            json.dump(contents, f, indent=2)
+        os.replace(temp_path, self.path) # atomic, so a killed job never leaves a half-written journal
+
+    def is_complete(self, batch_num, sample_names):
+        """True if this batch finished previously with the same samples and all of its files still exist."""
+        batch = self.batches.get(batch_num)
+        if batch is None or not batch.get('complete'):
+            return False
+        if batch.get('samples') != list(sample_names):
+            return False
+        missing = [artifact for artifact in batch.get('artifacts', []) if not Path(self.path.parent, artifact).exists()]
+        if missing:
+            LOGGER.warning(f"Batch {batch_num} will be re-processed; missing files: {missing}")
+            return False
+        return True
+
+    def mark_complete(self, batch_num, sample_names, artifacts):
+        """Records a finished batch. artifacts are paths relative to data_dir (or absolute paths, for exported CSVs)."""
+        self.batches[batch_num] = {
+            'samples': list(sample_names),
+            'artifacts': sorted(set(str(artifact) for artifact in artifacts)),
+            'complete': True,
+        }
+        self.save()
+
+    def artifacts(self, batch_num):
+        return self.batches.get(batch_num, {}).get('artifacts', [])
+
+    def discard_after(self, num_batches):
+        """Forgets batches numbered above num_batches, and returns the files only they wrote. A resumed run whose
+        batches were re-split (see run_pipeline max_memory) can end with fewer batches than the interrupted run,
+        so these higher-numbered parts are stale and must not be merged."""
+        stale = [batch_num for batch_num in self.batches if batch_num > num_batches]
+        if stale == []:
+            return []
+        kept_artifacts = set(artifact for batch_num in self.batches if batch_num <= num_batches
+                             for artifact in self.artifacts(batch_num))
+        stale_artifacts = sorted(set(artifact for batch_num in stale
+                                     for artifact in self.artifacts(batch_num)) - kept_artifacts)
+        for batch_num in stale:
+            del self.batches[batch_num]
+        self.save()
+        return stale_artifacts
+
+    def remove(self):
+        """Deletes the journal once the run has finished and batch parts were merged."""
+        if self.path.exists():
+            self.path.unlink()
@@ -0,0 +1,236 @@
+# Lib
+import logging
+import re
+import numpy as np
+import pandas as pd
+from pathlib import Path
+# App
+from .matrix_store import MatrixStore, MATRIX_STORE_SUFFIX
+from .encoding import decode_values, pvalue_mask, PVALUE_CODES_FILE, QUALITY_MASK_FILE, UINT8_NAN
+
+
+__all__ = ['load_values']
+
+LOGGER = logging.getLogger(__name__)
+
+# short names for the processed output matrices that run_pipeline saves.
+VALUE_KINDS = {
+    'beta': 'beta_values',
+    'm': 'm_values',
+    'm_value': 'm_values',
+    'noob_meth': 'noob_meth_values',
+    'noob_unmeth': 'noob_unmeth_values',
+    'meth': 'meth_values',
+    'unmeth': 'unmeth_values',
+    'poobah': 'poobah_values',
+    'pNegECDF': 'pNegECDF_values',
+    'mouse_beta': 'mouse_beta_values',
+    'mouse_m': 'mouse_m_values',
+    'mouse_cm': 'mouse_cm_values',
+    'mouse_noob_meth': 'mouse_noob_meth_values',
+    'mouse_noob_unmeth': 'mouse_noob_unmeth_values',
+    'poobah_codes': PVALUE_CODES_FILE,
+    'quality_mask': QUALITY_MASK_FILE,
+}
+# checked in this order: memory-mapped blocks, parquet, and feather can be partially read; pickles cannot.
+SUFFIXES = [MATRIX_STORE_SUFFIX, 'parquet', 'feather', 'pkl']
+
+
+def load_values(data_dir, kind='beta', probes=None, samples=None, region=None, poobah_sig=None, quality_mask=None):
+    """Loads a processed output matrix (probes in rows, samples in columns) from data_dir, reading only the
+    requested probes (rows) and samples (columns) where the file format allows it.
+
+    kind -- 'beta', 'm', 'noob_meth', 'noob_unmeth', 'meth', 'unmeth', 'poobah', 'pNegECDF', the mouse array's
+        'mouse_beta', 'mouse_m', 'mouse_cm', 'mouse_noob_meth', 'mouse_noob_unmeth', the deferred masks 'poobah_codes'
+        (uint8) and 'quality_mask' (bool), or a file name stem like 'beta_values'.
+    probes -- list of probe names (IlmnID) to read; default is all.
+    samples -- list of sample_ids (Sentrix_ID_Sentrix_Position) to read; default is all.
+    region -- only probes in a genomic region, like '7', 'chr7:27000000-27300000', or ('7', 27000000, 27300000).
+        This needs parquet files saved with run_pipeline(by_position=True); only row groups whose CHR and MAPINFO
+        statistics overlap the region are read.
+    poobah_sig -- for outputs saved with run_pipeline(deferred_masking=True): values whose poobah p-value is
+        >= poobah_sig become NaN (up to 0.254, with 3 decimals). None (default) leaves them as saved.
+    quality_mask -- for outputs saved with deferred_masking=True: if True, probes in sesame's quality mask become NaN.
+
+    - npy block stores (file_format='npy') are memory-mapped, and only the blocks holding the requested samples are
+      opened.
+    - parquet files are read with column projection, and filtered on the probe index; row groups whose min/max
+      statistics exclude all requested probes are skipped.
+    - feather files are memory-mapped, and only the requested columns are read.
+    - pickles must be loaded whole, then subset.
+    Batch parts that were never merged (beta_values_1.pkl, beta_values_2.pkl, ...) are read like one file.
+    Betas saved with run_pipeline(quantize_betas=True) are decoded to float32, and intensities saved with
+    masked_uint16=True get their missing values back as NaN.
+    Requested probes or samples that are not in the files are left out, with a warning. Rows and columns
+    follow the order of the probes and samples requested.
+    The deferred masks (poobah_codes, quality_mask_values) are read for the same probes and samples only.
+    """
+    file_stem = VALUE_KINDS.get(kind, kind)
+    files = _find_value_files(data_dir, file_stem)
+    if files == []:
+        raise FileNotFoundError(f"No {file_stem} files found in {data_dir}")
+    probes = None if probes is None else list(probes)
+    samples = None if samples is None else list(samples)
+    region = None if region is None else _parse_region(region)
+    frames = []
+    found_samples = set()
+    for filepath in files:
+        wanted = None if samples is None else [sample for sample in samples if sample not in found_samples]
+        if wanted == []:
+            break
+        df = _read_value_file(filepath, probes, wanted, region)
+        if df is None or df.shape[1] == 0:
+            continue
+        df = df.loc[:, ~df.columns.isin(list(found_samples))] # a sample in both a merged file and a part is read once
+        df = decode_values(df, file_stem)
+        found_samples.update(df.columns)
+        frames.append(df)
+    if frames == []:
+        LOGGER.warning(f"None of the requested samples are in {file_stem}")
+        return pd.DataFrame()
+    data = frames[0] if len(frames) == 1 else pd.concat(frames, axis='columns', join='inner')
+    if samples is not None:
+        missing = [sample for sample in samples if sample not in found_samples]
+        if missing:
+            LOGGER.warning(f"{len(missing)} samples not found in {file_stem}: {missing[:5]}")
+        data = data[[sample for sample in samples if sample in found_samples]]
+    if probes is not None:
+        found = set(data.index)
+        missing = set(probes) - found
+        if missing:
+            LOGGER.warning(f"{len(missing)} probes not found in {file_stem}")
+        data = data.reindex([probe for probe in probes if probe in found])
+    if poobah_sig is not None or quality_mask:
+        data = _apply_deferred_masks(data_dir, data, poobah_sig, quality_mask, region)
+    return data
+
+
+def _apply_deferred_masks(data_dir, data, poobah_sig=None, quality_mask=None, region=None):
+    """Sets values to NaN where the saved poobah p-value codes are >= poobah_sig, or the saved quality mask is
+    True. Probes or samples missing from the mask files are left as they are."""
+    has_codes = _find_value_files(data_dir, PVALUE_CODES_FILE) != []
+    has_mask = _find_value_files(data_dir, QUALITY_MASK_FILE) != []
+    if not (has_codes or has_mask):
+        raise FileNotFoundError(f"No {PVALUE_CODES_FILE} or {QUALITY_MASK_FILE} files in {data_dir}; poobah_sig and "
+            "quality_mask need outputs saved with run_pipeline(deferred_masking=True)")
+    masked = np.zeros(data.shape, dtype=bool)
+    probes = list(data.index)
+    samples = list(data.columns)
+    if poobah_sig is not None:
+        if not has_codes:
+            raise FileNotFoundError(f"No {PVALUE_CODES_FILE} files in {data_dir}; poobah was not run")
+        codes = load_values(data_dir, PVALUE_CODES_FILE, probes=probes, samples=samples, region=region)
+        codes = codes.reindex(index=data.index, columns=data.columns, fill_value=UINT8_NAN)
+        masked |= pvalue_mask(codes.to_numpy(), poobah_sig)
+    if quality_mask and not has_mask:
+        # arrays without sesame's quality mask (like 27k) have nothing to apply, as when processing
+        LOGGER.warning(f"No {QUALITY_MASK_FILE} files in {data_dir}, so no probes are quality-masked")
+    elif quality_mask:
+        mask = load_values(data_dir, QUALITY_MASK_FILE, probes=probes, samples=samples, region=region)
+        masked |= mask.reindex(index=data.index, columns=data.columns, fill_value=False).to_numpy(dtype=bool)
+    if not masked.any():
+        return data
+    return data.mask(masked)
+
+
+def _find_value_files(data_dir, file_stem):
+    """The merged file, then any batch parts in batch order, for the first file format found in data_dir."""
+    part_pattern = re.compile(rf"^{re.escape(file_stem)}_(\d+)$")
+    for suffix in SUFFIXES:
+        merged = Path(data_dir, f"{file_stem}.{suffix}")
+        parts = []
+        for path in Path(data_dir).glob(f"{file_stem}_*.{suffix}"):
+            match = part_pattern.match(path.name[:-len(suffix)-1])
+            if match:
+                parts.append((int(match.group(1)), path))
+        files = ([merged] if merged.exists() else []) + [path for _, path in sorted(parts)]
+        if files:
+            return files
+    return []
+
+
+def _parse_region(region):
+    """Returns (chromosome, start, end) from 'chr7:1000-2000', '7', or a tuple; start and end may be None."""
+    if isinstance(region, str):
+        chromosome, _, span = region.replace(',', '').partition(':')
+        start, _, end = span.partition('-')
+        region = (chromosome, int(start) if start else None, int(end) if end else None)
+    chromosome, start, end = (tuple(region) + (None, None))[:3]
+    return str(chromosome), start, end
+
+
+def _region_filters(region):
+    chromosome, start, end = region
+    # manifests name chromosomes like '7' (human) or 'chr7' (mouse)
+    names = [chromosome, chromosome[3:] if chromosome.startswith('chr') else f"chr{chromosome}"]
+    filters = [('CHR', 'in', names)]
+    if start is not None:
+        filters.append(('MAPINFO', '>=', start))
+    if end is not None:
+        filters.append(('MAPINFO', '<=', end))
+    return filters
+
+
+def _read_value_file(filepath, probes=None, samples=None, region=None):
+    """Reads one output file or part, subset to probes, samples, and a genomic region (if these are not None).
+    Returns a dataframe indexed by probe name only."""
+    if region is not None and filepath.suffix != '.parquet':
+        raise ValueError(f"region queries need parquet files saved with by_position=True, not {filepath.name}")
+    if filepath.name.endswith(MATRIX_STORE_SUFFIX):
+        store = MatrixStore(filepath)
+        if samples is not None:
+            stored = set(store.samples)
+            samples = [sample for sample in samples if sample in stored]
+            if samples == []:
+                return None
+        if probes is not None:
+            probes = store.probes.intersection(probes, sort=False)
+        return store.to_frame(probes=probes, samples=samples)
+
+    if filepath.suffix == '.parquet':
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(filepath)
+        index_columns = [col for col in (schema.pandas_metadata or {}).get('index_columns', []) if isinstance(col, str)]
+        columns = None
+        if samples is not None:
+            columns = [sample for sample in samples if sample in schema.names]
+            if columns == []:
+                return None
+            columns = columns + index_columns
+        filters = []
+        if probes is not None and index_columns:
+            filters.append((index_columns[0], 'in', list(probes)))
+        if region is not None:
+            if 'CHR' not in index_columns:
+                raise ValueError(f"region queries need parquet files saved with by_position=True; "
+                                 f"{filepath.name} has no CHR")
+            filters.extend(_region_filters(region))
+        table = pq.read_table(filepath, columns=columns, filters=filters or None)
+        df = table.to_pandas()
+        if isinstance(df.index, pd.MultiIndex): # CHR and MAPINFO levels, from by_position=True
+            df.index = df.index.get_level_values(0)
+        if probes is not None and not index_columns:
+            df = df[df.index.isin(probes)]
+        return df
+
+    if filepath.suffix == '.feather':
+        import pyarrow.feather as feather
+        table = feather.read_table(filepath, memory_map=True) # nothing is read until columns are used
+        if samples is not None:
+            index_columns = [col for col in (table.schema.pandas_metadata or {}).get('index_columns', [])
+                             if isinstance(col, str)]
+            columns = [sample for sample in samples if sample in table.schema.names]
+            if columns == []:
+                return None
+            table = table.select(columns + index_columns)
+        df = table.to_pandas()
+        if probes is not None:
+            df = df[df.index.isin(probes)]
+        return df
+
+    df = pd.read_pickle(filepath)
+    if samples is not None:
+        df = df[[sample for sample in samples if sample in df.columns]]
+    if probes is not None:
+        df = df[df.index.isin(probes)]
+    return df
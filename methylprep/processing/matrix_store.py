@@ -0,0 +1,166 @@
+# Lib
+import json
+import logging
+import os
+import shutil
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+__all__ = ['MatrixStore', 'MATRIX_STORE_SUFFIX']
+
+LOGGER = logging.getLogger(__name__)
+
+MATRIX_STORE_SUFFIX = 'npy_blocks'
+INDEX_FILENAME = 'index.json'
+STORE_FORMAT = 'methylprep.matrix_store'
+STORE_VERSION = 1
+
+
+class MatrixStore():
+    """An output matrix (probes in rows, samples in columns) saved as a folder of .npy blocks, so that
+    downstream code can memory-map it and read a few samples or probes without loading the whole thing.
+
+    Layout, for `beta_values.npy_blocks/`:
+        index.json -- probe names (in row order), the index name, and for each block its file and sample names
+        block_0001.npy, ... -- probes x samples arrays, one per batch of samples, saved in column (Fortran) order
+            so that each sample's values are contiguous on disk.
+
+    Every block has the same probes, in the same order. Blocks keep their own dtype (noob intensities are uint16
+    when there are no missing values), and reading across blocks upcasts to a common dtype.
+
+    MatrixStore(path) opens an existing store; MatrixStore.save(df, path) creates one.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(Path(self.path, INDEX_FILENAME), 'r') as index_file:
+            index = json.load(index_file)
+        if index.get('format') != STORE_FORMAT:
+            raise ValueError(f"{self.path} is not a methylprep matrix store")
+        self.index_name = index.get('index_name')
+        self.probes = pd.Index(index['probes'], name=self.index_name)
+        self.blocks = index['blocks']
+
+    def __repr__(self):
+        return (f"MatrixStore({self.path}, {len(self.probes)} probes x {len(self.samples)} samples, "
+                f"{len(self.blocks)} blocks)")
+
+    @property
+    def samples(self):
+        return [sample for block in self.blocks for sample in block['samples']]
+
+    @property
+    def shape(self):
+        return (len(self.probes), len(self.samples))
+
+    @classmethod
+    def save(cls, df, path, block_size=None):
+        """Saves df (probes x samples) as a new store at path, replacing any existing store there.
+        block_size limits the number of samples per block file (default: one block)."""
+        path = Path(path)
+        if path.exists():
+            shutil.rmtree(path)
+        path.mkdir(parents=True)
+        cls._write_index(path, df.index.name, list(df.index), [])
+        store = cls(path)
+        store.append(df, block_size=block_size)
+        return store
+
+    @staticmethod
+    def _write_index(path, index_name, probes, blocks):
+        temp_path = Path(path, f"_{INDEX_FILENAME}.tmp")
+        with open(temp_path, 'w') as index_file:
+            json.dump({'format': STORE_FORMAT, 'version': STORE_VERSION, 'index_name': index_name,
+                'probes': [str(probe) for probe in probes], 'blocks': blocks}, index_file)
+        os.replace(temp_path, Path(path, INDEX_FILENAME))
+
+    def _next_block_filename(self):
+        numbers = [int(block['file'][len('block_'):-len('.npy')]) for block in self.blocks]
+        return f"block_{max(numbers, default=0) + 1:04d}.npy"
+
+    def append(self, df, block_size=None):
+        """Adds df's samples (columns) as new block(s). Rows are aligned to the store's probes: probes not in the
+        store are dropped and probes missing from df are NaN. Samples already in the store are skipped."""
+        new_samples = [col for col in df.columns if col not in set(self.samples)]
+        if new_samples == []:
+            return []
+        df = df[new_samples]
+        if not df.index.equals(self.probes):
+            df = df.reindex(self.probes)
+        block_size = block_size or len(new_samples)
+        added = []
+        for start in range(0, len(new_samples), block_size):
+            part = df.iloc[:, start:start+block_size]
+            filename = self._next_block_filename()
+            np.save(Path(self.path, filename), np.asfortranarray(part.to_numpy()))
+            self.blocks.append({'file': filename, 'samples': [str(col) for col in part.columns],
+                'dtype': str(part.to_numpy().dtype)})
+            added.append(filename)
+        self._write_index(self.path, self.index_name, self.probes, self.blocks)
+        return added
+
+    def merge(self, other):
+        """Moves the blocks of another store into this one (the other store is removed). If both have the same
+        probes, no data is copied; otherwise the other store's blocks are rewritten to this store's probes."""
+        other = other if isinstance(other, MatrixStore) else MatrixStore(other)
+        if other.probes.equals(self.probes):
+            known = set(self.samples)
+            for block in other.blocks:
+                if set(block['samples']) & known:
+                    self.append(other.read_block(block))
+                    continue
+                filename = self._next_block_filename()
+                os.replace(Path(other.path, block['file']), Path(self.path, filename))
+                self.blocks.append({**block, 'file': filename})
+            self._write_index(self.path, self.index_name, self.probes, self.blocks)
+        else:
+            for block in other.blocks:
+                self.append(other.read_block(block))
+        shutil.rmtree(other.path)
+
+    def read_block(self, block, mmap_mode='r'):
+        """One block as a probes x samples DataFrame, backed by a read-only memory-map of its file."""
+        return pd.DataFrame(self.memmap(block, mmap_mode), index=self.probes, columns=block['samples'], copy=False)
+
+    def memmap(self, block, mmap_mode='r'):
+        """The numpy memmap for a block (probes x samples)."""
+        return np.load(Path(self.path, block['file']), mmap_mode=mmap_mode)
+
+    def to_frame(self, probes=None, samples=None):
+        """Reads the store, or only the given probes and/or samples, into a DataFrame. Only the blocks holding
+        the requested samples are opened, and only the requested rows are read from them."""
+        if samples is not None:
+            samples = list(samples)
+            wanted = set(samples)
+            missing = wanted - set(self.samples)
+            if missing:
+                raise KeyError(f"samples not in {self.path.name}: {sorted(missing)[:5]}")
+            blocks = [block for block in self.blocks if wanted & set(block['samples'])]
+        else:
+            blocks = self.blocks
+        if probes is not None:
+            rows = self.probes.get_indexer(list(probes))
+            if (rows == -1).any():
+                raise KeyError(f"{int((rows == -1).sum())} probes not in {self.path.name}")
+            index = self.probes[rows]
+        else:
+            rows = slice(None)
+            index = self.probes
+        dtype = np.result_type(*[np.dtype(block['dtype']) for block in blocks]) if blocks else np.float32
+        columns = [sample for block in blocks for sample in block['samples'] if samples is None or sample in wanted]
+        values = np.empty((len(index), len(columns)), dtype=dtype, order='F')
+        col = 0
+        for block in blocks:
+            block_values = self.memmap(block)
+            if samples is None:
+                block_cols = list(range(len(block['samples'])))
+            else:
+                block_cols = [num for num, sample in enumerate(block['samples']) if sample in wanted]
+            for block_col in block_cols:
+                values[:, col] = block_values[rows, block_col] # one contiguous column read per sample
+                col += 1
+            del block_values
+        df = pd.DataFrame(values, index=index, columns=columns, copy=False)
+        return df[samples] if samples is not None else df
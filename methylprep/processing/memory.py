@@ -0,0 +1,128 @@
+# Lib
+import logging
+import os
+import re
+import numpy as np
+try:
+    import psutil # optional; /proc/self/statm is used otherwise (linux)
+except ImportError:
+    psutil = None
+# App
+from ..files import IdatDataset
+from ..models import ArrayType, Channel
+
+
+__all__ = ['MemoryBudget', 'parse_memory_size', 'current_rss', 'array_type_from_idat']
+
+LOGGER = logging.getLogger(__name__)
+
+MEMORY_UNITS = {'': 1, 'B': 1, 'K': 1024, 'KB': 1024, 'M': 1024**2, 'MB': 1024**2,
+    'G': 1024**3, 'GB': 1024**3, 'T': 1024**4, 'TB': 1024**4}
+
+
+def parse_memory_size(value):
+    """Converts a memory size like 8000000000, '8GB', '8G', or '500 MB' into bytes (powers of 1024)."""
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+    match = re.fullmatch(r'\s*([0-9.]+)\s*([a-zA-Z]*)\s*', str(value))
+    if not match or match.group(2).upper() not in MEMORY_UNITS:
+        raise ValueError(f"max_memory must be a number of bytes or a size like '8GB' or '500MB', not {value}")
+    return int(float(match.group(1)) * MEMORY_UNITS[match.group(2).upper()])
+
+
+def current_rss():
+    """Resident memory (bytes) of this process right now, or None if it cannot be measured on this platform."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm', 'r') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class MemoryBudget():
+    """Picks a run_pipeline batch_size that keeps processing within max_memory, and shrinks it if the
+    measured memory use (RSS) goes over budget.
+
+    Arguments:
+        max_memory {int or str} -- the budget, in bytes or as a string like '16GB'.
+        array_type {ArrayType or str} -- used to look up the number of probes per sample (ArrayType.num_probes).
+        bit {str} -- float16, float32, or float64; the dtype of the processed values held for each sample.
+        num_columns {int} -- columns retained per probe in each sample's processed data_frame
+            (noob meth/unmeth, beta, m_value, poobah p-value, quality_mask, plus raw meth/unmeth if saved).
+        num_exports {int} -- number of matrix output files (beta_values, noob_meth_values, ...) built for each batch.
+
+    Notes:
+        Every sample in a batch is held in memory until the batch's output files are written, so memory grows
+        with batch size. On top of that, one sample is read and processed at a time (IDATs, probe subsets) and
+        the manifest is loaded; these don't depend on batch size and are counted as a fixed overhead.
+        The estimates are deliberately rough; `observe()` corrects them using the measured RSS after each batch.
+    """
+    # bytes per probe, roughly: the manifest data_frame, and one fully-loaded sample during processing.
+    MANIFEST_BYTES_PER_PROBE = 500
+    PROCESSING_BYTES_PER_PROBE = 700
+    # each retained sample also keeps its probe index, float64 p-values, and small per-sample probe subsets.
+    # (measured: ~100MB per 450k sample at float32, with low_memory=True)
+    RETAINED_BYTES_PER_PROBE = 170
+
+    def __init__(self, max_memory, array_type, bit='float32', num_columns=6, num_exports=3):
+        self.max_bytes = parse_memory_size(max_memory)
+        array_type = ArrayType(array_type) if isinstance(array_type, str) else array_type
+        # custom manifests have no fixed probe count; assume the largest array.
+        self.num_probes = getattr(array_type, 'num_probes', None) or ArrayType.ILLUMINA_EPIC_PLUS.num_probes
+        itemsize = np.dtype(bit).itemsize
+        self.per_sample = self.num_probes * (num_columns * itemsize + self.RETAINED_BYTES_PER_PROBE)
+        if num_exports > 0:
+            # each output matrix is built as float32, and sorted/cast into a copy before saving.
+            self.per_sample += self.num_probes * 4 * 2
+        self.fixed = self.num_probes * (self.MANIFEST_BYTES_PER_PROBE + self.PROCESSING_BYTES_PER_PROBE)
+        self.baseline = current_rss() or 0
+        self.batch_size = None
+
+    def available(self):
+        return self.max_bytes - self.baseline - self.fixed
+
+    def fits(self, num_samples):
+        """True if num_samples fit in the budget at once (e.g. to return all SampleDataContainers at the end)."""
+        return num_samples * self.per_sample <= self.available()
+
+    def get_batch_size(self):
+        available = self.available()
+        if available < self.per_sample:
+            needed = self.baseline + self.fixed + self.per_sample
+            LOGGER.warning(f"max_memory ({self.max_bytes/1024**2:.0f} MB) is less than the estimated memory to "
+                f"process one sample ({needed/1024**2:.0f} MB); processing one sample per batch.")
+            self.batch_size = 1
+        else:
+            self.batch_size = int(available // self.per_sample)
+        return self.batch_size
+
+    def observe(self, num_samples):
+        """Call after processing a batch of num_samples, while they are still in memory. If the process RSS went over
+        max_memory, the per-sample estimate is raised to match and a smaller batch_size is returned; otherwise the
+        current batch_size is returned."""
+        rss = current_rss()
+        if rss is None or rss <= self.max_bytes or num_samples == 0:
+            return self.batch_size
+        measured_per_sample = (rss - self.baseline - self.fixed) / num_samples
+        previous = self.batch_size
+        if measured_per_sample > self.per_sample:
+            self.per_sample = measured_per_sample
+            self.get_batch_size()
+        if self.batch_size >= previous:
+            # the overage came from somewhere other than the per-sample data (memory not yet returned to the OS, etc)
+            self.batch_size = max(1, previous // 2)
+        if self.batch_size < previous:
+            LOGGER.warning(f"Memory use ({rss/1024**2:.0f} MB) exceeded max_memory ({self.max_bytes/1024**2:.0f} MB) "
+                f"with {num_samples} samples per batch; reducing batch_size to {self.batch_size}.")
+        else:
+            LOGGER.info(f"Memory use ({rss/1024**2:.0f} MB) exceeded max_memory ({self.max_bytes/1024**2:.0f} MB) "
+                "processing one sample per batch.")
+        return self.batch_size
+
+
+def array_type_from_idat(sample, bit='float32'):
+    """Reads one sample's green IDAT to identify the array type before any batches are processed."""
+    green_idat = IdatDataset(sample.get_filepath('idat', Channel.GREEN), channel=Channel.GREEN, bit=bit)
+    return ArrayType.from_probe_count(green_idat.n_snps_read)
@@ -1,14 +1,15 @@
-try:
-    from methylcheck import mean_beta_compare
-except ImportError:
-    mean_beta_compare = None
 import types
-from scipy import stats
-from statsmodels.distributions.empirical_distribution import ECDF
 import pandas as pd
 import numpy as np
 
 
+def ECDF(values):
+    """statsmodels' empirical cumulative distribution function. statsmodels is slow to import, so this waits
+    until the first p-values are calculated."""
+    from statsmodels.distributions.empirical_distribution import ECDF as _ECDF
+    return _ECDF(values)
+
+
 def _pval_sesame_preprocess(data_container, combine_neg=True):
     """Performs p-value detection of low signal/noise probes. This ONE SAMPLE version uses meth/unmeth before it is contructed into a _SampleDataContainer__data_frame.
     - returns a dataframe of probes and their detected p-value levels.
@@ -131,6 +132,10 @@ Returns:
     else:
         pval = pval_sesame(data_containers)
 
+    try:
+        from methylcheck import mean_beta_compare # only used to plot the result
+    except ImportError:
+        mean_beta_compare = None
     if silent == False and type(mean_beta_compare) is types.FunctionType:
         # plot it
         # df1 and df2 are probe X sample_id matrices
@@ -139,6 +144,7 @@ Returns:
 
 
 def _pval_minfi(data_containers):
+    from scipy import stats
     # negative control p-value
     # Pull M and U values
     meth = pd.DataFrame(data_containers[0]._SampleDataContainer__data_frame.index)
@@ -5,8 +5,10 @@ import pandas as pd
 from ..utils.progress_bar import * # checks environment and imports tqdm appropriately.
 from collections import Counter
 from pathlib import Path
+import os
 import pickle
 import sys
+from contextlib import nullcontext
 # App
 from ..files import Manifest, get_sample_sheet, create_sample_sheet
 from ..models import (
@@ -24,18 +26,44 @@ from .postprocess import (
     calculate_copy_number,
     consolidate_values_for_sheet,
     one_sample_control_snp,
-    consolidate_mouse_probes,
+    mouse_probe_design,
+    MOUSE_FILE_TYPES,
+    MOUSE_DESIGN_FILE,
     merge_batches,
+    existing_sample_ids,
+    sort_by_position,
+    control_table,
+    save_control_table,
+    write_feather,
+    read_feather,
+    _write_parquet_in_row_groups,
 )
 from ..utils import ensure_directory_exists, is_file_like
 from .preprocess import preprocess_noob, _apply_sesame_quality_mask
 from .p_value_probe_detection import _pval_sesame_preprocess, _pval_neg_ecdf
 from .infer_channel_switch import infer_type_I_probes
+from .plan import compile_plan
 from .dye_bias import nonlinear_dye_bias_correction
 from .multi_array_idat_batches import check_array_folders
+from .journal import RunJournal
+from .memory import MemoryBudget, array_type_from_idat
+from .spill import SpillStore
+from .stage_cache import StageCache, manifest_key, sigset_state, restore_sigset_state
+from .matrix_store import MatrixStore, MATRIX_STORE_SUFFIX
+from .encoding import (
+    encode_betas,
+    encode_intensities,
+    encode_pvalues,
+    encode_quality_mask,
+    PVALUE_CODES_FILE,
+    QUALITY_MASK_FILE,
+)
+from .export import ExportWriter, DatasetWriter, write_export, EXPORT_FORMATS
+from .profiling import RunProfiler
 
 
-__all__ = ['SampleDataContainer', 'run_pipeline', 'consolidate_values_for_sheet', 'make_pipeline']
+__all__ = ['SampleDataContainer', 'SpilledSampleDataContainer', 'run_pipeline', 'consolidate_values_for_sheet',
+    'make_pipeline']
 
 LOGGER = logging.getLogger(__name__)
 
@@ -46,7 +74,11 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
                  save_uncorrected=False, save_control=True, meta_data_frame=True,
                  bit='float32', poobah=False, export_poobah=False,
                  poobah_decimals=3, poobah_sig=0.05, low_memory=True,
-                 sesame=True, quality_mask=None, pneg_ecdf=False, file_format='pickle', **kwargs):
+                 sesame=True, quality_mask=None, pneg_ecdf=False,
+                 file_format='pickle', resume=False, append=False, max_memory=None,
+                 quantize_betas=False, masked_uint16=False, deferred_masking=False,
+                 by_position=False, row_group_size=100000, parquet_compression='snappy',
+                 export_format=None, profile=False, **kwargs):
     """The main CLI processing pipeline. This does every processing step and returns a data set.
 
     Required Arguments:
@@ -65,6 +97,17 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
         sample_name [optional, list]
             if you don't want to process all samples, you can specify individual samples as a list.
             if sample_names are specified, this will not also do batch sizes (large batches must process all samples)
+        resume [default: False]
+            if True, batches that finished in a previous (interrupted) run of the same data_dir and settings are
+            skipped, and their saved parts are merged with the rest. Progress is tracked in `_run_journal.json`
+            in data_dir, which is updated after every batch and removed once the run completes.
+            From CLI pass in "--resume".
+        append [default: False]
+            if True, only samples that are not already in data_dir's output files (beta_values, noob_meth_values, etc)
+            are processed, and these are appended as new columns to the existing files, along with
+            sample_sheet_meta_data and control_probes. Useful for a cohort that grows over time; with parquet
+            files the existing matrices are streamed instead of fully loaded. Returns only the new samples' data.
+            From CLI pass in "--append".
 
     Optional processing arguments:
         sesame [default: True]
@@ -78,6 +121,14 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
             if set to any integer, samples will be processed and saved in batches no greater than
             the specified batch size. This will yield multiple output files in the format of
             "beta_values_1.pkl ... beta_values_N.pkl".
+        max_memory [optional]
+            a memory budget for processing, in bytes or as a string like '16GB'. Instead of guessing a batch_size,
+            this estimates the memory needed per sample (from the array's probe count, `bit`, and the output files
+            requested) and picks the largest batch_size that fits. If a batch_size is also given, the smaller one is
+            used. After each batch the process memory (RSS) is measured, and later batches are made smaller if it went
+            over budget.
+            If all samples won't fit in the budget at once, files are saved but nothing is returned.
+            From CLI pass in "--max_memory 16GB".
         bit [default: float32]
             You can change the processed output files to one of: {float16, float32, float64}.
             This will make files & memory usage smaller, often with no loss in precision.
@@ -96,10 +147,53 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
             if True, saves a file, "sample_sheet_meta_data.pkl" with samplesheet info.
         export [default: False]
             if True, exports a CSV of the processed data for each idat file in sample.
-        file_format [default: pickle; optional: parquet]
+        export_format [default: csv, or parquet/feather if file_format is parquet/feather]
+            file type of the exported per-sample files: 'csv', 'csv.gz' (gzipped CSV), 'parquet', or 'feather'
+            (Arrow IPC, fastest to write and read). These are written on background threads.
+            'dataset' writes all samples to one long-format parquet dataset instead, in data_dir/processed_dataset/,
+            with a partition per batch, one row per sample and probe, and a dictionary-encoded sample_id column.
+        file_format [default: pickle; optional: parquet, npy, feather]
             Matrix style files are faster to load and process than CSVs, and python supports two
             types of binary formats: pickle and parquet. Parquet is readable by other languages,
             so it is an option starting v1.7.0.
+            'npy' saves each probes x samples matrix (beta_values, m_values, noob_meth_values, ...) as a
+            folder of memory-mappable .npy blocks with a JSON index of probe and sample names, like
+            `beta_values.npy_blocks/`; open these with methylprep.processing.MatrixStore to read a few samples
+            or probes without loading the whole matrix. Other outputs are still pickled.
+            'feather' saves every output (matrices, sample_sheet_meta_data, control_probes) as an
+            uncompressed Arrow IPC file, readable from other languages and memory-mappable with zero-copy columns:
+            pyarrow.feather.read_table(path, memory_map=True). control_probes is a long table
+            with Sentrix_ID and IlmnID columns, as with parquet.
+        by_position [default: False]
+            parquet only: saves the probes x samples matrices ordered by chromosome and MAPINFO, with CHR and
+            MAPINFO as extra index levels from the manifest. Row groups never span two chromosomes, so region
+            queries (methylprep.load_values(..., region='7:27000000-27300000')) only read the matching row groups.
+        row_group_size [default: 100000]
+            parquet only: the maximum number of probes per row group.
+        parquet_compression [default: snappy]
+            parquet only: the compression codec, such as 'snappy', 'zstd', 'gzip', or 'none'.
+        quantize_betas [default: False]
+            if True, beta_values are saved as 16-bit fixed-point integers (beta x 65534, with 65535 for missing
+            values) instead of float32, halving their size on disk and in memory. Precision is about 0.00002.
+            methylprep.load_values() decodes these back to float32; pd.read_pickle() returns the raw integers.
+            Use the same setting when appending to existing outputs.
+        masked_uint16 [default: False]
+            Intensity matrices (noob_meth_values, meth_values, ...) are uint16 only if no probes are missing;
+            otherwise these are float32. If True, they stay uint16 (2 bytes per value) with 65535 marking missing
+            (poobah- or quality-masked) probes, and intensities clipped to 65534. methylprep.load_values()
+            restores the NaNs.
+        deferred_masking [default: False]
+            if True, probes are not removed (set to NaN) by poobah or the quality mask in the beta, m, and noob
+            matrices. Instead, each probe's poobah p-value is saved in poobah_codes (uint8: 0.001 steps up to 0.254)
+            and the quality mask in quality_mask_values (True = masked; stored as bits in parquet and feather),
+            so methylprep.load_values(data_dir, 'beta', poobah_sig=0.01, quality_mask=True) applies any threshold
+            or combination when reading, without reprocessing. The betas or m_values returned are unmasked too, like
+            the saved files. Use the same setting when appending.
+        profile [default: False]
+            if True, records the wall time, CPU time, and memory (RSS, and python allocations if tracemalloc is
+            tracing) of each stage -- reading idats, the manifest, each sample's poobah, noob, dye bias, etc.,
+            saving each file, merging -- per batch and per sample, as json lines in data_dir/methylprep_profile.jsonl.
+            methylprep.processing.profiling.summarize_profile(read_profile(data_dir)) totals these by stage.
         save_uncorrected [default: False]
             if True, adds two additional columns to the processed.csv per sample (meth and unmeth),
             representing the raw fluorescence intensities for all probes.
@@ -119,7 +213,9 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
         poobah_decimals [default: 3]
             The number of decimal places to round p-value column in the processed CSV output files.
         mouse probes
-            Mouse-specific will be saved if processing a mouse array.
+            Mouse-specific will be saved if processing a mouse array, as probes x samples matrices like the main
+            outputs (mouse_beta_values, mouse_m_values, mouse_cm_values, mouse_noob_meth_values,
+            mouse_noob_unmeth_values), in file_format. Each probe's `design` is saved once, in mouse_probe_design.
 
     Optional final estimators:
         betas
@@ -142,6 +238,7 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
         m_value
             if True, will return a single data frame of m_factor values instead of a list of SampleDataContainer objects.
             Format is a "wide matrix": columns contain probes and rows contain samples.
+        The betas or m_values are in the `bit` dtype (float32 by default; see consolidate_values_for_sheet).
         if batch_size is set to more than ~600 samples, nothing is returned but all the files are saved. You can recreate/merge output files by loading the files using methylcheck.load().
 
     Processing notes:
@@ -168,7 +265,7 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
     do_nonlinear_dye_bias = True # defaults to sesame(True), but can be False (linear) or None (omit step)
     do_save_noob = None
     do_mouse = True
-    hidden_kwargs = ['pipeline_steps', 'pipeline_exports', 'debug']
+    hidden_kwargs = ['pipeline_steps', 'pipeline_exports', 'pipeline_plan', 'stage_cache', 'debug']
     if kwargs != {}:
         for kwarg in kwargs:
             if kwarg not in hidden_kwargs:
@@ -227,9 +324,23 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
         except AttributeError():
             LOGGER.error("parquet is not installed in your environment; reverting to pickle format")
             file_format = 'pickle'
-    suffix = 'parquet' if file_format == 'parquet' else 'pkl'
+    if file_format not in ('pickle', 'parquet', 'npy', 'feather'):
+        raise ValueError("Input 'file_format' must be one of ('pickle', 'parquet', 'npy', 'feather').")
+    export_format = export_format or (file_format if file_format in ('parquet', 'feather') else 'csv')
+    if export_format not in EXPORT_FORMATS and export_format != 'dataset':
+        raise ValueError(f"Input 'export_format' must be one of {tuple(EXPORT_FORMATS) + ('dataset',)}.")
+    if by_position and file_format != 'parquet':
+        LOGGER.warning("by_position only applies to file_format='parquet'; ignoring it.")
+        by_position = False
+    suffix = {'parquet': 'parquet', 'npy': MATRIX_STORE_SUFFIX, 'feather': 'feather'}.get(file_format, 'pkl')
+    # sample sheet meta data, control probes and the mouse probe design are tables rather than
+    # probes x samples matrices; with file_format='npy' these are still pickled.
+    table_suffix = file_format if file_format in ('parquet', 'feather') else 'pkl'
 
     LOGGER.info('Running pipeline in: %s', data_dir)
+    # a disabled profiler's stages do nothing; its records are in data_dir/methylprep_profile.jsonl otherwise.
+    profiler = RunProfiler(data_dir, enabled=profile, append=resume)
+    run_token = profiler.start('run')
     if bit not in ('float64','float32','float16'):
         raise ValueError("Input 'bit' must be one of ('float64','float32','float16') or ommitted.")
     if sample_name:
@@ -267,6 +378,26 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
             unmatched_samples = [_sample for _sample in sample_name if _sample not in possible_sample_names]
             raise SystemExit(f"Your sample_name filter does not match the samplesheet; these samples were not found: {unmatched_samples}")
 
+    # append mode: skip samples already saved in the output files from an earlier run.
+    skip_sample_ids = existing_sample_ids(data_dir, file_format) if append else set()
+    if append:
+        LOGGER.info(f"Found {len(skip_sample_ids)} samples already processed in {data_dir}; these will be skipped.")
+
+    budget = None
+    if max_memory:
+        if array_type is None:
+            array_type = array_type_from_idat(samples[0], bit=bit)
+        num_exports = sum([bool(betas), bool(m_value), 2*bool(do_save_noob is not False or betas or m_value),
+            2*bool(save_uncorrected), bool(export_poobah)])
+        budget = MemoryBudget(max_memory, array_type, bit=bit, num_exports=num_exports,
+            num_columns=6 + 2*bool(save_uncorrected) + bool(pneg_ecdf))
+        auto_batch_size = min(budget.get_batch_size(), len(samples))
+        if batch_size and batch_size < auto_batch_size:
+            budget.batch_size = batch_size
+        else:
+            batch_size = budget.batch_size = auto_batch_size
+        LOGGER.info(f"max_memory {max_memory}: processing up to {batch_size} samples per batch")
+
     batches = []
     batch = []
     sample_id_counter = 1
@@ -276,6 +407,8 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
         for sample in samples:
             if sample_name and sample.name not in sample_name:
                 continue
+            if f"{sample.sentrix_id}_{sample.sentrix_position}" in skip_sample_ids:
+                continue
 
             # batch uses Sample_Name, so ensure these exist
             if sample.name in (None,''):
@@ -292,11 +425,14 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
                 batches.append(batch)
                 batch = []
                 batch.append(sample.name)
-        batches.append(batch)
+        if batch != []:
+            batches.append(batch)
     else:
         for sample in samples:
             if sample_name and sample.name not in sample_name:
                 continue
+            if f"{sample.sentrix_id}_{sample.sentrix_position}" in skip_sample_ids:
+                continue
 
             # batch uses Sample_Name, so ensure these exist
             if sample.name in (None,''):
@@ -308,26 +444,84 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
                 sample_id_counter += 1
 
             batch.append(sample.name)
-        batches.append(batch)
+        if batch != []:
+            batches.append(batch)
+    if batches == [] and append:
+        LOGGER.warning(f"All samples in {data_dir} were already processed; nothing to append.")
+        profiler.stop(run_token)
+        return
 
     temp_data_pickles = []
-    control_snps = {}
+    spilled_batches = []
+    spill_store = SpillStore(data_dir, bit=bit)
+    # make_pipeline(cache=True) keeps each sample's intermediate stages in data_dir,
+    # for faster re-runs with other settings.
+    stage_cache = StageCache(data_dir) if kwargs.get('stage_cache') else None
+    temp_control_parts = []
     #data_containers = [] # returned when this runs in interpreter, and < 200 samples
     # v1.3.0 memory fix: save each batch_data_containers object to disk as temp, then load and combine at end.
     # 200 samples still uses 4.8GB of memory/disk space (float64)
     missing_probe_errors = {'noob': [], 'raw':[]}
+    export_writer = ExportWriter() if export and export_format != 'dataset' else None
+    dataset_writer = (DatasetWriter(data_dir, compression=parquet_compression, keep_existing=resume, append=append)
+                      if export and export_format == 'dataset' else None)
+
+    # the journal records finished batches, so an interrupted run can pick up where it left off.
+    journal_settings = {
+        'batches': [list(batch) for batch in batches], 'max_memory': max_memory, 'file_format': file_format,
+        'bit': bit, 'betas': betas, 'm_value': m_value,
+        'save_uncorrected': save_uncorrected, 'save_control': save_control, 'export': export,
+        'export_poobah': export_poobah, 'poobah': poobah, 'poobah_sig': poobah_sig, 'poobah_decimals': poobah_decimals,
+        'pneg_ecdf': pneg_ecdf, 'sesame': sesame, 'array_type': str(array_type) if array_type else None,
+        'manifest_filepath': str(manifest_filepath) if manifest_filepath else None, 'meta_data_frame': meta_data_frame,
+        'quality_mask': quality_mask, 'pipeline_steps': kwargs.get('pipeline_steps'),
+        'pipeline_exports': kwargs.get('pipeline_exports'), 'append': append, 'low_memory': low_memory,
+        'quantize_betas': quantize_betas, 'masked_uint16': masked_uint16, 'deferred_masking': deferred_masking,
+        'by_position': by_position, 'row_group_size': row_group_size, 'parquet_compression': parquet_compression,
+        'export_format': export_format,
+    }
+    journal = RunJournal.load(data_dir, journal_settings) if resume else RunJournal(data_dir, journal_settings)
 
     for batch_num, batch in enumerate(batches, 1):
-        idat_datasets = parse_sample_sheet_into_idat_datasets(sample_sheet, sample_name=batch, from_s3=None, meta_only=False, bit=bit) # replaces get_raw_datasets
+        pkl_name = f"_temp_data_{batch_num}.pkl"
+        # columnar formats keep each batch's control probes as a feather part of the final table;
+        # otherwise a pickled dict.
+        control_part_name = f"_temp_control_{batch_num}.{'feather' if file_format in ('parquet', 'feather') else 'pkl'}"
+        if resume and journal.is_complete(batch_num, batch):
+            LOGGER.info(f"Skipping batch {batch_num} of {len(batches)}; it finished in a previous run.")
+            if pkl_name in journal.artifacts(batch_num):
+                temp_data_pickles.append(pkl_name)
+            if spill_store.batch_filename(batch_num) in journal.artifacts(batch_num):
+                spilled_batches.append(batch_num)
+            if control_part_name in journal.artifacts(batch_num):
+                temp_control_parts.append(control_part_name)
+            continue
+        batch_token = profiler.start('batch', batch=batch_num)
+        batch_artifacts = []
+        batch_control_snps = {}
+
+        with profiler.stage('read_idats', batch=batch_num):
+            if stage_cache is not None:
+                # only reads IDATs that are not cached
+                idat_datasets = stage_cache.read_idat_datasets(sample_sheet, batch, bit=bit)
+            else:
+                # replaces get_raw_datasets
+                idat_datasets = parse_sample_sheet_into_idat_datasets(sample_sheet, sample_name=batch, from_s3=None,
+                    meta_only=False, bit=bit)
         # idat_datasets are a list; each item is a dict of {'green_idat': ..., 'red_idat':..., 'array_type', 'sample'} to feed into SigSet
         #--- pre v1.5 --- raw_datasets = get_raw_datasets(sample_sheet, sample_name=batch)
         if array_type is None: # use must provide either the array_type or manifest_filepath.
             array_type = get_array_type(idat_datasets)
-        manifest = Manifest(array_type, manifest_filepath) # this allows each batch to be a different array type; but not implemented yet. common with older GEO sets.
+        with profiler.stage('manifest', batch=batch_num):
+            # this allows each batch to be a different array type; but not implemented yet. common with older GEO sets.
+            manifest = Manifest(array_type, manifest_filepath)
+        manifest_cache_key = manifest_key(manifest, manifest_filepath) if stage_cache is not None else None
 
         batch_data_containers = []
         export_paths = set() # inform CLI user where to look
         for idat_dataset_pair in tqdm(idat_datasets, total=len(idat_datasets), desc="Processing samples"):
+            sample_id = f"{idat_dataset_pair['sample'].sentrix_id}_{idat_dataset_pair['sample'].sentrix_position}"
+            sample_token = profiler.start('sample', batch=batch_num, sample=sample_id)
             data_container = SampleDataContainer(
                 idat_dataset_pair=idat_dataset_pair,
                 manifest=manifest,
@@ -344,14 +538,27 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
                 sesame=sesame,
                 pneg_ecdf=pneg_ecdf,
                 file_format=file_format,
+                # make_pipeline computes only what it needs
+                outputs=(kwargs['pipeline_plan'].outputs if kwargs.get('pipeline_plan') else None),
+                cache=(stage_cache.for_sample(sample_id, idat_dataset_pair['cache_key'], manifest_cache_key)
+                       if stage_cache is not None else None),
+                profiler=(profiler if profile else None),
             )
             data_container.process_all()
-
-            if export: # as CSV or parquet
-                suffix = 'parquet' if file_format == 'parquet' else 'csv'
-                output_path = data_container.sample.get_export_filepath(extension=suffix)
-                data_container.export(output_path)
+            data_container.profiler = None # processed; the container is pickled or returned without it
+            profiler.stop(sample_token)
+
+            if export and dataset_writer is not None:
+                with profiler.stage('export', batch=batch_num, sample=sample_id):
+                    dataset_writer.write_sample(batch_num, sample_id, *data_container.prepare_export())
+                export_paths.add(str(Path(data_dir, dataset_writer.partition_file(batch_num))))
+            elif export: # as CSV, parquet, or feather; written in the background while the next sample is processed.
+                output_path = data_container.sample.get_export_filepath(extension=EXPORT_FORMATS[export_format])
+                # only the time to hand it to the writer, if there is one
+                with profiler.stage('export', batch=batch_num, sample=sample_id):
+                    data_container.export(output_path, export_format=export_format, writer=export_writer)
                 export_paths.add(output_path)
+                batch_artifacts.append(os.path.relpath(output_path, data_dir))
                 # this tidies-up the tqdm by moving errors to end of batch warning.
                 if data_container.noob_processing_missing_probe_errors != []:
                     missing_probe_errors['noob'].extend(data_container.noob_processing_missing_probe_errors)
@@ -359,9 +566,9 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
                     missing_probe_errors['raw'].extend(data_container.raw_processing_missing_probe_errors)
 
             if save_control: # Process and consolidate now. Keep in memory. These files are small.
-                sample_id = f"{data_container.sample.sentrix_id}_{data_container.sample.sentrix_position}"
-                control_df = one_sample_control_snp(data_container)
-                control_snps[sample_id] = control_df
+                with profiler.stage('control_snp', batch=batch_num, sample=sample_id):
+                    control_df = one_sample_control_snp(data_container)
+                batch_control_snps[sample_id] = control_df
 
             # now I can drop all the unneeded stuff from each SampleDataContainer (400MB per sample becomes 92MB)
             # these are stored in SampleDataContainer.__data_frame for processing.
@@ -387,48 +594,97 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
 
         if kwargs.get('debug'): LOGGER.info('[finished SampleDataContainer processing]')
 
-        def _prepare_save_out_file(df, file_stem, uint16=False):
-            out_name = f"{file_stem}_{batch_num}" if batch_size else file_stem
-            if uint16 and file_format != 'parquet':
+        def _prepare_save_out_file(df, file_stem, uint16=False, quantize=False, encoder=None):
+            # append mode always writes parts, so the existing (merged) output files are not overwritten.
+            out_name = f"{file_stem}_{batch_num}" if (batch_size or append) else file_stem
+            if encoder is not None:
+                df = encoder(df)
+            elif quantize:
+                df = encode_betas(df)
+            elif uint16 and masked_uint16:
+                df = encode_intensities(df)
+            elif uint16 and file_format != 'parquet':
                 df = df.astype('float32') if df.isna().sum().sum() > 0 else df.astype('uint16')
             else:
                 df = df.astype('float32')
-            if df.shape[1] > df.shape[0]:
+            if df.shape[1] > df.shape[0] and file_format != 'npy' and not by_position:
                 df = df.transpose() # put probes as columns for faster loading.
             # sort sample names
             df = df.sort_index().reindex(sorted(df.columns), axis=1)
-            if file_format == 'parquet':
-                # put probes in rows; format is optimized for same-type storage so it won't really matter
-                df.to_parquet(Path(data_dir,f"{out_name}.parquet"))
-            else:
-                df.to_pickle(Path(data_dir, f"{out_name}.pkl"))
+            with profiler.stage('write', batch=batch_num, file=file_stem):
+                if file_format == 'parquet':
+                    # put probes in rows; format is optimized for same-type storage so it won't really matter
+                    if by_position:
+                        df = sort_by_position(df, manifest.data_frame)
+                    _write_parquet_in_row_groups(df, Path(data_dir,f"{out_name}.parquet"), row_group_size,
+                                                 compression=parquet_compression)
+                elif file_format == 'feather':
+                    write_feather(df, Path(data_dir, f"{out_name}.feather"))
+                elif file_format == 'npy':
+                    MatrixStore.save(df, Path(data_dir, f"{out_name}.{suffix}"))
+                else:
+                    df.to_pickle(Path(data_dir, f"{out_name}.pkl"))
+            batch_artifacts.append(f"{out_name}.{suffix}")
             LOGGER.info(f"saved {out_name}")
 
+        # with deferred_masking, the poobah p-values and quality mask are saved alongside instead of applied here.
+        apply_masks = not deferred_masking
+        # consolidating each probes x samples matrix, and writing it
+        matrices_token = profiler.start('save_matrices', batch=batch_num)
         if betas:
-            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='beta_value', bit=bit, poobah=poobah, exclude_rs=True)
-            _prepare_save_out_file(df, 'beta_values')
+            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='beta_value', bit=bit,
+                poobah=poobah and apply_masks, exclude_rs=True, apply_quality_mask=apply_masks)
+            _prepare_save_out_file(df, 'beta_values', quantize=quantize_betas)
         if m_value:
-            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='m_value', bit=bit, poobah=poobah, exclude_rs=True)
+            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='m_value', bit=bit,
+                poobah=poobah and apply_masks, exclude_rs=True, apply_quality_mask=apply_masks)
             _prepare_save_out_file(df, 'm_values')
         if (do_save_noob is not False) or betas or m_value:
-            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='noob_meth', bit=bit, poobah=poobah, exclude_rs=True)
+            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='noob_meth', bit=bit,
+                poobah=poobah and apply_masks, exclude_rs=True, apply_quality_mask=apply_masks)
             _prepare_save_out_file(df, 'noob_meth_values', uint16=True)
-            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='noob_unmeth', bit=bit, poobah=poobah, exclude_rs=True)
+            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='noob_unmeth', bit=bit,
+                poobah=poobah and apply_masks, exclude_rs=True, apply_quality_mask=apply_masks)
             _prepare_save_out_file(df, 'noob_unmeth_values', uint16=True)
+        if deferred_masking:
+            # load_values(..., poobah_sig=, quality_mask=) applies these when reading.
+            if all('poobah_pval' in e._SampleDataContainer__data_frame.columns for e in batch_data_containers):
+                df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='poobah_pval',
+                    bit='float32', poobah=False, exclude_rs=True)
+                _prepare_save_out_file(df, PVALUE_CODES_FILE, encoder=encode_pvalues)
+            if all(e.quality_mask == True and 'quality_mask' in e._SampleDataContainer__data_frame.columns
+                   for e in batch_data_containers):
+                df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='quality_mask',
+                    bit='float32', poobah=False, exclude_rs=True, apply_quality_mask=False)
+                _prepare_save_out_file(df, QUALITY_MASK_FILE, encoder=encode_quality_mask)
         if save_uncorrected:
-            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='meth', bit=bit, poobah=False, exclude_rs=True)
+            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='meth', bit=bit,
+                poobah=False, exclude_rs=True, apply_quality_mask=apply_masks)
             _prepare_save_out_file(df, 'meth_values', uint16=True)
-            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='unmeth', bit=bit, poobah=False, exclude_rs=True)
+            df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='unmeth', bit=bit,
+                poobah=False, exclude_rs=True, apply_quality_mask=apply_masks)
             _prepare_save_out_file(df, 'unmeth_values', uint16=True)
 
         if manifest.array_type == ArrayType.ILLUMINA_MOUSE and do_mouse:
-            # save mouse specific probes
-            if not batch_size:
-                mouse_probe_filename = f'mouse_probes.{suffix}'
-            else:
-                mouse_probe_filename = f'mouse_probes_{batch_num}.{suffix}'
-            consolidate_mouse_probes(batch_data_containers, Path(data_dir, mouse_probe_filename), file_format)
-            LOGGER.info(f"saved {mouse_probe_filename}")
+            # save mouse specific probes as matrices, like the main outputs; their design is saved once, below.
+            for postprocess_func_colname, file_stem in MOUSE_FILE_TYPES.items():
+                if all(postprocess_func_colname in e.mouse_data_frame.columns for e in batch_data_containers):
+                    df = consolidate_values_for_sheet(batch_data_containers,
+                        postprocess_func_colname=postprocess_func_colname, bit=bit, poobah=poobah and apply_masks,
+                        exclude_rs=True, object_name='mouse_data_frame', apply_quality_mask=apply_masks)
+                    _prepare_save_out_file(df, file_stem,
+                        uint16=postprocess_func_colname in ('noob_meth', 'noob_unmeth'),
+                        quantize=quantize_betas and postprocess_func_colname == 'beta_value')
+            design_filename = f"{MOUSE_DESIGN_FILE}.{table_suffix}"
+            if not Path(data_dir, design_filename).exists() or batch_num == 1:
+                design = mouse_probe_design(batch_data_containers)
+                if file_format == 'parquet':
+                    design.to_parquet(Path(data_dir, design_filename))
+                elif file_format == 'feather':
+                    write_feather(design, Path(data_dir, design_filename))
+                else:
+                    design.to_pickle(Path(data_dir, design_filename))
+                LOGGER.info(f"saved {design_filename}")
 
         if export:
             export_path_parents = list(set([str(Path(e).parent) for e in export_paths]))
@@ -446,6 +702,7 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
                 # sample_ids in the column headings and probe names in index.
                 df = consolidate_values_for_sheet(batch_data_containers, postprocess_func_colname='pNegECDF_pval', bit=bit, poobah=False, poobah_sig=poobah_sig, exclude_rs=True)
                 _prepare_save_out_file(df, 'pNegECDF_values')
+        profiler.stop(matrices_token)
 
         # v1.3.0 fixing mem problems: pickling each batch_data_containers object then reloading it later.
 
@@ -454,38 +711,94 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
         #    continue
         #data_containers.extend(batch_data_containers)
 
-        pkl_name = f"_temp_data_{batch_num}.pkl"
-        with open(Path(data_dir,pkl_name), 'wb') as temp_data:
-            pickle.dump(batch_data_containers, temp_data)
-            temp_data_pickles.append(pkl_name)
+        if low_memory is True:
+            # only the processed data_frames are needed from here on; spill these as memory-mappable columns.
+            with profiler.stage('spill', batch=batch_num):
+                batch_artifacts.extend(spill_store.write_batch(batch_num, batch_data_containers))
+            spilled_batches.append(batch_num)
+        else:
+            # keep the whole objects, with all probe subsets, for interactive use.
+            with profiler.stage('pickle_containers', batch=batch_num), open(Path(data_dir,pkl_name), 'wb') as temp_data:
+                pickle.dump(batch_data_containers, temp_data)
+                temp_data_pickles.append(pkl_name)
+                batch_artifacts.append(pkl_name)
+        if save_control:
+            # kept on disk per batch, so a resumed run still has the control probes of skipped batches.
+            if file_format in ('parquet', 'feather'):
+                write_feather(control_table(batch_control_snps), Path(data_dir, control_part_name),
+                              preserve_index=False)
+            else:
+                with open(Path(data_dir, control_part_name), 'wb') as temp_control:
+                    pickle.dump(batch_control_snps, temp_control)
+            temp_control_parts.append(control_part_name)
+            batch_artifacts.append(control_part_name)
+        if export_writer is not None:
+            with profiler.stage('export_wait', batch=batch_num):
+                export_writer.wait() # the batch is only complete once its exported files are written
+        if dataset_writer is not None:
+            dataset_writer.close_batch(batch_num)
+            batch_artifacts.append(dataset_writer.partition_file(batch_num))
+        journal.mark_complete(batch_num, batch, batch_artifacts)
+        profiler.stop(batch_token)
+        if budget is not None:
+            next_batch_size = budget.observe(len(batch))
+            if next_batch_size < len(batch) and batch_num < len(batches):
+                # went over max_memory: split the samples that are left into smaller batches. (The for loop
+                # iterates over this same list, so it picks up the new batches.)
+                remaining = [name for later_batch in batches[batch_num:] for name in later_batch]
+                batches[batch_num:] = [remaining[i:i+next_batch_size]
+                                       for i in range(0, len(remaining), next_batch_size)]
+        del batch_data_containers
 
-    del batch_data_containers
+    if export_writer is not None:
+        export_writer.shutdown()
+    if dataset_writer is not None:
+        dataset_writer.shutdown()
+    # a resumed run with re-split batches can finish with fewer batches than the run it resumed; drop the extra parts.
+    for stale_artifact in journal.discard_after(len(batches)):
+        LOGGER.info(f"Removing {stale_artifact}, left by a batch of the interrupted run.")
+        Path(data_dir, stale_artifact).unlink(missing_ok=True)
 
     if meta_data_frame == True:
         meta_frame = sample_sheet.build_meta_data(samples)
+        meta_frame_filename = f'sample_sheet_meta_data.{table_suffix}'
+        if append and Path(data_dir, meta_frame_filename).exists():
+            # keep the earlier rows as-is and add rows for samples that are new to the sample sheet.
+            read_func = {'parquet': pd.read_parquet, 'feather': read_feather}.get(file_format, pd.read_pickle)
+            existing_meta = read_func(Path(data_dir, meta_frame_filename))
+            new_rows = meta_frame[~meta_frame['Sample_ID'].isin(existing_meta['Sample_ID'])]
+            meta_frame = pd.concat([existing_meta, new_rows], ignore_index=True)
         if file_format == 'parquet':
-            meta_frame_filename = f'sample_sheet_meta_data.parquet'
             meta_frame.to_parquet(Path(data_dir, meta_frame_filename))
+        elif file_format == 'feather':
+            write_feather(meta_frame, Path(data_dir, meta_frame_filename), preserve_index=False)
         else:
-            meta_frame_filename = f'sample_sheet_meta_data.pkl'
             meta_frame.to_pickle(Path(data_dir, meta_frame_filename))
         LOGGER.info(f"saved {meta_frame_filename}")
 
     # FIXED in v1.3.0
     if save_control:
-        if file_format == 'parquet':
-            control_filename = f'control_probes.parquet'
-            control = pd.concat(control_snps) # creates multiindex
-            (control.reset_index()
-                .rename(columns={'level_0': 'Sentrix_ID', 'level_1': 'IlmnID'})
-                .astype({'IlmnID':str})
-                .to_parquet('control_probes.parquet')
-            )
+        if file_format in ('parquet', 'feather'):
+            control_filename = f'control_probes.{table_suffix}'
+            save_control_table([Path(data_dir, part) for part in temp_control_parts],
+                Path(data_dir, control_filename), file_format, append=append)
         else:
+            # methylcheck reads control_probes.pkl as a dict of per-sample dataframes.
             control_filename = f'control_probes.pkl'
+            control_snps = {}
+            for control_part_name in temp_control_parts:
+                with open(Path(data_dir, control_part_name), 'rb') as temp_control:
+                    control_snps.update(pickle.load(temp_control))
+            if append and Path(data_dir, control_filename).exists():
+                with open(Path(data_dir, control_filename), 'rb') as control_file:
+                    existing_control = pickle.load(control_file)
+                new_controls = {k:v for k,v in control_snps.items() if k not in existing_control}
+                control_snps = {**existing_control, **new_controls}
             with open(Path(data_dir, control_filename), 'wb') as control_file:
                 pickle.dump(control_snps, control_file)
         LOGGER.info(f"saved {control_filename}")
+        for control_part_name in temp_control_parts:
+            Path(data_dir, control_part_name).unlink(missing_ok=True)
 
     # summarize any processing errors
     if missing_probe_errors['noob'] != []:
@@ -497,24 +810,53 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
         samples_affected = len(set([item[0] for item in missing_probe_errors['raw']]))
         LOGGER.warning(f"{samples_affected} samples were missing (or had infinite values) RAW meth/unmeth probe values (average {avg_missing_per_sample} per sample)")
 
+    def _remove_temp_data():
+        for temp_data in temp_data_pickles:
+            Path(data_dir, temp_data).unlink(missing_ok=True) # delete it
+        spill_store.remove()
+
     # batch processing done; consolidate and return data. This uses much more memory, but not called if in batch mode.
-    if batch_size and batch_size >= 200:
+    # With max_memory, the budget decides whether the data is returned instead (see below).
+    large_batch = budget is None and batch_size and batch_size >= 200
+    if large_batch and not append:
         LOGGER.warning("Because the batch size was >=200 samples, files are saved but no data objects are returned.")
-        del batch_data_containers
-        for temp_data in temp_data_pickles:
-            temp_file = Path(data_dir, temp_data)
-            temp_file.unlink(missing_ok=True) # delete it
+        _remove_temp_data()
+        journal.remove()
+        profiler.stop(run_token)
         return
 
     # consolidate batches and delete parts, if possible
+    merge_token = profiler.start('merge')
+    # control_probes.pkl not included yet
     for file_type in ['beta_values', 'm_values', 'meth_values', 'unmeth_values',
-        'noob_meth_values', 'noob_unmeth_values', 'mouse_probes', 'poobah_values']: # control_probes.pkl not included yet
+        'noob_meth_values', 'noob_unmeth_values', 'poobah_values', 'pNegECDF_values',
+        PVALUE_CODES_FILE, QUALITY_MASK_FILE] + list(MOUSE_FILE_TYPES.values()):
         test_parts = list([str(temp_file) for temp_file in Path(data_dir).rglob(f'{file_type}*.{suffix}')])
-        num_batches = len(test_parts)
         # ensures that only the file_types that appear to be selected get merged.
-        #print(f"DEBUG num_batches {num_batches}, batch_size {batch_size}, file_type {file_type}")
-        if batch_size and num_batches >= 1: #--- if the batch size was larger than the number of total samples, this will still drop the _1
-            merge_batches(num_batches, data_dir, file_type, file_format)
+        #print(f"DEBUG num_batches {len(batches)}, batch_size {batch_size}, file_type {file_type}")
+        #--- if the batch size was larger than the number of total samples, this will still drop the _1
+        if (batch_size or append) and len(test_parts) >= 1:
+            # only this run's parts; any higher-numbered part on disk is left from another run.
+            merge_batches(len(batches), data_dir, file_type, file_format, append=append,
+                rows_per_chunk=row_group_size, compression=parquet_compression)
+    profiler.stop(merge_token)
+    journal.remove()
+
+    if large_batch: # append mode merges first, but still returns nothing for large batches.
+        LOGGER.warning("Because the batch size was >=200 samples, files are saved but no data objects are returned.")
+        _remove_temp_data()
+        profiler.stop(run_token)
+        return
+
+    # spilled containers are lazy, so returning them is cheap;
+    # consolidating values or unpickling whole containers is not.
+    loads_all_data = betas or m_value or temp_data_pickles != []
+    if budget is not None and loads_all_data and not budget.fits(sum(len(batch) for batch in batches)):
+        LOGGER.warning("All samples will not fit in max_memory at once, "
+                       "so files are saved but no data objects are returned.")
+        _remove_temp_data()
+        profiler.stop(run_token)
+        return
 
     # reload all the big stuff -- after everything important is done.
     # attempts to consolidate all the batch_files below, if they'll fit in memory.
@@ -527,13 +869,57 @@ def run_pipeline(data_dir, array_type=None, export=False, manifest_filepath=None
                 data_containers.extend(batch_data_containers)
                 del batch_data_containers
             temp_file.unlink() # delete it after loading.
-
-    if betas:
-        return consolidate_values_for_sheet(data_containers, postprocess_func_colname='beta_value', poobah=poobah, exclude_rs=True)
-    elif m_value:
-        return consolidate_values_for_sheet(data_containers, postprocess_func_colname='m_value', poobah=poobah, exclude_rs=True)
-    else:
-        return data_containers
+    for batch_num in spilled_batches:
+        data_containers.extend(spill_store.load_batch(batch_num))
+
+    if betas or m_value:
+        postprocess_func_colname = 'beta_value' if betas else 'm_value'
+        with profiler.stage('consolidate_return'):
+            # unmasked with deferred_masking, like the saved files
+            values = consolidate_values_for_sheet(data_containers, postprocess_func_colname=postprocess_func_colname,
+                poobah=poobah and not deferred_masking, exclude_rs=True, apply_quality_mask=not deferred_masking)
+        del data_containers
+        spill_store.remove()
+        profiler.stop(run_token)
+        return values
+    # the spilled data stays on disk until the returned containers are no longer used.
+    spill_store.remove_when_unused()
+    profiler.stop(run_token)
+    return data_containers
+
+
+def _in_probe_order(data_frame, probe_order, probe_positions=None):
+    """Returns data_frame sorted by probe name, using the manifest's canonical (sorted) probe_order instead of
+    sorting the names again. If the sample has every probe in probe_order, the result uses that Index object
+    itself, so every such sample shares one index and their columns stack into matrices as they are.
+    probe_positions -- the manifest's ProbePositions for probe_order,
+        to reuse the positions found for earlier samples."""
+    if probe_order is None:
+        return data_frame.sort_index()
+    positions = probe_positions.get(data_frame.index) if probe_positions is not None else None
+    if positions is None:
+        positions = probe_order.get_indexer(data_frame.index)
+    if (positions == -1).any() or data_frame.index.has_duplicates:
+        return data_frame.sort_index() # probes the manifest does not list
+    order = np.argsort(positions, kind='stable')
+    data_frame = data_frame.iloc[order]
+    if len(positions) == len(probe_order):
+        data_frame.index = probe_order
+    return data_frame
+
+
+def _join_by_position(data_frame, other, probe_positions=None):
+    """data_frame.join(other, how='inner'), for other indexed by probe_positions.target (a manifest's probe names):
+    rows are matched with the ProbePositions kept for the manifest, instead of looking up names for each sample."""
+    positions = None
+    if probe_positions is not None and other.index is probe_positions.target:
+        positions = probe_positions.get(data_frame.index)
+    if positions is None:
+        return data_frame.join(other, how='inner')
+    found = positions != -1
+    if not found.all():
+        data_frame, positions = data_frame[found], positions[found]
+    return data_frame.assign(**{column: other[column].to_numpy()[positions] for column in other.columns})
 
 
 class SampleDataContainer(SigSet):
@@ -562,7 +948,7 @@ class SampleDataContainer(SigSet):
     def __init__(self, idat_dataset_pair, manifest=None, retain_uncorrected_probe_intensities=False,
                  bit='float32', pval=False, poobah_decimals=3, poobah_sig=0.05, do_noob=True,
                  quality_mask=True, switch_probes=True, do_nonlinear_dye_bias=True, debug=False, sesame=True,
-                 pneg_ecdf=False, file_format='csv'):
+                 pneg_ecdf=False, file_format='csv', outputs=None, cache=None, profiler=None):
         self.debug = debug
         self.do_noob = do_noob
         self.pval = pval
@@ -580,18 +966,40 @@ class SampleDataContainer(SigSet):
         self.pneg_ecdf = pneg_ecdf
         self.data_type = 'float32' if bit == None else bit # options: (float64, float32, or float16)
         self.file_format = file_format
+        # what process_all computes (see plan.compile_plan); None computes everything, as run_pipeline does.
+        self.outputs = None if outputs is None else set(outputs)
         if debug:
             print(f'DEBUG SDC: sesame {self.sesame} switch {self.switch_probes} noob {self.do_noob} poobah {self.pval} mask {self.quality_mask}, dye {self.do_nonlinear_dye_bias}')
 
         self.manifest = manifest # used by inter_channel_switch only.
-        if self.switch_probes:
+        # run_pipeline(profile=True) passes its RunProfiler (see profiling.py), which times each stage below.
+        self.profiler = profiler
+        # a SampleStageCache (see stage_cache.py) restores the SigSet after channel switching, and after noob,
+        # from an earlier run.
+        self.cache = cache
+        cached_sigset = None
+        if self.cache is not None:
+            cached_sigset = self.cache.load('sigset', switch_probes=bool(self.switch_probes))
+        if self.switch_probes and cached_sigset is None:
             # apply inter_channel_switch here; uses raw_dataset and manifest only; then updates self.raw_dataset
             # these are read from idats directly, not SigSet, so need to be modified at source.
-            infer_type_I_probes(self, debug=self.debug)
-
-        super().__init__(self.sample, self.green_idat, self.red_idat, self.manifest, self.debug)
+            with self._stage('channel_switch'):
+                infer_type_I_probes(self, debug=self.debug)
+
+        with self._stage('sigset'):
+            super().__init__(self.sample, self.green_idat, self.red_idat, self.manifest, self.debug,
+                             cached_subsets=cached_sigset)
+        if self.cache is not None and cached_sigset is None:
+            self.cache.save('sigset', sigset_state(self), switch_probes=bool(self.switch_probes))
         # SigSet defines all probe-subsets, then SampleDataContainer adds them with super(); no need to re-define below.
         # mouse probes are processed within the normals meth/unmeth sets, then split at end of preprocessing step.
+        # sesame's quality mask, matched to the manifest's probes once per run; process_all uses it, then drops it.
+        self.quality_mask_probes = self.manifest.get_quality_mask() if self.quality_mask == True else None
+        # the canonical probe order; samples with every probe share this one index (see _in_probe_order).
+        self.probe_order = self.manifest.get_probe_order()
+        # where each sample's probes are in these; found once, then reused by every sample of this manifest.
+        self.probe_positions = {name: self.manifest.get_probe_positions(name)
+                                for name in ('quality_mask', 'probe_order')}
         del self.manifest
         del manifest
 
@@ -603,7 +1011,7 @@ class SampleDataContainer(SigSet):
             lists = ['red_switched','green_switched']
             exclude = ['data_channel', 'man', 'snp_man', 'ctl_man', 'address_code', 'ctrl_green', 'ctrl_red', 'II',
             'IG', 'IR', 'oobG', 'oobR', 'methylated', 'unmethylated', 'snp_methylated', 'snp_unmethylated', 'ibG', 'ibR',
-            'mouse_probes_mask',            ]
+            'mouse_probes_mask', 'quality_mask_probes', 'probe_order', 'probe_positions']
             for key,value in self.__dict__.items():
                 if key in exclude:
                     try:
@@ -635,16 +1043,45 @@ class SampleDataContainer(SigSet):
         # also creates a self.mouse_data_frame for mouse specific probes with 'noob_meth' and 'noob_unmeth' columns here.
         if self.__data_frame:
             return self.__data_frame
-
-        pval_probes_df = _pval_sesame_preprocess(self) if self.pval == True else None
-        pneg_ecdf_probes_df = _pval_neg_ecdf(self) if self.pneg_ecdf == True else None
-        # output: df with one column named 'poobah_pval'
-        quality_mask_df = _apply_sesame_quality_mask(self) if self.quality_mask == True else None
-        # output: df with one column named 'quality_mask' | if not supported array / custom array: returns nothing.
-
-        if self.do_noob == True:
-            # apply corrections: bg subtract, then noob (in preprocess.py)
-            preprocess_noob(self, pval_probes_df=pval_probes_df, quality_mask_df=quality_mask_df, nonlinear_dye_correction=self.do_nonlinear_dye_bias, debug=self.debug)
+        quality_mask_probes, self.quality_mask_probes = getattr(self, 'quality_mask_probes', None), None
+        probe_positions, self.probe_positions = getattr(self, 'probe_positions', None) or {}, None
+
+        run_noob = self.do_noob == True and self._wants('noob_meth')
+        # everything the noob-corrected SigSet depends on, for the stage cache
+        noob_params = dict(switch_probes=bool(self.switch_probes),
+            pval=self.pval == True and self._wants('poobah_pval'),
+            pneg_ecdf=self.pneg_ecdf == True and self._wants('pNegECDF_pval'), poobah_sig=self.poobah_sig,
+            quality_mask=self.quality_mask == True and self._wants('quality_mask'), noob=run_noob,
+            linear_dye=self.do_nonlinear_dye_bias == False, sesame=self.sesame)
+        noob_state = self.cache.load('noob', **noob_params) if self.cache is not None else None
+        if noob_state is not None:
+            pval_probes_df = noob_state.pop('pval_probes_df')
+            pneg_ecdf_probes_df = noob_state.pop('pneg_ecdf_probes_df')
+            quality_mask_df = noob_state.pop('quality_mask_df')
+            restore_sigset_state(self, noob_state)
+        else:
+            pval_probes_df = pneg_ecdf_probes_df = quality_mask_df = None
+            if noob_params['pval']:
+                with self._stage('poobah'):
+                    pval_probes_df = _pval_sesame_preprocess(self)
+            if noob_params['pneg_ecdf']:
+                with self._stage('pneg_ecdf'):
+                    pneg_ecdf_probes_df = _pval_neg_ecdf(self)
+            # output: df with one column named 'poobah_pval'
+            if noob_params['quality_mask']:
+                with self._stage('quality_mask'):
+                    quality_mask_df = _apply_sesame_quality_mask(self, quality_mask_probes)
+            # output: df with one column named 'quality_mask' | if not supported array / custom array: returns nothing.
+            if run_noob:
+                # apply corrections: bg subtract, then noob (in preprocess.py)
+                with self._stage('noob'):
+                    preprocess_noob(self, pval_probes_df=pval_probes_df, quality_mask_df=quality_mask_df,
+                        nonlinear_dye_correction=self.do_nonlinear_dye_bias, debug=self.debug)
+            if self.cache is not None:
+                self.cache.save('noob', {**sigset_state(self), 'pval_probes_df': pval_probes_df,
+                    'pneg_ecdf_probes_df': pneg_ecdf_probes_df, 'quality_mask_df': quality_mask_df}, **noob_params)
+
+        if run_noob:
             #if self.sesame in (None,True):
                 #preprocess_noob(self, pval_probes_df=pval_probes_df, quality_mask_df=quality_mask_df, nonlinear_dye_correction=self.do_nonlinear_dye_bias, debug=self.debug)
                 #if container.__dye_bias_corrected is False: # process failed, so fallback is linear-dye
@@ -698,10 +1135,12 @@ class SampleDataContainer(SigSet):
         self.check_for_probe_loss(f"preprocess_noob sesame={self.sesame} --> {self.methylated.shape} {self.unmethylated.shape}")
 
         if self.quality_mask == True and isinstance(quality_mask_df, pd.DataFrame):
-            self.__data_frame = self.__data_frame.join(quality_mask_df, how='inner')
+            self.__data_frame = _join_by_position(self.__data_frame, quality_mask_df,
+                                                  probe_positions.get('quality_mask'))
 
-        if self.do_nonlinear_dye_bias == True:
-            nonlinear_dye_bias_correction(self, debug=self.debug)
+        if self.do_nonlinear_dye_bias == True and self._wants('noob_meth'):
+            with self._stage('dye_bias'):
+                nonlinear_dye_bias_correction(self, debug=self.debug)
             # this step ensures that failed probes are not included in the NOOB calculations.
             # but they MUST be included in CSV exports, so I move the failed probes to another df for storage until pipeline.export() needs them.
             if self.quality_mask == True and 'quality_mask' in self.__data_frame.columns:
@@ -759,7 +1198,8 @@ class SampleDataContainer(SigSet):
 
         # finally, sort probes -- note: uncommenting this step breaks beta/m_value calcs in testing. Some downstream function depends on the probe_order staying same.
         # --- must fix all unit tests using .iloc[ before this will work | fixed.
-        self.__data_frame.sort_index(inplace=True)
+        self.__data_frame = _in_probe_order(self.__data_frame, getattr(self, 'probe_order', None),
+                                            probe_positions.get('probe_order'))
         ###### end preprocessing ######
 
         if hasattr(self, '_SampleDataContainer__quality_mask_excluded_probes') and isinstance(self._SampleDataContainer__quality_mask_excluded_probes, pd.DataFrame):
@@ -770,19 +1210,31 @@ class SampleDataContainer(SigSet):
                 'noob_meth': self.__quality_mask_excluded_probes['noob_meth'],
                 'noob_unmeth': self.__quality_mask_excluded_probes['noob_unmeth']
                 })
-        self.__data_frame = self.process_beta_value(self.__data_frame)
-        self.__data_frame = self.process_m_value(self.__data_frame)
+        if self._wants('beta_value'):
+            self.__data_frame = self.process_beta_value(self.__data_frame)
+        if self._wants('m_value'):
+            self.__data_frame = self.process_m_value(self.__data_frame)
 
         if self.debug:
             self.check_for_probe_loss(f"816 self.check_for_probe_loss(): self.__data_frame = {self.__data_frame.shape}")
 
-        if self.array_type == ArrayType.ILLUMINA_MOUSE:
+        if self.array_type == ArrayType.ILLUMINA_MOUSE and self._wants('mouse_beta_value'):
             self.mouse_data_frame = self.process_beta_value(self.mouse_data_frame)
             self.mouse_data_frame = self.process_m_value(self.mouse_data_frame)
             self.mouse_data_frame = self.process_copy_number(self.mouse_data_frame)
 
         return # self.__data_frame
 
+    def _wants(self, output):
+        return self.outputs is None or output in self.outputs
+
+    def _stage(self, stage):
+        # times a processing stage of this sample, if run_pipeline is profiling.
+        profiler = getattr(self, 'profiler', None) # containers pickled before profiling existed lack it
+        if profiler is None:
+            return nullcontext()
+        return profiler.stage(stage, sample=f"{self.sample.sentrix_id}_{self.sample.sentrix_position}")
+
     def process_m_value(self, input_dataframe):
         """Calculate M value from methylation data"""
         return self._postprocess(input_dataframe, calculate_m_value, 'm_value')
@@ -800,48 +1252,40 @@ class SampleDataContainer(SigSet):
         """Calculate copy number value from methylation data"""
         return self._postprocess(input_dataframe, calculate_copy_number, 'cm_value')
 
+    def read_columns(self, columns):
+        """Returns the processed data_frame's values for whichever of these columns exist.
+        Used by consolidate_values_for_sheet."""
+        return self.__data_frame[[column for column in columns if column in self.__data_frame.columns]]
+
+    def export(self, output_path, export_format=None, writer=None):
+        """Saves a CSV (or gzipped CSV, parquet, or feather file) for each sample with all processing intermediate data.
 
-    def export(self, output_path):
-        """Saves a CSV for each sample with all processing intermediate data"""
+        export_format -- one of 'csv', 'csv.gz', 'parquet', 'feather';
+            default matches file_format if that is parquet or feather, else csv.
+        writer -- an ExportWriter; if given, the file is written on one of its background threads.
+
+        The data_frame is rounded here (these values are also used in the saved output matrices), but not copied:
+        the quality-masked probes' noob values are filled back in as each chunk of rows is written."""
         ensure_directory_exists(output_path)
+        export_format = export_format or (self.file_format if self.file_format in ('parquet', 'feather') else 'csv')
+        data_frame, overlay = self.prepare_export()
+        if writer is not None:
+            writer.submit(write_export, data_frame, output_path, export_format, overlay=overlay)
+        else:
+            write_export(data_frame, output_path, export_format, overlay=overlay)
+
+    def prepare_export(self):
+        """Rounds the data_frame for export, and returns it with the overlay of quality-masked probe values
+        that exports include (or None). Used by export() and the long-format dataset export."""
         # ensure smallest possible csv files
         self.__data_frame = self.__data_frame.round({'noob_meth':0, 'noob_unmeth':0, 'm_value':3, 'beta_value':3,
             'meth':0, 'unmeth':0, 'poobah_pval':self.poobah_decimals})
-        this = self.__data_frame.copy(deep=True)
+        overlay = None
         if hasattr(self, '_SampleDataContainer__quality_mask_excluded_probes') and isinstance(self._SampleDataContainer__quality_mask_excluded_probes, pd.DataFrame):
-            # copy over these failed probes to a dataframe for export
-            this.update({
-                'noob_meth': self.__quality_mask_excluded_probes['noob_meth'],
-                'noob_unmeth': self.__quality_mask_excluded_probes['noob_unmeth']
-                })
-        if 'quality_mask' in this.columns:
-            this['quality_mask'] = this['quality_mask'].fillna(1)
+            # these failed probes are NaN in the data_frame, but exports include their values
+            overlay = self.__quality_mask_excluded_probes[['noob_meth', 'noob_unmeth']]
         # noob columns contain NANs now because of sesame (v1.4.0 to v1.4.5); v1.4.6+ CSVs contain all data, but pickles are filtered.
-        #try:
-        #    self.__data_frame['noob_meth'] = self.__data_frame['noob_meth'].astype(int, copy=False)
-        #    self.__data_frame['noob_unmeth'] = self.__data_frame['noob_unmeth'].astype(int, copy=False)
-        #except ValueError as e:
-        #if 'quality_mask' in self.__data_frame.columns:
-        #    num_missing = self.__data_frame[ ~self.__data_frame['quality_mask'].isna() ]['noob_unmeth'].isna().sum() + self.__data_frame[ ~self.__data_frame['quality_mask'].isna() ]['noob_meth'].isna().sum()
-        #else:
-        #    num_missing = self.__data_frame['noob_unmeth'].isna().sum() + self.__data_frame['noob_meth'].isna().sum()
-        #if num_missing > 0:
-        #    self.noob_processing_missing_probe_errors.append((output_path, num_missing))
-        # these are the raw, uncorrected values, replaced by sesame quality_mask as NANs
-        #if 'meth' in self.__data_frame.columns and 'unmeth' in self.__data_frame.columns:
-        #    try:
-        #        self.__data_frame['meth'] = self.__data_frame['meth'] # .astype('float16', copy=False) # --- float16 was changing these values, so not doing this step.
-        #        self.__data_frame['unmeth'] = self.__data_frame['unmeth'] # .astype('float16', copy=False)
-        #    except ValueError as e:
-        #        if 'quality_mask' in self.__data_frame.columns:
-        #            num_missing = self.__data_frame[ ~self.__data_frame['quality_mask'].isna() ]['unmeth'].isna().sum() + self.__data_frame[ ~self.__data_frame['quality_mask'].isna() ]['meth'].isna().sum()
-        #        else:
-        #            num_missing = self.__data_frame['meth'].isna().sum() + self.__data_frame['unmeth'].isna().sum()
-        #        self.raw_processing_missing_probe_errors.append((output_path, num_missing))
-        if self.file_format == 'parquet':
-            this.to_parquet(output_path)
-        else:
-            this.to_csv(output_path)
+        return self.__data_frame, overlay
 
     def _postprocess(self, input_dataframe, postprocess_func, header, offset=None):
         if offset is not None:
@@ -869,7 +1313,7 @@ class SampleDataContainer(SigSet):
         return input_dataframe
 
 
-def make_pipeline(data_dir='.', steps=None, exports=None, estimator='beta', **kwargs):
+def make_pipeline(data_dir='.', steps=None, exports=None, estimator='beta', dry_run=False, cache=False, **kwargs):
     """Specify a list of processing steps for run_pipeline, then instantiate and run that pipeline.
 
     steps:
@@ -881,6 +1325,13 @@ def make_pipeline(data_dir='.', steps=None, exports=None, estimator='beta', **kw
     estimator:
         which final format?
         [beta | m_value | copy_number | None (returns containers instead)]
+    dry_run:
+        if True, prints the processing plan (see below) and returns it, without processing anything.
+    cache:
+        if True, each sample's intermediate results (IDAT intensities, the SigSet after channel switching, and after
+        noob) are kept in data_dir/_stage_cache, keyed by the settings they depend on. Re-running with other
+        downstream settings (poobah_sig, quality_mask, dye_bias) then starts from the deepest stage that is still
+        valid, instead of from the IDATs. See methylprep.processing.stage_cache.StageCache.
 
     This feeds a Class that runs the run_pipeline function of transforms with a final estimator.
     It replaces all of the kwargs that are in run_pipeline() and adds a few more options:
@@ -908,6 +1359,11 @@ def make_pipeline(data_dir='.', steps=None, exports=None, estimator='beta', **kw
     You may override that by specifying `estimator`= ('betas' or 'm_value').
 
 [how it works]
+    steps, exports, and estimator are compiled into a plan (methylprep.processing.plan): a graph of processing stages,
+    each declaring its inputs and outputs. Stages that nothing requested depends on are pruned, so each sample only
+    computes what the exports and estimator need -- e.g. exports=['noob_meth'] with estimator=None skips beta and
+    M values, and returned containers have only the computed columns.
+
     make_pipeline calls run_pipeline(), which has a **kwargs final keyword that maps many additional esoteric settings that you can define here.
 
     These are used for more granular unit testing on methylsuite, but could allow you to change how data is processed
@@ -949,8 +1405,63 @@ The rest of these are additional optional kwargs you can include:
         raise ValueError(f"Your chosen final estimator must be one of these: {allowed_estimators}; you said {estimator}")
     if estimator == 'copy_number':
         raise ValueError("copy_number is not yet suppported. (You can get it in the code, but not with make_pipelines)")
+    plan = compile_plan(steps, exports, estimator, pneg_ecdf=kwargs.get('pneg_ecdf', False))
+    if dry_run:
+        print(plan.describe())
+        return plan
+    LOGGER.debug(plan.describe())
     if estimator in ('betas','beta'):
         kwargs['betas'] = True
     if estimator == 'm_value':
         kwargs['m_value'] = True
-    return run_pipeline(data_dir, pipeline_steps=steps, pipeline_exports=exports, **kwargs)
+    if cache:
+        kwargs['stage_cache'] = True
+    return run_pipeline(data_dir, pipeline_steps=steps, pipeline_exports=exports, pipeline_plan=plan, **kwargs)
+
+
+class SpilledSampleDataContainer(SampleDataContainer):
+    """A processed SampleDataContainer, as returned by run_pipeline, whose data_frame stays on disk (in a SpillStore)
+    until it is first used. Only the Sample, processing settings, and the processed data_frame are kept; the probe
+    subsets (methylated, oobG, ctrl_red, etc) are dropped during processing when low_memory=True.
+
+    Arguments:
+        store {SpillStore} -- where the sample's data_frame columns are saved.
+        record {dict} -- the sample's entry in the store (sample_id, Sample, columns, settings).
+    """
+
+    def __init__(self, store, record):
+        # no SampleDataContainer/SigSet init: that reads the idats. Only restore what was saved.
+        self._store = store
+        self._record = record
+        self.sample = record['sample']
+        for key, value in record['attributes'].items():
+            setattr(self, key, value)
+        self._data_frame = None
+
+    @property
+    def _SampleDataContainer__data_frame(self):
+        if self._data_frame is None:
+            self._data_frame = pd.DataFrame(
+                {column: self._store.read_column(self._record, column, mmap_mode=None)
+                 for column in self._record['columns']},
+                index=self._store.read_index(self._record),
+            )
+        return self._data_frame
+
+    @_SampleDataContainer__data_frame.setter
+    def _SampleDataContainer__data_frame(self, data_frame):
+        self._data_frame = data_frame
+
+    def process_all(self):
+        return self._SampleDataContainer__data_frame
+
+    def read_columns(self, columns):
+        """Like SampleDataContainer.read_columns, but reads only these columns from disk, unless the whole
+        data_frame is already loaded."""
+        if self._data_frame is not None:
+            return super().read_columns(columns)
+        return pd.DataFrame(
+            {column: self._store.read_column(self._record, column)
+             for column in columns if column in self._record['columns']},
+            index=self._store.read_index(self._record),
+        )
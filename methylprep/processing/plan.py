@@ -0,0 +1,142 @@
+# Lib
+import logging
+
+
+__all__ = ['Stage', 'Plan', 'compile_plan', 'STAGES']
+
+LOGGER = logging.getLogger(__name__)
+
+
+class Stage():
+    """One step of processing a sample, with the names of what it reads (inputs) and produces (outputs).
+    A stage whose outputs overlap its inputs transforms them in place (like dye_bias on noob_meth/noob_unmeth).
+
+    step -- the make_pipeline step (or run_pipeline option) that enables this stage; None means always enabled.
+    Inputs that no enabled stage produces are ignored, so poobah_pval only feeds noob when poobah runs."""
+
+    def __init__(self, name, inputs, outputs, step=None, description=''):
+        self.name = name
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.step = step
+        self.description = description
+
+    def __repr__(self):
+        return f"Stage({self.name}: {', '.join(self.inputs) or '-'} -> {', '.join(self.outputs)})"
+
+
+# in the order SampleDataContainer runs them (see SampleDataContainer.process_all)
+STAGES = [
+    Stage('read_idats', [], ['sigset'], description='read the green and red IDATs into a SigSet'),
+    Stage('infer_channel_switch', ['sigset'], ['sigset'], step='infer_channel_switch',
+        description='reassign type I probes to the channel they fluoresce in'),
+    Stage('poobah', ['sigset'], ['poobah_pval'], step='poobah',
+        description='p-values from out-of-band background (pOOBAH)'),
+    Stage('pneg_ecdf', ['sigset'], ['pNegECDF_pval'], step='pneg_ecdf',
+        description='p-values from negative control probes'),
+    Stage('quality_mask', [], ['quality_mask'], step='quality_mask',
+        description="sesame's list of unreliable probes for this array"),
+    Stage('intensities', ['sigset'], ['meth', 'unmeth', 'noob_meth', 'noob_unmeth'],
+        description='methylated and unmethylated intensities; copied to noob_meth/noob_unmeth'),
+    Stage('noob', ['sigset', 'poobah_pval', 'quality_mask', 'noob_meth', 'noob_unmeth'], ['noob_meth', 'noob_unmeth'],
+        step='noob',
+        description='background correction (and linear dye-bias correction)'),
+    Stage('dye_bias', ['noob_meth', 'noob_unmeth', 'quality_mask'], ['noob_meth', 'noob_unmeth'], step='dye_bias',
+        description='nonlinear dye-bias correction'),
+    Stage('beta_value', ['noob_meth', 'noob_unmeth'], ['beta_value'], description='beta values'),
+    Stage('m_value', ['noob_meth', 'noob_unmeth'], ['m_value'], description='M values'),
+    Stage('mouse_values', ['noob_meth', 'noob_unmeth'], ['mouse_beta_value', 'mouse_m_value', 'mouse_cm_value'],
+        description='beta, M, and copy number values of mouse-specific probes (mouse arrays only)'),
+    # SNP betas use the noob intensities of the snp probes, when noob runs
+    Stage('control_snp', ['sigset', 'noob_meth', 'noob_unmeth'], ['control_snp'],
+        description='control and SNP probe table'),
+]
+
+# probes x samples matrices are masked with these (when present) as they are saved; see consolidate_values_for_sheet.
+MATRIX_MASKS = ['poobah_pval', 'quality_mask']
+# make_pipeline export --> what it needs from each sample
+EXPORT_TARGETS = {
+    'csv': ['noob_meth', 'noob_unmeth', 'beta_value', 'm_value', 'poobah_pval', 'pNegECDF_pval', 'quality_mask'],
+    'poobah': ['poobah_pval', 'pNegECDF_pval'],
+    'meth': ['meth', 'quality_mask'],
+    'unmeth': ['unmeth', 'quality_mask'],
+    'noob_meth': ['noob_meth'] + MATRIX_MASKS,
+    'noob_unmeth': ['noob_unmeth'] + MATRIX_MASKS,
+    'sample_sheet_meta_data': [],
+    'mouse': ['mouse_beta_value', 'mouse_m_value', 'mouse_cm_value', 'noob_meth', 'noob_unmeth'] + MATRIX_MASKS,
+    'control': ['control_snp'],
+}
+# make_pipeline estimator --> what it needs from each sample (the noob matrices are saved along with these).
+# Without an estimator, make_pipeline returns the SampleDataContainers themselves, holding the corrected intensities
+# and p-values of the selected steps; beta and M values are only computed if an export asks for them.
+ESTIMATOR_TARGETS = {
+    'beta': ['beta_value', 'noob_meth', 'noob_unmeth'] + MATRIX_MASKS,
+    'betas': ['beta_value', 'noob_meth', 'noob_unmeth'] + MATRIX_MASKS,
+    'm_value': ['m_value', 'noob_meth', 'noob_unmeth'] + MATRIX_MASKS,
+    None: ['noob_meth', 'noob_unmeth', 'pNegECDF_pval'] + MATRIX_MASKS,
+}
+
+
+class Plan():
+    """The stages that will run for each sample, compiled from make_pipeline's steps, exports, and estimator.
+
+    stages -- enabled stages needed for the requested outputs, in run order.
+    pruned -- enabled stages whose outputs nothing requested uses, so they are not run.
+    disabled -- stages whose step was not selected.
+    outputs -- everything the kept stages produce (and SampleDataContainer(outputs=...) computes).
+    """
+
+    def __init__(self, stages, pruned, disabled, targets):
+        self.stages = stages
+        self.pruned = pruned
+        self.disabled = disabled
+        self.targets = targets
+        self.outputs = set(output for stage in stages for output in stage.outputs)
+
+    def __contains__(self, stage_name):
+        return any(stage.name == stage_name for stage in self.stages)
+
+    def __repr__(self):
+        return self.describe()
+
+    def describe(self):
+        """A readable printout of the plan, for make_pipeline(..., dry_run=True)."""
+        width = max(len(stage.name) for stage in STAGES)
+        lines = [f"methylprep plan: {len(self.stages)} of {len(STAGES)} stages run per sample"]
+        for stage in self.stages:
+            inputs = [name for name in stage.inputs if name in self.outputs]
+            lines.append(f"  {stage.name:<{width}}  {', '.join(inputs) or '-'} -> {', '.join(stage.outputs)}")
+        if self.pruned:
+            lines.append(f"pruned (outputs not needed): {', '.join(stage.name for stage in self.pruned)}")
+        if self.disabled:
+            lines.append(f"not selected: {', '.join(stage.name for stage in self.disabled)}")
+        lines.append(f"requested: {', '.join(sorted(self.targets)) or '-'}")
+        return '\n'.join(lines)
+
+
+def compile_plan(steps=None, exports=None, estimator='beta', pneg_ecdf=False):
+    """Compiles make_pipeline's steps, exports, and estimator into a Plan: the enabled stages are walked from last
+    to first, keeping only those that produce something requested (or something a kept stage reads)."""
+    steps = list(steps or [])
+    exports = list(exports or [])
+    selected = set(['infer_channel_switch', 'poobah', 'quality_mask', 'noob', 'dye_bias'] if 'all' in steps else steps)
+    if 'linear_dye_bias' in selected: # linear dye-bias correction is part of noob
+        selected.discard('linear_dye_bias')
+    if pneg_ecdf:
+        selected.add('pneg_ecdf')
+    export_names = list(EXPORT_TARGETS) if 'all' in exports else exports
+    targets = set(target for export in export_names for target in EXPORT_TARGETS.get(export, []))
+    targets.update(ESTIMATOR_TARGETS.get(estimator, []))
+
+    enabled = [stage for stage in STAGES if stage.step is None or stage.step in selected]
+    disabled = [stage for stage in STAGES if stage not in enabled]
+    produced = set(output for stage in enabled for output in stage.outputs)
+    needed = set(targets)
+    kept = []
+    for stage in reversed(enabled):
+        if needed & set(stage.outputs):
+            kept.append(stage)
+            needed.update(name for name in stage.inputs if name in produced)
+    kept.reverse()
+    pruned = [stage for stage in enabled if stage not in kept]
+    return Plan(kept, pruned, disabled, targets & produced)
@@ -2,20 +2,41 @@
 import numpy as np
 import pandas as pd
 import os
-import pickle
+import shutil
 from pathlib import Path
 import logging
 # app
-from ..utils import is_file_like
+from .matrix_store import MatrixStore, MATRIX_STORE_SUFFIX
+from .encoding import PVALUE_CODES_FILE, QUALITY_MASK_FILE
 #from ..utils.progress_bar import * # context tqdm
 
 os.environ['NUMEXPR_MAX_THREADS'] = "8" # suppresses warning
 
 
-__all__ = ['calculate_beta_value', 'calculate_m_value', 'consolidate_values_for_sheet', 'consolidate_mouse_probes']
+__all__ = ['calculate_beta_value', 'calculate_m_value', 'consolidate_values_for_sheet']
 
 LOGGER = logging.getLogger(__name__)
 
+# text columns of the control/SNP table that are saved as categoricals in parquet and feather.
+CONTROL_LABEL_COLUMNS = ['Sentrix_ID', 'IlmnID', 'Control_Type', 'Color', 'Extended_Type']
+
+# processed output matrices with probes in rows and one column per sample;
+# run_pipeline(append=True) adds columns to these.
+APPENDABLE_FILE_TYPES = ['beta_values', 'm_values', 'noob_meth_values', 'noob_unmeth_values',
+    'meth_values', 'unmeth_values', 'poobah_values', 'pNegECDF_values']
+# mouse_data_frame column --> probes x samples matrix of the mouse-specific ('Multi'|'Random' design) probes.
+MOUSE_FILE_TYPES = {
+    'beta_value': 'mouse_beta_values',
+    'm_value': 'mouse_m_values',
+    'cm_value': 'mouse_cm_values',
+    'noob_meth': 'mouse_noob_meth_values',
+    'noob_unmeth': 'mouse_noob_unmeth_values',
+}
+APPENDABLE_FILE_TYPES += list(MOUSE_FILE_TYPES.values())
+# poobah p-value codes and quality mask, saved with run_pipeline(deferred_masking=True); see encoding.py
+APPENDABLE_FILE_TYPES += [PVALUE_CODES_FILE, QUALITY_MASK_FILE]
+MOUSE_DESIGN_FILE = 'mouse_probe_design'
+
 def calculate_beta_value(methylated_noob, unmethylated_noob, offset=100):
     """ the ratio of (methylated_intensity / total_intensity)
     where total_intensity is (meth + unmeth + 100) -- to give a score in range of 0 to 1.0.
@@ -47,7 +68,8 @@ def calculate_copy_number(methylated_noob, unmethylated_noob, offset=None):
     return copy_number
 
 
-def consolidate_values_for_sheet(data_containers, postprocess_func_colname='beta_value', bit='float32', poobah=True, poobah_sig=0.05, exclude_rs=True):
+def consolidate_values_for_sheet(data_containers, postprocess_func_colname='beta_value', bit='float32', poobah=True,
+                                 poobah_sig=0.05, exclude_rs=True, object_name=None, apply_quality_mask=True):
     """ Transforms results into a single dataframe with all of the function values,
     with probe names in rows, and sample beta values for probes in columns.
 
@@ -68,42 +90,73 @@ def consolidate_values_for_sheet(data_containers, postprocess_func_colname='beta
             to another type to save disk space. float16 works fine, but might not be compatible
             with all numnpy/pandas functions, or with outside packages, so float32 is default.
             This is specified from methylprep process command line.
+            The returned values are always in this dtype, so with the default they are float32. (Before the
+            matrix was preallocated, the default kept the containers' own dtype, usually float64.)
         poobah
             If true, filters by the poobah_pval column. (beta m_val pass True in for this.)
         data_container.quality_mask (True/False)
             If 'quality_mask' is present in df, True filters these probes from pickle output.
         exclude_rs
             as of v1.5.0 SigSet keeps snp ('rs') probes with other probe types (if qualityMask is false); need to separate them here
-            before exporting to file."""
+            before exporting to file.
+        object_name
+            reads this dataframe attribute of each container (like 'mouse_data_frame')
+            instead of the processed data_frame.
+        apply_quality_mask
+            if False, quality-masked probes are kept (run_pipeline(deferred_masking=True) saves the mask separately)."""
     poobah_column = 'poobah_pval'
     quality_mask = 'quality_mask'
+    dtype = bit if bit in ('float64','float32','float16') else 'float32'
+    # one probes x samples array, in the final dtype, filled one column per sample. Masks are applied to each
+    # sample's column as it is copied in, so the containers' data_frames are not modified.
+    merged = None
+    sample_ids = []
+    misaligned = {} # sample_id --> values, for samples whose probes differ from the first sample's
     for idx,sample in enumerate(data_containers):
         sample_id = f"{sample.sample.sentrix_id}_{sample.sample.sentrix_position}"
-
-        if poobah == True and poobah_column in sample._SampleDataContainer__data_frame.columns:
+        sample_ids.append(sample_id)
+        columns = list(dict.fromkeys([postprocess_func_colname, poobah_column, quality_mask])) # unique, in order
+        if object_name is not None:
+            data_frame = getattr(sample, object_name)
+        elif hasattr(sample, 'read_columns'):
+            data_frame = sample.read_columns(columns) # only loads these columns for spilled containers
+        else:
+            data_frame = sample._SampleDataContainer__data_frame
+        values = data_frame[postprocess_func_colname].to_numpy(dtype=dtype, copy=True)
+
+        if poobah == True and poobah_column in data_frame.columns:
             # remove all failed probes by replacing with NaN before building DF.
-            sample._SampleDataContainer__data_frame.loc[sample._SampleDataContainer__data_frame[poobah_column] >= poobah_sig, postprocess_func_colname] = np.nan
-        elif poobah == True and poobah_column not in sample._SampleDataContainer__data_frame.columns:
+            values[data_frame[poobah_column].to_numpy() >= poobah_sig] = np.nan
+        elif poobah == True and poobah_column not in data_frame.columns:
             LOGGER.warning('DEBUG: missing poobah')
 
-        if sample.quality_mask == True and quality_mask in sample._SampleDataContainer__data_frame.columns:
+        if apply_quality_mask and sample.quality_mask == True and quality_mask in data_frame.columns:
             # blank there probes where quality_mask == 0
-            sample._SampleDataContainer__data_frame.loc[sample._SampleDataContainer__data_frame[quality_mask] == 0, postprocess_func_colname] = np.nan
-
-        this_sample_values = sample._SampleDataContainer__data_frame[postprocess_func_colname]
-
-        if exclude_rs: # dropping rows before exporting
-            mask_snps = (sample._SampleDataContainer__data_frame.index.str.startswith('rs'))
-            this_sample_values = this_sample_values.loc[ ~mask_snps ]
-
-        if idx == 0:
-            merged = pd.DataFrame(this_sample_values, columns=[postprocess_func_colname])
-            merged.rename(columns={postprocess_func_colname: sample_id}, inplace=True)
-            continue
-        merged = pd.concat([merged, this_sample_values], axis=1)
-        merged.rename(columns={postprocess_func_colname: sample_id}, inplace=True)
-    if bit != 'float32' and bit in ('float64','float16'):
-        merged = merged.astype(bit)
+            values[data_frame[quality_mask].to_numpy() == 0] = np.nan
+
+        if merged is None:
+            first_index = data_frame.index
+            # dropping snp ('rs') rows before exporting
+            keep = ~first_index.str.startswith('rs') if exclude_rs else np.ones(len(first_index), dtype=bool)
+            merged = np.full((int(keep.sum()), len(data_containers)), np.nan, dtype=dtype)
+        if data_frame.index is first_index or data_frame.index.equals(first_index):
+            merged[:, idx] = values[keep]
+        else:
+            this_sample_values = pd.Series(values, index=data_frame.index)
+            if exclude_rs:
+                this_sample_values = this_sample_values.loc[ ~data_frame.index.str.startswith('rs') ]
+            misaligned[idx] = this_sample_values
+    if merged is None:
+        return pd.DataFrame(dtype=dtype)
+    merged = pd.DataFrame(merged, index=first_index[keep], columns=sample_ids)
+    if misaligned:
+        # some samples have a different set of probes: include every probe, like an outer join.
+        index = merged.index
+        for this_sample_values in misaligned.values():
+            index = index.append(this_sample_values.index.difference(index, sort=False))
+        merged = merged.reindex(index)
+        for idx, this_sample_values in misaligned.items():
+            merged.iloc[:, idx] = this_sample_values.reindex(index).to_numpy(dtype=dtype)
     return merged
 
 
@@ -154,10 +207,10 @@ Notes:
     # below (snp-->beta) is analogous to:
     # SampleDataContainer._postprocess(input_dataframe, calculate_beta_value, 'beta_value')
     # except that it doesn't use the predefined noob columns.
-    vectorized_func = np.vectorize(calculate_beta_value)
-    SNP['snp_beta'] = vectorized_func(
-        SNP['snp_meth'].values,
-        SNP['snp_unmeth'].values,
+    # calculate_beta_value works on whole arrays; float64 so uint16 intensities don't overflow when summed.
+    SNP['snp_beta'] = calculate_beta_value(
+        SNP['snp_meth'].to_numpy(dtype='float64'),
+        SNP['snp_unmeth'].to_numpy(dtype='float64'),
     )
     SNP = SNP[['snp_beta','snp_meth','snp_unmeth']]
 
@@ -177,54 +230,133 @@ Notes:
     return CONTROL
 
 
-def consolidate_mouse_probes(data_containers, filename_or_fileobj, file_format, object_name='mouse_data_frame', poobah_column='poobah_pval', poobah_sig=0.05):
-    """ these probes have 'Multi'|'Random' in `design` col of mouse manifest. used to populate 'mouse_probes.pkl'.
-    pre v1.4.6: ILLUMINA_MOUSE specific probes (starting with 'rp' for repeat sequence or 'mu' for murine, 'uk' for unknown-experimental)
-    stored as data_container.mouse_data_frame.
-
-    saves as a dataframe just like controls:
-        a dict of dataframes like processed.csv format, but only mouse probes.
-        keys are sample_ids -- values are dataframes"""
-    out = dict()
-    for idx,sample in enumerate(data_containers):
-        sample_id = f"{sample.sample.sentrix_id}_{sample.sample.sentrix_position}"
-        data_frame = getattr(sample, object_name)
-        data_frame = data_frame.round({'noob_meth':0, 'noob_unmeth':0, 'm_value':3, 'beta_value':3, 'cm_value':3,
-            'meth':0, 'unmeth':0, 'poobah_pval':3})
-        out[sample_id] = data_frame
+def mouse_probe_design(data_containers, object_name='mouse_data_frame'):
+    """The `design` of every mouse-specific probe in data_containers, as a one-column dataframe indexed by IlmnID.
+    Saved once per run next to the mouse probe matrices, instead of repeated for every sample."""
+    designs = [getattr(sample, object_name)['design'] for sample in data_containers
+        if 'design' in getattr(sample, object_name).columns]
+    if designs == []:
+        return pd.DataFrame(columns=['design'], index=pd.Index([], name='IlmnID'))
+    design = pd.concat(designs)
+    design = design[~design.index.duplicated()].sort_index().to_frame('design')
+    design.index.name = 'IlmnID'
+    return design
+
+
+def samples_to_long_table(frames):
+    """Combines a dict of per-sample dataframes (control probes) into one table, with the sample in a
+    Sentrix_ID column and the probe names in an IlmnID column, for columnar file formats. Samples without
+    probes (27k arrays have no control probes) are left out."""
+    frames = {sample: frame for sample, frame in frames.items() if len(frame) > 0}
+    if frames == {}:
+        return pd.DataFrame(columns=['Sentrix_ID', 'IlmnID'])
+    table = pd.concat(frames).reset_index() # the multiindex becomes the first two columns, whatever its level names
+    table.columns = ['Sentrix_ID', 'IlmnID'] + list(table.columns[2:])
+    return table.astype({'IlmnID':str})
+
+
+def control_table(control_snps):
+    """Long table (see samples_to_long_table) of a dict of per-sample control/SNP dataframes, for columnar formats.
+    Label columns are categoricals (dictionary-encoded in parquet and feather) and values are float32, so every
+    batch's part has the same columns and dtypes, whether or not its intensities were downcast to integers."""
+    table = samples_to_long_table(control_snps)
+    return _control_dtypes(table)
+
+
+def _control_dtypes(table):
+    for column in table.columns:
+        if column in CONTROL_LABEL_COLUMNS:
+            table[column] = table[column].astype('category')
+        elif pd.api.types.is_numeric_dtype(table[column]):
+            table[column] = table[column].astype('float32')
+    return table
+
+
+def save_control_table(part_files, filepath, file_format, append=False):
+    """Combines the per-batch control/SNP parts (feather files of control_table, written during the run) into one
+    parquet or feather file at filepath. With append, samples already in an existing file there are kept and
+    only new samples are added from the parts."""
+    frames = [read_feather(part) for part in part_files]
+    read_func = pd.read_parquet if file_format == 'parquet' else read_feather
+    if append and Path(filepath).exists():
+        existing = read_func(filepath)
+        known = set(existing['Sentrix_ID'].astype(str))
+        frames = [existing] + [frame[~frame['Sentrix_ID'].astype(str).isin(known)] for frame in frames]
+    # parts have different categories, so concat gives object columns; those are made categorical again.
+    if frames:
+        table = _control_dtypes(pd.concat(frames, ignore_index=True))
+    else:
+        table = pd.DataFrame(columns=['Sentrix_ID', 'IlmnID'])
+    if file_format == 'parquet':
+        table.to_parquet(filepath, index=False)
+    else:
+        write_feather(table, filepath, preserve_index=False)
+    return table
+
+
+def write_feather(df, filepath, preserve_index=True):
+    """Saves df as an uncompressed Feather (Arrow IPC) file in a single record batch, so readers can memory-map
+    it (pyarrow.feather.read_table(path, memory_map=True)) and use each column without copying it.
+    The index is kept (it is restored by pyarrow.feather.read_feather), unlike DataFrame.to_feather."""
+    import pyarrow as pa
+    import pyarrow.feather as feather
+    table = pa.Table.from_pandas(df, preserve_index=preserve_index)
+    temp_path = Path(filepath).with_name(f"_{Path(filepath).name}.tmp")
+    feather.write_feather(table, temp_path, compression='uncompressed', chunksize=max(len(df), 1))
+    os.replace(temp_path, filepath)
+
+
+def read_feather(filepath, columns=None):
+    """Reads a Feather file through a memory-map; columns without missing values are not copied by pyarrow."""
+    import pyarrow.feather as feather
+    return feather.read_table(filepath, columns=columns, memory_map=True).to_pandas()
+
+
+def merge_batches(num_batches, data_dir, filepattern, file_format, append=False, rows_per_chunk=100000,
+                  compression='snappy'):
+    """for each of the output pickle file types,
+    this will merge the _1, _2, ..._X batches into a single file in data_dir.
 
-    if is_file_like(filename_or_fileobj): # and file_format == 'pickle':
-        pickle.dump(out, filename_or_fileobj)
-    #elif is_file_like(filename_or_fileobj) and file_format == 'parquet':
+    Parts are read one at a time and their values streamed into a temporary memory-mapped file, so peak memory
+    is about one part rather than the whole merged matrix. Probe order comes from the first part, and only probes
+    found in every part are kept (like an inner join). Parquet output is then written in row groups of
+    rows_per_chunk probes (and split by chromosome, if sorted by position -- see sort_by_position), using
+    compression; pickle output is written straight from the memory-mapped values.
 
-    else: #except TypeError: # File must have a write attribute
-        with open(filename_or_fileobj, 'wb') as f:
-            pickle.dump(out, f)
-    return
+    if append is True and a merged file from an earlier run already exists, the merged batches are
+    appended to it as new sample columns (see append_columns) instead of replacing it.
 
-def merge_batches(num_batches, data_dir, filepattern, file_format):
-    """for each of the output pickle file types,
-    this will merge the _1, _2, ..._X batches into a single file in data_dir.
+    npy block stores (file_format='npy') are merged by moving each part's block files into one store, without
+    reading or copying the values.
     """
-    dfs = []
-    suffix = 'parquet' if file_format == 'parquet' else 'pkl'
-    for num in range(num_batches):
+    if file_format == 'npy':
+        return _merge_matrix_stores(num_batches, data_dir, filepattern, append=append)
+    suffix = {'parquet': 'parquet', 'feather': 'feather'}.get(file_format, 'pkl')
+    read_func = {'parquet': pd.read_parquet, 'feather': read_feather}.get(file_format, pd.read_pickle)
+    parts = [Path(data_dir, f"{filepattern}_{num+1}.{suffix}") for num in range(num_batches)]
+    parts = [part for part in parts if part.exists()] # pipeline passes in all filenames, but not all exist
+    outfile_name = Path(data_dir, f"{filepattern}.{suffix}")
+    temp_values = Path(data_dir, f"_merge_{filepattern}.values")
+    if parts:
         try:
-            filename = f"{filepattern}_{num+1}.{suffix}"
-            part = Path(data_dir, filename)
-            if part.exists() and file_format == 'parquet':
-                dfs.append( pd.read_parquet(part) )
-            elif part.exists():
-                dfs.append( pd.read_pickle(part) )
+            merged = _stream_parts(parts, read_func, temp_values)
         except Exception as e:
-            LOGGER.error(f'error merging batch {num} of {filepattern}')
-    if dfs: # pipeline passes in all filenames, but not all exist
-        dfs = pd.concat(dfs, axis='columns', join='inner')
-        outfile_name = Path(data_dir, f"{filepattern}.{suffix}")
-        LOGGER.info(f"{filepattern}: {dfs.shape}")
-        func = dfs.to_parquet if file_format == 'parquet' else dfs.to_pickle
-        func(str(outfile_name))
-        del dfs # save memory.
+            LOGGER.error(f'error merging batches of {filepattern}: {e}')
+            temp_values.unlink(missing_ok=True)
+            return
+        if merged is None:
+            return
+        LOGGER.info(f"{filepattern}: {merged.shape}")
+        if append and outfile_name.exists():
+            append_columns(outfile_name, merged, file_format, compression=compression)
+        elif file_format == 'parquet':
+            _write_parquet_in_row_groups(merged, outfile_name, rows_per_chunk, compression=compression)
+        elif file_format == 'feather':
+            write_feather(merged, outfile_name)
+        else:
+            merged.to_pickle(str(outfile_name))
+        del merged # save memory, and release the memory-mapped file.
+        temp_values.unlink(missing_ok=True)
 
         # confirm file saved ok.
         if not Path(outfile_name).exists():
@@ -232,8 +364,251 @@ def merge_batches(num_batches, data_dir, filepattern, file_format):
             return
 
     # now delete the parts
-    for num in range(num_batches):
-        filename = f"{filepattern}_{num+1}.{suffix}"
-        part = Path(data_dir, filename)
+    for part in parts:
         if part.exists():
             part.unlink() # delete it
+
+
+def _merge_matrix_stores(num_batches, data_dir, filepattern, append=False):
+    parts = [Path(data_dir, f"{filepattern}_{num+1}.{MATRIX_STORE_SUFFIX}") for num in range(num_batches)]
+    parts = [part for part in parts if part.exists()]
+    if parts == []:
+        return
+    outfile_name = Path(data_dir, f"{filepattern}.{MATRIX_STORE_SUFFIX}")
+    if append and outfile_name.exists():
+        merged = MatrixStore(outfile_name)
+    else:
+        if outfile_name.exists():
+            shutil.rmtree(outfile_name)
+        os.replace(parts.pop(0), outfile_name) # the first part becomes the merged store
+        merged = MatrixStore(outfile_name)
+    for part in parts:
+        try:
+            merged.merge(part)
+        except Exception as e:
+            LOGGER.error(f'error merging {part.name}: {e}')
+    LOGGER.info(f"{filepattern}: {merged.shape}")
+
+
+def _stream_parts(parts, read_func, temp_values):
+    """Reads each part (probes x samples) in turn and appends its values to temp_values, one row per sample.
+    Returns a DataFrame backed by a memory-map of that file."""
+    index = None
+    columns = []
+    found_in_all = None
+    dtype = None
+    temp_values.write_bytes(b'')
+    for num, part_file in enumerate(parts):
+        try:
+            part = read_func(part_file)
+        except Exception as e:
+            LOGGER.error(f'error merging batch {num} of {part_file.name}: {e}')
+            continue
+        if index is None:
+            index = part.index
+            found_in_all = np.ones(len(index), dtype=bool)
+            dtype = part.values.dtype
+        if not np.can_cast(part.values.dtype, dtype, casting='safe'):
+            # e.g. an earlier part was uint16 (no NaNs) and this one is float32; rewrite what's saved so far.
+            new_dtype = np.result_type(dtype, part.values.dtype)
+            _recast_values_file(temp_values, dtype, new_dtype, len(index))
+            dtype = new_dtype
+        # one row per sample, in the first part's probe order (pandas stores blocks this way too, so
+        # this transpose is usually a view and not a copy)
+        values = part.to_numpy(dtype=dtype).T
+        if not part.index.equals(index):
+            indexer = part.index.get_indexer(index)
+            matched = indexer != -1
+            found_in_all &= matched
+            block = np.zeros((values.shape[0], len(index)), dtype=dtype)
+            block[:, matched] = values[:, indexer[matched]]
+            values = block
+        with open(temp_values, 'ab') as values_file:
+            values_file.write(memoryview(np.ascontiguousarray(values)))
+        columns.extend(part.columns)
+        del part, values
+    if index is None:
+        temp_values.unlink()
+        return None
+    values = np.memmap(temp_values, dtype=dtype, mode='r+', shape=(len(columns), len(index)))
+    if not found_in_all.all():
+        # drop probes missing from any part, one sample at a time into a smaller file.
+        kept_file = temp_values.with_suffix('.kept')
+        kept = np.memmap(kept_file, dtype=dtype, mode='w+', shape=(len(columns), int(found_in_all.sum())))
+        for row in range(len(columns)):
+            kept[row] = values[row, found_in_all]
+        kept.flush()
+        del values, kept
+        os.replace(kept_file, temp_values)
+        index = index[found_in_all]
+        values = np.memmap(temp_values, dtype=dtype, mode='r+', shape=(len(columns), len(index)))
+    # transposed view: probes in rows; DataFrame keeps it as one block without copying.
+    return pd.DataFrame(values.view(np.ndarray).T, index=index, columns=columns, copy=False)
+
+
+def _recast_values_file(path, dtype, new_dtype, num_probes):
+    """Rewrites a raw values file (rows of num_probes) in a wider dtype, one row at a time."""
+    old_values = np.memmap(path, dtype=dtype, mode='r')
+    num_rows = old_values.shape[0] // num_probes
+    temp_path = Path(path).with_suffix('.recast')
+    new_values = np.memmap(temp_path, dtype=new_dtype, mode='w+', shape=(num_rows, num_probes))
+    for row in range(num_rows):
+        new_values[row] = old_values[row*num_probes:(row+1)*num_probes]
+    new_values.flush()
+    del old_values, new_values
+    os.replace(temp_path, path)
+
+
+def sort_by_position(df, manifest_data_frame):
+    """Orders an output matrix (IlmnID in rows) by chromosome, then MAPINFO, and adds CHR and MAPINFO from the
+    manifest as index levels. Saved to parquet, each row group then covers one chromosome and a narrow range of
+    positions, and its column statistics let region queries skip the rest of the file (see load_values).
+    Probes without a position are placed last."""
+    positions = manifest_data_frame[['CHR', 'MAPINFO']].reindex(df.index)
+    chromosome = positions['CHR'].astype(str).str.replace('chr', '', regex=False)
+    numeric = pd.to_numeric(chromosome, errors='coerce')
+    mapinfo = pd.to_numeric(positions['MAPINFO'], errors='coerce')
+    # 1-22 in numeric order, then X, Y, M, and anything else alphabetically; unmapped probes last.
+    order = pd.DataFrame({
+        'unmapped': positions['CHR'].isna().to_numpy(),
+        'named': numeric.isna().to_numpy(),
+        'number': numeric.to_numpy(),
+        'chromosome': chromosome.to_numpy(),
+        'mapinfo': mapinfo.to_numpy(),
+    }, index=df.index)
+    order = order.sort_values(['unmapped', 'named', 'number', 'chromosome', 'mapinfo'], kind='stable').index
+    df = df.reindex(order)
+    df.index = pd.MultiIndex.from_arrays([order, positions['CHR'].reindex(order).astype(object),
+        mapinfo.reindex(order).astype('Int64')], names=[df.index.name or 'IlmnID', 'CHR', 'MAPINFO'])
+    return df
+
+
+def _chromosome_chunks(df, rows_per_chunk):
+    """Splits df into row chunks of at most rows_per_chunk,
+    never spanning two chromosomes (if CHR is an index level)."""
+    if 'CHR' in (df.index.names or []):
+        chromosomes = df.index.get_level_values('CHR')
+        boundaries = [0] + list(np.flatnonzero(chromosomes[1:] != chromosomes[:-1]) + 1) + [len(df)]
+    else:
+        boundaries = [0, len(df)]
+    for segment_start, segment_end in zip(boundaries[:-1], boundaries[1:]):
+        for start in range(segment_start, max(segment_end, segment_start + 1), rows_per_chunk):
+            yield df.iloc[start:min(start + rows_per_chunk, segment_end)]
+
+
+def _write_parquet_in_row_groups(df, filepath, rows_per_chunk=100000, compression='snappy'):
+    """Writes a (memory-mapped) DataFrame to parquet, rows_per_chunk probes at a time, without copying it all.
+    Each chunk is a row group with min/max statistics; chunks do not span chromosomes."""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    writer = None
+    temp_path = Path(filepath).with_name(f"_{Path(filepath).name}.tmp")
+    # from the whole frame, since one chunk's CHR values could all be missing (null type)
+    schema = pa.Schema.from_pandas(df, preserve_index=True)
+    try:
+        for chunk in _chromosome_chunks(df, rows_per_chunk):
+            table = pa.Table.from_pandas(chunk, schema=schema, preserve_index=True)
+            if writer is None:
+                writer = pq.ParquetWriter(temp_path, table.schema, compression=compression, write_statistics=True)
+            writer.write_table(table, row_group_size=rows_per_chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    os.replace(temp_path, filepath)
+
+
+def _probe_names(index):
+    return index.get_level_values(0) if isinstance(index, pd.MultiIndex) else index
+
+
+def existing_sample_ids(data_dir, file_format):
+    """Returns the set of sample_ids (Sentrix_ID_Sentrix_Position) already saved in data_dir's processed
+    output matrices (beta_values, m_values, noob_meth_values, ...), or an empty set if there are none.
+    Parquet files and npy block stores only have their schema/index read;
+    pickles must be loaded to see their columns."""
+    suffix = {'parquet': 'parquet', 'npy': MATRIX_STORE_SUFFIX, 'feather': 'feather'}.get(file_format, 'pkl')
+    for file_type in APPENDABLE_FILE_TYPES:
+        filepath = Path(data_dir, f"{file_type}.{suffix}")
+        if not filepath.exists():
+            continue
+        if file_format == 'npy':
+            return set(MatrixStore(filepath).samples)
+        if file_format == 'feather':
+            import pyarrow.feather as feather
+            schema = feather.read_table(filepath, memory_map=True).schema # reads only the schema and buffer locations
+            index_columns = (schema.pandas_metadata or {}).get('index_columns', [])
+            return set(name for name in schema.names if name not in index_columns)
+        if file_format == 'parquet':
+            import pyarrow.parquet as pq
+            schema = pq.read_schema(filepath)
+            index_columns = (schema.pandas_metadata or {}).get('index_columns', [])
+            return set(name for name in schema.names if name not in index_columns)
+        data = pd.read_pickle(filepath)
+        return set(data.columns)
+    return set()
+
+
+def append_columns(filepath, df, file_format, rows_per_chunk=50000, compression='snappy'):
+    """Appends the sample columns in df to an existing output matrix (probes in rows, samples in columns).
+
+    - Columns (samples) already in the file are skipped, and new samples are aligned to the file's probe
+      index; probes not in the file are dropped and probes missing from df become NaN.
+    - parquet files are streamed through in chunks of rows_per_chunk probes and rewritten with the extra
+      columns, so the stored matrix is never fully loaded into memory.
+    - pickles cannot be partially read, so these are loaded, joined, and rewritten.
+    - npy block stores get the new samples as another block; existing blocks are not touched.
+    - feather files are memory-mapped, joined with the new columns, and rewritten.
+    The file is replaced atomically, via a temp file in the same folder.
+    """
+    filepath = Path(filepath)
+    if file_format == 'npy':
+        added = MatrixStore(filepath).append(df)
+        LOGGER.info(f"{filepath.name}: appended {len(added)} block(s)")
+        return
+    temp_path = filepath.with_name(f"_{filepath.name}.tmp")
+    if file_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(filepath)
+        index_columns = (parquet_file.schema_arrow.pandas_metadata or {}).get('index_columns', [])
+        new_samples = [col for col in df.columns if col not in parquet_file.schema_arrow.names]
+        if new_samples == []:
+            LOGGER.info(f"{filepath.name}: no new samples to append")
+            return
+        writer = None
+        try:
+            for batch in parquet_file.iter_batches(batch_size=rows_per_chunk):
+                chunk = batch.to_pandas()
+                # match on IlmnID, in case only one of these has CHR and MAPINFO index levels (see sort_by_position)
+                new_values = df[new_samples].set_axis(_probe_names(df.index), axis='index')
+                chunk[new_samples] = new_values.reindex(_probe_names(chunk.index)).to_numpy()
+                for row_group in _chromosome_chunks(chunk, rows_per_chunk):
+                    table = pa.Table.from_pandas(row_group, preserve_index=bool(index_columns),
+                        schema=writer.schema if writer is not None else None)
+                    if writer is None:
+                        writer = pq.ParquetWriter(temp_path, table.schema, compression=compression,
+                                                  write_statistics=True)
+                    writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+        os.replace(temp_path, filepath)
+        LOGGER.info(f"{filepath.name}: appended {len(new_samples)} samples")
+        return
+
+    if file_format == 'feather':
+        existing = read_feather(filepath)
+        new_samples = [col for col in df.columns if col not in existing.columns]
+        if new_samples:
+            write_feather(existing.join(df[new_samples]), filepath)
+        del existing
+        LOGGER.info(f"{filepath.name}: appended {len(new_samples)} samples")
+        return
+
+    existing = pd.read_pickle(filepath)
+    new_samples = [col for col in df.columns if col not in existing.columns]
+    existing = existing.join(df[new_samples]) if new_samples else existing
+    existing.to_pickle(temp_path)
+    del existing
+    os.replace(temp_path, filepath)
+    LOGGER.info(f"{filepath.name}: appended {len(new_samples)} samples")
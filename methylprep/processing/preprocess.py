@@ -6,11 +6,9 @@
 import logging
 import numpy as np
 import pandas as pd
-from statsmodels import robust
-from scipy.stats import norm, lognorm
 # App
 from ..models import ControlType, ArrayType
-from ..models.sketchy_probes import qualityMask450, qualityMaskEPIC, qualityMaskEPICPLUS, qualityMaskmouse
+from ..models.sketchy_probes import quality_mask_probes, QUALITY_MASK_ARRAYS
 
 
 __all__ = ['preprocess_noob']
@@ -199,7 +197,7 @@ def apply_bg_correction(mean_values, params):
     #    signal = signal_part_one * signal_part_two
     #except:
     #    print(signal_part_one, norm(mu_sf, bg_mad).logpdf(0),  norm(mu_sf, bg_mad).logsf(0))
-    # norm is from scipy.stats
+    from scipy.stats import norm # imported here, as scipy.stats is slow to import
     signal = mu_sf + (bg_mad ** 2) * np.exp(norm(mu_sf, bg_mad).logpdf(0) - norm(mu_sf, bg_mad).logsf(0))
 
     """ COMPARE with sesame:
@@ -235,6 +233,7 @@ def huber(vector):
     num_values = len(vector)
     positive_factor = 1.5
     convergence_tol = 1.0e-6
+    from statsmodels import robust # imported here, as statsmodels is slow to import
     mad_scale = robust.mad(vector)
     local_median = np.median(vector)
     init_local_median = local_median
@@ -259,7 +258,7 @@ def huber(vector):
         local_median = init_local_median
 
 
-def _apply_sesame_quality_mask(data_container):
+def _apply_sesame_quality_mask(data_container, quality_mask=None):
     """ adapted from sesame's qualityMask function, which is applied just after poobah
     to remove probes Wanding thinks are sketchy.
     OUTPUT: this pandas DataFrame will have NaNs for probes to be excluded and 0.0 for probes to be retained. NaNs converted to 1.0 in final processing output.
@@ -268,33 +267,20 @@ def _apply_sesame_quality_mask(data_container):
         masked <- sesameDataGet(paste0(sset@platform, '.probeInfo'))$mask
         to use TCGA masking, only applies to HM450
 
+    quality_mask -- the (index, masked) pair from Manifest.get_quality_mask(); if None, the mask's probe names
+        are matched to the container's probes here.
     """
-    if data_container.array_type not in (
-        # ArrayType.ILLUMINA_27K,
-        ArrayType.ILLUMINA_450K,
-        ArrayType.ILLUMINA_EPIC,
-        ArrayType.ILLUMINA_EPIC_PLUS,
-        ArrayType.ILLUMINA_MOUSE):
+    if data_container.array_type not in QUALITY_MASK_ARRAYS: # 27k and custom arrays have none
         LOGGER.info(f"Quality masking is not supported for {data_container.array_type}.")
         return
-    # load set of probes to remove from local file
-    if data_container.array_type == ArrayType.ILLUMINA_450K:
-        probes = qualityMask450
-    elif data_container.array_type == ArrayType.ILLUMINA_EPIC:
-        probes = qualityMaskEPIC
-    elif data_container.array_type == ArrayType.ILLUMINA_EPIC_PLUS:
-        # this is a bit of a hack; probe names don't match epic, so I'm temporarily renaming, then filtering, then reverting.
-        probes = qualityMaskEPICPLUS
-    elif data_container.array_type == ArrayType.ILLUMINA_MOUSE:
-        probes = qualityMaskmouse
+    if quality_mask is not None:
+        index, masked = quality_mask
+    else:
+        index = data_container.man.index.append(data_container.snp_man.index)
+        masked = index.isin(quality_mask_probes(QUALITY_MASK_ARRAYS[data_container.array_type]))
 
     # v1.6+: the 1.0s are good probes and the 0.0 are probes to be excluded.
-    cgs = pd.DataFrame( np.zeros((len(data_container.man.index), 1)), index=data_container.man.index, columns=['quality_mask'])
-    cgs['quality_mask'] = 1.0
-    snps = pd.DataFrame( np.zeros((len(data_container.snp_man.index), 1)), index=data_container.snp_man.index, columns=['quality_mask'])
-    snps['quality_mask'] = 1.0
-    df = pd.concat([cgs, snps])
-    df.loc[df.index.isin(probes), 'quality_mask'] = 0
+    df = pd.DataFrame({'quality_mask': np.where(masked, 0.0, 1.0)}, index=index)
     #LOGGER.info(f"DEBUG quality_mask: {df.shape}, {df['quality_mask'].value_counts()} from {probes.shape} probes")
     return df
 
@@ -0,0 +1,149 @@
+# Lib
+import json
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from pathlib import Path
+try:
+    import resource # unix only; used for the peak RSS
+except ImportError:
+    resource = None
+# App
+from .memory import current_rss
+
+
+__all__ = ['RunProfiler', 'read_profile', 'summarize_profile', 'PROFILE_FILENAME']
+
+LOGGER = logging.getLogger(__name__)
+
+PROFILE_FILENAME = 'methylprep_profile.jsonl'
+MB = 1024 ** 2
+
+
+def _peak_rss():
+    """The process's highest RSS so far, in bytes (None where unavailable)."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # kilobytes on linux
+
+
+class RunProfiler():
+    """Times each stage of run_pipeline (per batch and per sample) and records its memory use, for
+    run_pipeline(profile=True) or `methylprep process --profile`.
+
+    Each stage is one line of json in data_dir/methylprep_profile.jsonl, written as it finishes:
+        stage, batch, sample -- which stage, and of what; stages nest (a sample's noob is part of its batch).
+        wall_s, cpu_s -- elapsed and CPU (user + system, all threads) seconds.
+        rss_mb, rss_delta_mb -- resident memory after the stage, and how much it changed during it.
+        peak_rss_mb -- the process's highest resident memory so far (a stage that raised it set a new peak).
+        traced_peak_mb -- only if tracemalloc is tracing (e.g. PYTHONTRACEMALLOC=1): the peak of python
+            allocations during the stage, above what was allocated when it started.
+    A disabled profiler records nothing, and its stages cost about as much as an empty `with` block.
+    """
+
+    def __init__(self, data_dir=None, enabled=True, append=False):
+        self.enabled = enabled
+        self.records = []
+        self.path = Path(data_dir, PROFILE_FILENAME) if (enabled and data_dir is not None) else None
+        self._open = [] # stages started and not yet stopped
+        if self.path is not None and not append:
+            self.path.write_text('')
+
+    def start(self, stage, **labels):
+        """Starts timing a stage; returns a token for stop(). For stages too long for a `with` block."""
+        if not self.enabled:
+            return None
+        traced = None
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            if self._open and self._open[-1]['traced'] is not None: # the enclosing stage keeps its peak so far
+                self._open[-1]['traced_peak'] = max(self._open[-1]['traced_peak'], peak)
+            tracemalloc.reset_peak()
+            traced = current
+        token = {'stage': stage, 'labels': labels, 'rss': current_rss(), 'traced': traced, 'traced_peak': 0,
+            'wall': time.perf_counter(), 'cpu': time.process_time()}
+        self._open.append(token)
+        return token
+
+    def stop(self, token):
+        if token is None:
+            return None
+        wall = time.perf_counter() - token['wall']
+        cpu = time.process_time() - token['cpu']
+        rss = current_rss()
+        peak_rss = _peak_rss()
+        labels = {key: value for key, value in token['labels'].items() if value is not None}
+        record = {'stage': token['stage'], **labels,
+            'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4),
+            'rss_mb': None if rss is None else round(rss / MB, 1),
+            'rss_delta_mb': None if (rss is None or token['rss'] is None) else round((rss - token['rss']) / MB, 1),
+            'peak_rss_mb': None if peak_rss is None else round(peak_rss / MB, 1)}
+        if token['traced'] is not None and tracemalloc.is_tracing():
+            token['traced_peak'] = max(token['traced_peak'], tracemalloc.get_traced_memory()[1])
+            record['traced_peak_mb'] = round(max(token['traced_peak'] - token['traced'], 0) / MB, 1)
+        if token in self._open:
+            self._open.remove(token)
+        if self._open and token['traced'] is not None and self._open[-1]['traced'] is not None:
+            self._open[-1]['traced_peak'] = max(self._open[-1]['traced_peak'], token['traced_peak'])
+            tracemalloc.reset_peak()
+        self.records.append(record)
+        if self.path is not None:
+            with open(self.path, 'a') as profile_file:
+                profile_file.write(json.dumps(record) + '\n')
+        return record
+
+    @contextmanager
+    def _stage(self, stage, **labels):
+        token = self.start(stage, **labels)
+        try:
+            yield
+        finally:
+            self.stop(token)
+
+    def stage(self, stage, **labels):
+        """A context manager that times the code inside it as stage (with labels like batch=1, sample='...')."""
+        if not self.enabled:
+            return nullcontext()
+        return self._stage(stage, **labels)
+
+    def __getstate__(self):
+        # containers keep a reference to the profiler; pickling them should not copy every record.
+        return {**self.__dict__, 'records': [], '_open': []}
+
+
+def read_profile(data_dir):
+    """The records of data_dir/methylprep_profile.jsonl, as a list of dicts."""
+    filepath = Path(data_dir, PROFILE_FILENAME)
+    if not filepath.exists():
+        return []
+    with open(filepath) as profile_file:
+        return [json.loads(line) for line in profile_file if line.strip()]
+
+
+def summarize_profile(records):
+    """A text table of the time and memory of each stage, totalled over batches and samples, in run order."""
+    if not records:
+        return 'No profile records.'
+    stages = {}
+    for record in records:
+        totals = stages.setdefault(record['stage'],
+            {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rss_delta_mb': None, 'peak_rss_mb': None})
+        totals['count'] += 1
+        totals['wall_s'] += record['wall_s']
+        totals['cpu_s'] += record['cpu_s']
+        for key in ('rss_delta_mb', 'peak_rss_mb'):
+            if record.get(key) is not None:
+                totals[key] = record[key] if totals[key] is None else max(totals[key], record[key])
+    run_wall = stages['run']['wall_s'] if 'run' in stages else None
+    width = max(len(stage) for stage in stages)
+    lines = [f"{'stage':<{width}}  {'calls':>5}  {'wall s':>8}  {'mean s':>7}  "
+        f"{'cpu s':>8}  {'% run':>5}  {'max +MB':>7}  {'peak MB':>7}"]
+    for stage, totals in stages.items():
+        share = f"{100 * totals['wall_s'] / run_wall:5.1f}" if run_wall else '    -'
+        delta = '-' if totals['rss_delta_mb'] is None else f"{totals['rss_delta_mb']:.0f}"
+        peak = '-' if totals['peak_rss_mb'] is None else f"{totals['peak_rss_mb']:.0f}"
+        mean = totals['wall_s'] / totals['count']
+        lines.append(f"{stage:<{width}}  {totals['count']:>5}  {totals['wall_s']:>8.2f}  {mean:>7.3f}  "
+            f"{totals['cpu_s']:>8.2f}  {share:>5}  {delta:>7}  {peak:>7}")
+    return '\n'.join(lines)
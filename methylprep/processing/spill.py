@@ -0,0 +1,123 @@
+# Lib
+import hashlib
+import logging
+import pickle
+import shutil
+import weakref
+import numpy as np
+import pandas as pd
+from pathlib import Path
+
+
+__all__ = ['SpillStore', 'SPILL_DIRNAME']
+
+LOGGER = logging.getLogger(__name__)
+
+SPILL_DIRNAME = '_temp_spill'
+# processed sample attributes that are worth keeping with the spilled data (settings and the Sample itself);
+# probe subsets, idats, and manifests are not needed once the batch's output files are saved.
+SCALAR_TYPES = (bool, int, float, str, type(None))
+
+
+class SpillStore():
+    """Holds each processed sample's data_frame on disk between batches, so run_pipeline does not need to keep
+    (or pickle) whole SampleDataContainer objects.
+
+    Layout, inside `data_dir/_temp_spill/`:
+        {sample_id}/{column}.npy -- one numpy array per data_frame column (memory-mappable)
+        index_{hash}.npy -- probe names (IlmnID), shared by every sample with the same probes
+        batch_{N}.pkl -- for each sample in batch N: its Sample, scalar settings, and which files hold its data
+
+    Float64 columns are saved as float32 (or float64, if bit='float64') to halve the size, matching the
+    precision of the saved output files.
+
+    load_batch() returns SpilledSampleDataContainer objects, which only read their data_frame from disk when
+    it is first used. The folder is deleted by remove(), or -- after remove_when_unused() -- once the store and
+    every container loaded from it are garbage collected. Until then it stays on disk, so an interrupted run
+    can be resumed from it.
+    """
+
+    def __init__(self, data_dir, bit='float32'):
+        self.path = Path(data_dir, SPILL_DIRNAME)
+        self.float_dtype = 'float64' if bit == 'float64' else 'float32'
+        self._indexes = {} # hash --> filename, for index arrays already written
+        self._index_cache = {} # filename --> pd.Index; samples with the same probes share one Index object
+        self._last_index = (None, None) # (pd.Index, filename) of the last index written
+        self._finalizer = None
+
+    def remove_when_unused(self):
+        """Deletes the folder when this store, and every lazy container holding a reference to it, is gone."""
+        if self._finalizer is None:
+            self._finalizer = weakref.finalize(self, shutil.rmtree, str(self.path), True)
+
+    def batch_filename(self, batch_num):
+        """path of the batch file, relative to data_dir (for the run journal)."""
+        return f"{SPILL_DIRNAME}/batch_{batch_num}.pkl"
+
+    def _write_index(self, index):
+        if index is self._last_index[0]: # samples in the manifest's probe order share one Index object
+            return self._last_index[1]
+        names = np.asarray(index, dtype=bytes) # probe names are ascii; 1 byte per character instead of 4.
+        digest = hashlib.sha1(names.tobytes() + str(names.dtype).encode()).hexdigest()[:16]
+        if digest not in self._indexes:
+            filename = f"index_{digest}.npy"
+            if not Path(self.path, filename).exists():
+                np.save(Path(self.path, filename), names)
+            self._indexes[digest] = filename
+        self._last_index = (index, self._indexes[digest])
+        return self._indexes[digest]
+
+    def write_batch(self, batch_num, data_containers):
+        """Saves each container's data_frame and settings. Returns the files written, relative to data_dir."""
+        self.path.mkdir(exist_ok=True)
+        records = []
+        artifacts = []
+        for container in data_containers:
+            data_frame = container._SampleDataContainer__data_frame
+            sample_id = f"{container.sample.sentrix_id}_{container.sample.sentrix_position}"
+            sample_dir = Path(self.path, sample_id)
+            sample_dir.mkdir(exist_ok=True)
+            for column in data_frame.columns:
+                values = data_frame[column].to_numpy()
+                if values.dtype == 'float64':
+                    values = values.astype(self.float_dtype)
+                np.save(Path(sample_dir, f"{column}.npy"), values)
+            index_file = self._write_index(data_frame.index)
+            records.append({
+                'sample_id': sample_id,
+                'columns': list(data_frame.columns),
+                'index_file': index_file,
+                'index_name': data_frame.index.name,
+                'sample': container.sample,
+                'attributes': {key: value for key, value in vars(container).items()
+                    if isinstance(value, SCALAR_TYPES) and not key.startswith('_')},
+            })
+            artifacts.extend([f"{SPILL_DIRNAME}/{sample_id}", f"{SPILL_DIRNAME}/{index_file}"])
+        with open(Path(self.path, f"batch_{batch_num}.pkl"), 'wb') as batch_file:
+            pickle.dump(records, batch_file)
+        artifacts.append(self.batch_filename(batch_num))
+        return artifacts
+
+    def load_batch(self, batch_num):
+        """Returns a list of SpilledSampleDataContainers for batch_num. Nothing is read but the batch file."""
+        from .pipeline import SpilledSampleDataContainer # pipeline imports this module
+        with open(Path(self.path, f"batch_{batch_num}.pkl"), 'rb') as batch_file:
+            records = pickle.load(batch_file)
+        return [SpilledSampleDataContainer(self, record) for record in records]
+
+    def read_index(self, record):
+        if record['index_file'] not in self._index_cache:
+            names = np.load(Path(self.path, record['index_file']))
+            self._index_cache[record['index_file']] = pd.Index(names.astype(str).astype(object),
+                                                               name=record['index_name'])
+        return self._index_cache[record['index_file']]
+
+    def read_column(self, record, column, mmap_mode='r'):
+        """One column of a sample's data_frame, as a (read-only, memory-mapped) numpy array."""
+        return np.load(Path(self.path, record['sample_id'], f"{column}.npy"), mmap_mode=mmap_mode)
+
+    def remove(self):
+        if self._finalizer is not None:
+            self._finalizer() # runs rmtree once, and detaches
+        elif self.path.exists():
+            shutil.rmtree(self.path, ignore_errors=True)
@@ -0,0 +1,153 @@
+# Lib
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from pathlib import Path
+# App
+from ..models import Channel, ArrayType, SigSet
+from ..files import IdatDataset
+from ..utils.progress_bar import * # checks environment and imports tqdm appropriately.
+
+
+__all__ = ['StageCache', 'manifest_key', 'STAGE_CACHE_DIRNAME']
+
+LOGGER = logging.getLogger(__name__)
+
+STAGE_CACHE_DIRNAME = '_stage_cache'
+STAGE_CACHE_VERSION = 1
+# the probe subsets that make up a SigSet's state; preprocessing (noob) updates all of them.
+SIGSET_SUBSETS = list(SigSet.subsets) + ['ctrl_green', 'ctrl_red']
+SIGSET_FLAGS = ['_SigSet__preprocessed', '_SigSet__bg_corrected', '_SigSet__minfi_noob', '_SigSet__linear_dye',
+    '_SigSet__dye_bias_corrected']
+
+
+class StageCache():
+    """Keeps each sample's intermediate processing results on disk, so that re-running make_pipeline with different
+    downstream settings starts from the deepest stage whose inputs did not change, instead of from the IDATs.
+
+    Stages, in order, with what each result depends on:
+        raw -- the green and red IDAT probe means. The IDAT files (name, size, modification time) and bit.
+        sigset -- the SigSet probe subsets, after channel-switch inference. raw, the manifest, and whether
+            infer_channel_switch runs.
+        noob -- the SigSet probe subsets after background correction, with the poobah p-values and quality mask
+            used. sigset, plus poobah, poobah_sig, pNegECDF, quality_mask, noob, linear (vs nonlinear) dye-bias,
+            and sesame's offsets.
+    So changing poobah_sig or quality_mask resumes from sigset (no IDAT reading or channel inference), and
+    switching between nonlinear dye-bias correction and none resumes after noob.
+
+    Layout, inside `data_dir/_stage_cache/`:
+        {sample_id}/{stage}-{key}.pkl -- one file per stage; key is a hash of everything the stage depends on.
+    Only the latest result of each stage is kept per sample. The cache is kept between runs; delete the folder
+    (or call clear()) to free the space. A cached sigset or noob stage is about the size of a pickled SigSet.
+    """
+
+    def __init__(self, data_dir):
+        self.path = Path(data_dir, STAGE_CACHE_DIRNAME)
+
+    @staticmethod
+    def key(*parts, **params):
+        """A short hash of parts and params, which must be json-serializable (or convertible with str)."""
+        text = json.dumps([STAGE_CACHE_VERSION, parts, sorted(params.items())], default=str)
+        return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+    def load(self, sample_id, stage, key):
+        filepath = Path(self.path, sample_id, f"{stage}-{key}.pkl")
+        if not filepath.exists():
+            return None
+        try:
+            with open(filepath, 'rb') as cache_file:
+                return pickle.load(cache_file)
+        except Exception as e: # a partly-written or outdated file is a cache miss
+            LOGGER.warning(f"Ignoring unreadable stage cache file {filepath.name}: {e}")
+            return None
+
+    def save(self, sample_id, stage, key, data):
+        folder = Path(self.path, sample_id)
+        folder.mkdir(parents=True, exist_ok=True)
+        for old_file in folder.glob(f"{stage}-*.pkl"):
+            old_file.unlink()
+        temp_path = Path(folder, f"_{stage}-{key}.tmp")
+        with open(temp_path, 'wb') as cache_file:
+            pickle.dump(data, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, Path(folder, f"{stage}-{key}.pkl"))
+
+    def clear(self):
+        if self.path.exists():
+            shutil.rmtree(self.path)
+
+    def for_sample(self, sample_id, *parts):
+        """A SampleStageCache for one sample, whose stage keys also depend on parts (like the raw key and manifest)."""
+        return SampleStageCache(self, sample_id, parts)
+
+    def read_idat_datasets(self, sample_sheet, sample_names, bit='float32'):
+        """Like parse_sample_sheet_into_idat_datasets, but IDATs already in the cache (unchanged since) are not
+        read again. Each dataset also gets its 'cache_key', for the later stages."""
+        idat_datasets = []
+        for sample_name in tqdm(sample_names, total=len(sample_names), desc='Reading IDATs'):
+            sample = sample_sheet.get_sample(sample_name)
+            sample_id = f"{sample.sentrix_id}_{sample.sentrix_position}"
+            filepaths = {channel: sample.get_filepath('idat', channel) for channel in (Channel.GREEN, Channel.RED)}
+            key = self.key('raw', bit, [(Path(filepath).name, os.stat(filepath).st_size, os.stat(filepath).st_mtime_ns)
+                for filepath in filepaths.values()])
+            cached = self.load(sample_id, 'raw', key)
+            if cached is None:
+                idats = {channel: IdatDataset(filepath, channel=channel, bit=bit)
+                         for channel, filepath in filepaths.items()}
+                self.save(sample_id, 'raw', key, {str(channel): (idat.n_snps_read, idat.probe_means)
+                    for channel, idat in idats.items()})
+            else:
+                idats = {channel: CachedIdatDataset(channel, *cached[str(channel)]) for channel in filepaths}
+            idat_datasets.append({'green_idat': idats[Channel.GREEN], 'red_idat': idats[Channel.RED], 'sample': sample,
+                'array_type': ArrayType.from_probe_count(idats[Channel.GREEN].n_snps_read), 'cache_key': key})
+        return idat_datasets
+
+
+def manifest_key(manifest, manifest_filepath=None):
+    """Identifies the manifest for the stage cache: its array type, and the file (with size and modification time)
+    if a custom manifest_filepath was used."""
+    filepath = Path(manifest_filepath) if manifest_filepath and not hasattr(manifest_filepath, 'read') else None
+    if filepath is not None and filepath.exists():
+        stat = os.stat(filepath)
+        return StageCache.key('manifest', str(manifest.array_type), filepath.name, stat.st_size, stat.st_mtime_ns)
+    return StageCache.key('manifest', str(manifest.array_type), str(manifest_filepath) if filepath else None)
+
+
+class SampleStageCache():
+    """One sample's view of a StageCache: load(stage, **params) and save(stage, data, **params) key each stage by
+    its params plus the sample's raw IDAT key and manifest."""
+
+    def __init__(self, store, sample_id, parts):
+        self.store = store
+        self.sample_id = sample_id
+        self.parts = parts
+
+    def load(self, stage, **params):
+        return self.store.load(self.sample_id, stage, self.store.key(stage, *self.parts, **params))
+
+    def save(self, stage, data, **params):
+        self.store.save(self.sample_id, stage, self.store.key(stage, *self.parts, **params), data)
+
+
+class CachedIdatDataset():
+    """Stands in for an IdatDataset whose probe means came from the stage cache; SigSet and channel-switch
+    inference only use these attributes."""
+
+    def __init__(self, channel, n_snps_read, probe_means):
+        self.channel = channel
+        self.n_snps_read = n_snps_read
+        self.probe_means = probe_means
+
+
+def sigset_state(container):
+    """The probe subsets (and preprocessing flags) of a SigSet, to cache."""
+    state = {name: getattr(container, name) for name in SIGSET_SUBSETS if hasattr(container, name)}
+    state.update({flag: getattr(container, flag) for flag in SIGSET_FLAGS if flag in vars(container)})
+    return state
+
+
+def restore_sigset_state(container, state):
+    for name, value in state.items():
+        setattr(container, name, value)
@@ -0,0 +1,52 @@
+import numpy as np
+import pandas as pd
+import pytest
+# App
+from methylprep.files import IdatDataset, Manifest, get_sample_sheet
+from methylprep.files.synthetic import write_idat, write_synthetic_manifest, write_synthetic_samples, IDAT_PROBE_COUNTS
+from methylprep.models import ArrayType, Channel
+
+
+class TestSyntheticIdats():
+
+    @staticmethod
+    def test_write_idat_round_trip(tmp_path):
+        ids = np.array([10, 20, 30])
+        write_idat(tmp_path / 'sample_Grn.idat.gz', ids, [100, 2000, 65535], std_devs=[10, 20, 30], n_beads=[5, 6, 7],
+            barcode='200000000000', chip_type='BeadChip 450k')
+        idat = IdatDataset(tmp_path / 'sample_Grn.idat.gz', Channel.GREEN, std_dev=True, nbeads=True)
+        assert idat.barcode == '200000000000' and idat.chip_type == 'BeadChip 450k' and idat.n_snps_read == 3
+        assert idat.probe_means.index.tolist() == [10, 20, 30]
+        assert idat.probe_means['mean_value'].tolist() == [100, 2000, 65535]
+        assert idat.probe_means['std_dev'].tolist() == [10, 20, 30]
+        assert idat.probe_means['n_beads'].tolist() == [5, 6, 7]
+        assert idat.run_info[0][1] == 'Scan'
+
+    @staticmethod
+    def test_dataset_matches_manifest(tmp_path):
+        manifest_path = write_synthetic_manifest(tmp_path / 'synthetic_27k_manifest.csv.gz', '27k')
+        manifest = Manifest(ArrayType.ILLUMINA_27K, manifest_path, verbose=False)
+        assert len(manifest.data_frame) == ArrayType.ILLUMINA_27K.num_probes
+        samples = write_synthetic_samples(tmp_path, manifest, 2, seed=3)
+        assert len(get_sample_sheet(tmp_path).get_samples()) == 2
+        green_idat = next(tmp_path.rglob(f"*{samples['Sentrix_Position'][0]}_Grn.idat"))
+        green = IdatDataset(green_idat, Channel.GREEN).probe_means
+        assert ArrayType.from_probe_count(len(green)) == ArrayType.ILLUMINA_27K == manifest.array_type
+        assert len(green) == IDAT_PROBE_COUNTS[ArrayType.ILLUMINA_27K]
+        # every probe's addresses are in the IDATs, and a green type I probe's signal is in green
+        probes = manifest.data_frame
+        assert probes['AddressA_ID'].isin(green.index).all() and probes['AddressB_ID'].dropna().isin(green.index).all()
+        in_green = probes[probes['Color_Channel'] == 'Grn']
+        signal = (green.loc[in_green['AddressA_ID'].astype(int), 'mean_value'].values
+            + green.loc[in_green['AddressB_ID'].astype(int), 'mean_value'].values)
+        assert np.median(signal) > 2 * green['mean_value'].median()
+        # the same seed writes the same samples again
+        again = write_synthetic_samples(tmp_path / 'again', manifest, 1, seed=3, sample_sheet=False)
+        assert again.equals(samples.iloc[:1])
+        first = next(tmp_path.glob(f"{samples['Sentrix_ID'][0]}/*{samples['Sentrix_Position'][0]}_Grn.idat"))
+        assert first.read_bytes() == next((tmp_path / 'again').rglob('*_Grn.idat')).read_bytes()
+
+    @staticmethod
+    def test_custom_arrays_need_a_manifest(tmp_path):
+        with pytest.raises(ValueError):
+            write_synthetic_manifest(tmp_path / 'custom.csv', 'custom')
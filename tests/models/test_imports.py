@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+
+class TestLazyImports():
+
+    @staticmethod
+    def test_import_defers_heavy_modules():
+        # the download stack, statsmodels, scipy.stats, and the quality masks load on first use only.
+        code = ("import sys, methylprep, methylprep.models.sketchy_probes as sketchy; "
+            "print([m for m in ('methylprep.download', 'statsmodels', 'scipy.stats', 'bs4') if m in sys.modules], "
+            "sketchy.quality_mask_probes.cache_info().currsize)")
+        result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+        assert result.stdout.strip() == '[] 0'
+
+    @staticmethod
+    def test_lazy_names_still_resolve():
+        import methylprep
+        from methylprep.models.sketchy_probes import qualityMask450, quality_mask_probes
+        assert methylprep.run_series is methylprep.download.run_series
+        assert qualityMask450 is quality_mask_probes('qualityMask450') and len(qualityMask450) > 0
@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+# App
+from methylprep.processing.postprocess import (
+    append_columns,
+    existing_sample_ids,
+    merge_batches,
+    write_feather,
+    read_feather,
+)
+
+
+def _matrix(samples, probes=('cg01', 'cg02', 'cg03')):
+    df = pd.DataFrame(np.random.default_rng(0).random((len(probes), len(samples))),
+        index=pd.Index(probes, name='IlmnID'), columns=samples, dtype='float32')
+    return df
+
+
+class TestAppend():
+
+    @staticmethod
+    @pytest.mark.parametrize('file_format,suffix', [('pickle', 'pkl'), ('parquet', 'parquet'), ('feather', 'feather')])
+    def test_append_columns(tmp_path, file_format, suffix):
+        existing = _matrix(['A_R01C01', 'B_R01C01'])
+        filepath = Path(tmp_path, f'beta_values.{suffix}')
+        writers = {'parquet': existing.to_parquet, 'feather': lambda path: write_feather(existing, path)}
+        write = writers.get(file_format, existing.to_pickle)
+        write(filepath)
+        assert existing_sample_ids(tmp_path, file_format) == {'A_R01C01', 'B_R01C01'}
+
+        # B is already stored and is skipped; cg04 is not in the stored matrix and is dropped.
+        new = _matrix(['B_R01C01', 'C_R01C01'], probes=('cg02', 'cg01', 'cg04'))
+        append_columns(filepath, new, file_format, rows_per_chunk=2)
+        result = {'parquet': pd.read_parquet, 'feather': read_feather}.get(file_format, pd.read_pickle)(filepath)
+        assert list(result.columns) == ['A_R01C01', 'B_R01C01', 'C_R01C01']
+        assert list(result.index) == ['cg01', 'cg02', 'cg03']
+        assert result['B_R01C01'].equals(existing['B_R01C01'])
+        assert result.loc['cg02', 'C_R01C01'] == new.loc['cg02', 'C_R01C01']
+        assert np.isnan(result.loc['cg03', 'C_R01C01'])
+
+    @staticmethod
+    def test_merge_batches_appends_to_existing(tmp_path):
+        _matrix(['A_R01C01']).to_pickle(Path(tmp_path, 'beta_values.pkl'))
+        _matrix(['B_R01C01']).to_pickle(Path(tmp_path, 'beta_values_1.pkl'))
+        _matrix(['C_R01C01']).to_pickle(Path(tmp_path, 'beta_values_2.pkl'))
+        merge_batches(2, tmp_path, 'beta_values', 'pickle', append=True)
+        result = pd.read_pickle(Path(tmp_path, 'beta_values.pkl'))
+        assert list(result.columns) == ['A_R01C01', 'B_R01C01', 'C_R01C01']
+        assert not Path(tmp_path, 'beta_values_1.pkl').exists()
+
+    @staticmethod
+    def test_no_existing_outputs(tmp_path):
+        assert existing_sample_ids(tmp_path, 'pickle') == set()
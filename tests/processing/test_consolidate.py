@@ -0,0 +1,101 @@
+import numpy as np
+import pandas as pd
+from types import SimpleNamespace
+# App
+from methylprep.files.manifests import ProbePositions
+from methylprep.processing import SampleDataContainer, consolidate_values_for_sheet
+from methylprep.processing.postprocess import mouse_probe_design
+from methylprep.processing.pipeline import _in_probe_order
+
+
+def _container(sentrix_id, probes, betas, poobah_pval, quality_mask=None, mask=True):
+    container = SampleDataContainer.__new__(SampleDataContainer) # no idats needed
+    container.sample = SimpleNamespace(sentrix_id=sentrix_id, sentrix_position='R01C01')
+    container.quality_mask = mask
+    data_frame = pd.DataFrame({'beta_value': betas, 'poobah_pval': poobah_pval},
+        index=pd.Index(probes, name='IlmnID'))
+    if quality_mask is not None:
+        data_frame['quality_mask'] = quality_mask
+    container._SampleDataContainer__data_frame = data_frame
+    return container
+
+
+class TestConsolidateValues():
+
+    @staticmethod
+    def test_masks_without_modifying_containers():
+        probes = ['cg01', 'cg02', 'cg03', 'rs01']
+        containers = [
+            _container('2001', probes, [0.1, 0.2, 0.3, 0.4], [0.01, 0.9, 0.01, 0.01], [1.0, 1.0, 0.0, 1.0]),
+            _container('2002', probes, [0.5, 0.6, 0.7, 0.8], [0.01, 0.01, 0.01, 0.01], [1.0, 1.0, 0.0, 1.0],
+                       mask=False),
+        ]
+        before = [c._SampleDataContainer__data_frame.copy() for c in containers]
+        df = consolidate_values_for_sheet(containers, postprocess_func_colname='beta_value', poobah=True,
+                                          poobah_sig=0.05)
+        assert list(df.columns) == ['2001_R01C01', '2002_R01C01']
+        assert list(df.index) == ['cg01', 'cg02', 'cg03'] and df.index.name == 'IlmnID'
+        assert df.dtypes.unique().tolist() == [np.dtype('float32')]
+        # cg02 fails poobah and cg03 is quality-masked in the first sample; the second sample has quality_mask off.
+        assert np.isnan(df.loc['cg02', '2001_R01C01']) and np.isnan(df.loc['cg03', '2001_R01C01'])
+        assert np.isclose(df.loc['cg03', '2002_R01C01'], 0.7)
+        for container, original in zip(containers, before):
+            assert container._SampleDataContainer__data_frame.equals(original)
+
+    @staticmethod
+    def test_differing_probes_and_bit():
+        containers = [
+            _container('2001', ['cg01', 'cg02'], [0.1, 0.2], [0.0, 0.0]),
+            _container('2002', ['cg02', 'cg03'], [0.6, 0.7], [0.0, 0.0]),
+        ]
+        df = consolidate_values_for_sheet(containers, bit='float16', poobah=False)
+        assert list(df.index) == ['cg01', 'cg02', 'cg03']
+        assert df.dtypes.unique().tolist() == [np.dtype('float16')]
+        assert np.isnan(df.loc['cg03', '2001_R01C01']) and np.isnan(df.loc['cg01', '2002_R01C01'])
+        assert np.isclose(df.loc['cg02', '2002_R01C01'], 0.6, atol=1e-3)
+
+    @staticmethod
+    def test_mouse_probe_matrices():
+        containers = [
+            _container('2001', ['cg01'], [0.1], [0.0]),
+            _container('2002', ['cg01'], [0.5], [0.0]),
+        ]
+        for num, container in enumerate(containers):
+            container.mouse_data_frame = pd.DataFrame({'beta_value': [0.3 + num, 0.4], 'poobah_pval': [0.01, 0.9],
+                'design': ['Multi', 'Random']}, index=pd.Index(['mu01', 'rp01'], name='IlmnID'))
+        df = consolidate_values_for_sheet(containers, postprocess_func_colname='beta_value',
+                                          object_name='mouse_data_frame')
+        assert list(df.index) == ['mu01', 'rp01'] and list(df.columns) == ['2001_R01C01', '2002_R01C01']
+        assert np.allclose(df.loc['mu01'], [0.3, 1.3]) and df.loc['rp01'].isna().all() # rp01 fails poobah
+        design = mouse_probe_design(containers)
+        assert design.index.name == 'IlmnID' and design['design'].tolist() == ['Multi', 'Random']
+
+    @staticmethod
+    def test_canonical_probe_order_is_shared():
+        probe_order = pd.Index(['cg01', 'cg02', 'cg03', 'rs01'], name='IlmnID')
+        rng = np.random.default_rng(0)
+        frames = []
+        for seed in range(2):
+            probes = list(np.random.default_rng(seed).permutation(probe_order))
+            frames.append(pd.DataFrame({'beta_value': rng.random(4)}, index=pd.Index(probes, name='IlmnID')))
+        containers = []
+        for num, frame in enumerate(frames):
+            ordered = _in_probe_order(frame, probe_order)
+            assert ordered.index is probe_order and ordered.equals(frame.sort_index())
+            containers.append(_container(f'200{num}', probe_order, ordered['beta_value'], [0.0] * 4))
+            containers[-1]._SampleDataContainer__data_frame.index = probe_order
+        df = consolidate_values_for_sheet(containers, poobah=False)
+        assert list(df.index) == ['cg01', 'cg02', 'cg03']
+        assert np.allclose(df['2001_R01C01'], frames[1]['beta_value'].sort_index().iloc[:3])
+        # a sample missing probes is sorted, but keeps its own index; unknown probes fall back to sorting names
+        partial = _in_probe_order(frames[0].drop(index='cg02'), probe_order)
+        assert list(partial.index) == ['cg01', 'cg03', 'rs01'] and partial.index is not probe_order
+        extra = pd.concat([frames[0], pd.DataFrame({'beta_value': [0.5]}, index=pd.Index(['cg00'], name='IlmnID'))])
+        assert list(_in_probe_order(extra, probe_order).index) == ['cg00', 'cg01', 'cg02', 'cg03', 'rs01']
+        # the manifest's ProbePositions give the same order, and are reused by samples with the same probes
+        probe_positions = ProbePositions(probe_order)
+        for frame in frames + [frames[1].copy()]:
+            ordered = _in_probe_order(frame, probe_order, probe_positions)
+            assert ordered.index is probe_order and ordered.equals(frame.sort_index())
+        ordered = _in_probe_order(extra, probe_order, probe_positions)
+        assert list(ordered.index) == ['cg00', 'cg01', 'cg02', 'cg03', 'rs01']
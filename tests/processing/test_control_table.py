@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+# App
+from methylprep.files.synthetic import write_synthetic_dataset
+from methylprep.processing import run_pipeline
+from methylprep.processing.postprocess import control_table, save_control_table, write_feather, read_feather
+
+
+def _control(seed=0, downcast=False):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'Mean_Value_Red': rng.integers(100, 9000, 4).astype('float64'),
+        'Mean_Value_Green': rng.integers(100, 9000, 4).astype('float64'),
+        'Control_Type': ['STAINING', 'STAINING', None, None],
+        'Color': ['Red', 'Green', None, None],
+        'Extended_Type': ['Biotin (High)', 'DNP (High)', None, None],
+        'snp_beta': [np.nan, np.nan, 0.25, 0.8],
+    }, index=pd.Index(['21630339', '27630314', 'rs01', 'rs02'], name='IlmnID'))
+    if downcast:
+        df['Mean_Value_Red'] = df['Mean_Value_Red'].astype('uint16')
+    return df
+
+
+class TestControlTable():
+
+    @staticmethod
+    def test_parts_combine_into_one_table(tmp_path):
+        batches = [
+            {'2001_R01C01': _control(1), '2002_R01C01': _control(2, downcast=True)},
+            {'2003_R01C01': _control(3)},
+        ]
+        parts = []
+        for num, batch in enumerate(batches, 1):
+            table = control_table(batch)
+            assert table['Control_Type'].dtype == 'category' and table['Mean_Value_Red'].dtype == 'float32'
+            parts.append(Path(tmp_path, f'_temp_control_{num}.feather'))
+            write_feather(table, parts[-1], preserve_index=False)
+        for file_format in ('parquet', 'feather'):
+            filepath = Path(tmp_path, f'control_probes.{file_format}')
+            save_control_table(parts, filepath, file_format)
+            result = pd.read_parquet(filepath) if file_format == 'parquet' else read_feather(filepath)
+            assert result.shape == (12, 8)
+            assert list(result['Sentrix_ID'].unique()) == ['2001_R01C01', '2002_R01C01', '2003_R01C01']
+            assert result['IlmnID'].dtype == 'category' and result['Color'].dtype == 'category'
+            sample = result[result['Sentrix_ID'] == '2002_R01C01'].set_index('IlmnID')
+            assert np.allclose(sample['Mean_Value_Red'], _control(2)['Mean_Value_Red'])
+
+    @staticmethod
+    def test_append_keeps_existing_samples(tmp_path):
+        filepath = Path(tmp_path, 'control_probes.parquet')
+        old = _control(1)
+        old['Mean_Value_Red'] = 1.0
+        write_feather(control_table({'2001_R01C01': old}), Path(tmp_path, 'old.feather'), preserve_index=False)
+        save_control_table([Path(tmp_path, 'old.feather')], filepath, 'parquet')
+        part = Path(tmp_path, '_temp_control_1.feather')
+        table = control_table({'2001_R01C01': _control(1), '2002_R01C01': _control(2)})
+        write_feather(table, part, preserve_index=False)
+        result = save_control_table([part], filepath, 'parquet', append=True)
+        assert list(result['Sentrix_ID'].unique()) == ['2001_R01C01', '2002_R01C01']
+        assert (result.loc[result['Sentrix_ID'] == '2001_R01C01', 'Mean_Value_Red'] == 1.0).all()
+        assert pd.read_parquet(filepath).shape == (8, 8)
+
+    @staticmethod
+    def test_empty_and_unnamed_frames():
+        # 27k arrays have no control probes; their empty frames are indexed by Address_ID
+        empty = pd.DataFrame(columns=['Mean_Value_Red', 'Mean_Value_Green'], index=pd.Index([], name='Address_ID'))
+        table = control_table({'2001_R01C01': empty})
+        assert len(table) == 0 and list(table.columns[:2]) == ['Sentrix_ID', 'IlmnID']
+        other = _control(2).rename_axis('Address_ID')
+        table = control_table({'2001_R01C01': empty, '2002_R01C01': other})
+        assert list(table.columns[:2]) == ['Sentrix_ID', 'IlmnID']
+        assert list(table['Sentrix_ID'].unique()) == ['2002_R01C01']
+        assert table['IlmnID'].tolist() == other.index.tolist()
+
+    @staticmethod
+    def test_27k_run(tmp_path):
+        manifest_path = write_synthetic_dataset(tmp_path, '27k', 2)
+        run_pipeline(tmp_path, manifest_filepath=str(manifest_path), file_format='feather', save_control=True)
+        assert list(read_feather(Path(tmp_path, 'control_probes.feather')).columns[:2]) == ['Sentrix_ID', 'IlmnID']
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+import pyarrow.feather as feather
+import pytest
+from pathlib import Path
+# App
+from methylprep.processing.export import ExportWriter, DatasetWriter, write_export, DATASET_DIRNAME
+
+
+def _data_frame():
+    data_frame = pd.DataFrame({
+        'noob_meth': [100.0, np.nan, 300.0, np.nan],
+        'noob_unmeth': [10.0, np.nan, 30.0, 40.0],
+        'beta_value': [0.5, np.nan, 0.9, 0.1],
+        'quality_mask': [1.0, np.nan, 1.0, 1.0],
+    }, index=pd.Index(['cg01', 'cg02', 'cg03', 'cg04'], name='IlmnID'))
+    overlay = pd.DataFrame({'noob_meth': [222.0], 'noob_unmeth': [22.0]}, index=pd.Index(['cg02'], name='IlmnID'))
+    return data_frame, overlay
+
+
+def _expected(data_frame, overlay):
+    this = data_frame.copy(deep=True)
+    this.update(overlay)
+    this['quality_mask'] = this['quality_mask'].fillna(1)
+    return this
+
+
+class TestExport():
+
+    @staticmethod
+    def test_csv_matches_pandas(tmp_path):
+        data_frame, overlay = _data_frame()
+        before = data_frame.copy()
+        write_export(data_frame, Path(tmp_path, 'chunked.csv'), 'csv', overlay=overlay, rows_per_chunk=3)
+        _expected(data_frame, overlay).to_csv(Path(tmp_path, 'pandas.csv'))
+        assert Path(tmp_path, 'chunked.csv').read_bytes() == Path(tmp_path, 'pandas.csv').read_bytes()
+        assert data_frame.equals(before)
+
+    @staticmethod
+    @pytest.mark.parametrize('export_format', ['csv.gz', 'parquet', 'feather'])
+    def test_background_formats(tmp_path, export_format):
+        data_frame, overlay = _data_frame()
+        output_path = Path(tmp_path, f'sample_processed.{export_format}')
+        writer = ExportWriter(max_workers=2, max_pending=1)
+        writer.submit(write_export, data_frame, output_path, export_format, overlay=overlay, rows_per_chunk=2)
+        writer.shutdown()
+        if export_format == 'csv.gz':
+            result = pd.read_csv(output_path).set_index('IlmnID')
+        elif export_format == 'parquet':
+            result = pd.read_parquet(output_path)
+        else:
+            result = feather.read_feather(output_path)
+        assert result.equals(_expected(data_frame, overlay))
+
+    @staticmethod
+    def test_errors_are_raised(tmp_path):
+        data_frame, _ = _data_frame()
+        writer = ExportWriter()
+        writer.submit(write_export, data_frame, Path(tmp_path, 'missing_folder', 'x.csv'), 'csv')
+        with pytest.raises(FileNotFoundError):
+            writer.wait()
+
+    @staticmethod
+    def test_long_format_dataset(tmp_path):
+        import pyarrow.parquet as pq
+        data_frame, overlay = _data_frame()
+        writer = DatasetWriter(tmp_path)
+        for batch_num, sample_ids in [(1, ['2001_R01C01', '2001_R02C01']), (2, ['2002_R01C01'])]:
+            for sample_id in sample_ids:
+                writer.write_sample(batch_num, sample_id, data_frame, overlay)
+            writer.close_batch(batch_num)
+        writer.shutdown()
+        assert Path(tmp_path, writer.partition_file(2)).exists()
+        part = pq.ParquetFile(Path(tmp_path, writer.partition_file(1)))
+        assert part.num_row_groups == 2
+        assert str(part.schema_arrow.field('sample_id').type) == 'dictionary<values=string, indices=int32, ordered=0>'
+        dataset = pd.read_parquet(Path(tmp_path, DATASET_DIRNAME))
+        assert len(dataset) == 12 and list(dataset.columns[:2]) == ['sample_id', 'IlmnID']
+        sample = dataset[dataset['sample_id'] == '2002_R01C01'].set_index('IlmnID')
+        assert np.allclose(sample[data_frame.columns].values, _expected(data_frame, overlay).values, equal_nan=True)
+        # append mode numbers its batches after the existing ones
+        assert DatasetWriter(tmp_path, append=True).partition_file(1).startswith(f'{DATASET_DIRNAME}/batch=3/')
@@ -0,0 +1,74 @@
+import json
+from pathlib import Path
+import pandas as pd
+# App
+from methylprep.files.synthetic import write_synthetic_dataset
+from methylprep.processing import run_pipeline
+from methylprep.processing.journal import RunJournal, JOURNAL_FILENAME
+
+
+class TestRunJournal():
+
+    @staticmethod
+    def test_completed_batch_is_skipped_on_resume(tmp_path):
+        settings = {'batch_size': 2, 'file_format': 'pickle'}
+        journal = RunJournal(tmp_path, settings)
+        Path(tmp_path, 'beta_values_1.pkl').write_bytes(b'')
+        journal.mark_complete(1, ['Sample_1', 'Sample_2'], ['beta_values_1.pkl'])
+        assert Path(tmp_path, JOURNAL_FILENAME).exists()
+
+        resumed = RunJournal.load(tmp_path, settings)
+        assert resumed.is_complete(1, ['Sample_1', 'Sample_2'])
+        assert not resumed.is_complete(2, ['Sample_3'])
+        # different samples in the batch means it must be re-run
+        assert not resumed.is_complete(1, ['Sample_1', 'Sample_9'])
+
+    @staticmethod
+    def test_missing_artifact_forces_rerun(tmp_path):
+        journal = RunJournal(tmp_path, {})
+        journal.mark_complete(1, ['Sample_1'], ['beta_values_1.pkl', '_temp_data_1.pkl'])
+        Path(tmp_path, 'beta_values_1.pkl').write_bytes(b'')
+        assert not RunJournal.load(tmp_path, {}).is_complete(1, ['Sample_1'])
+
+    @staticmethod
+    def test_changed_settings_ignore_journal(tmp_path):
+        RunJournal(tmp_path, {'betas': True}).mark_complete(1, ['Sample_1'], [])
+        assert RunJournal.load(tmp_path, {'betas': True}).is_complete(1, ['Sample_1'])
+        assert not RunJournal.load(tmp_path, {'betas': False}).is_complete(1, ['Sample_1'])
+
+    @staticmethod
+    def test_remove(tmp_path):
+        journal = RunJournal(tmp_path, {})
+        journal.mark_complete(1, ['Sample_1'], [])
+        journal.remove()
+        assert not Path(tmp_path, JOURNAL_FILENAME).exists()
+
+    @staticmethod
+    def test_discard_after(tmp_path):
+        # a resumed run re-split into fewer batches: batch 3 of the interrupted run is stale
+        journal = RunJournal(tmp_path, {})
+        journal.mark_complete(1, ['Sample_1', 'Sample_2'], ['beta_values_1.pkl', 'Sample_1_processed.csv'])
+        journal.mark_complete(2, ['Sample_3'], ['beta_values_2.pkl'])
+        journal.mark_complete(3, ['Sample_1'], ['beta_values_3.pkl', 'Sample_1_processed.csv'])
+        assert journal.discard_after(2) == ['beta_values_3.pkl']
+        assert sorted(RunJournal.load(tmp_path, {}).batches) == [1, 2]
+        assert journal.discard_after(2) == []
+
+    @staticmethod
+    def test_merge_ignores_parts_of_other_runs(tmp_path):
+        manifest_path = write_synthetic_dataset(tmp_path, '27k', 2)
+        stale = pd.DataFrame({'999_R01C01': [0.5]}, index=pd.Index(['cg00000029'], name='IlmnID'))
+        stale.to_pickle(Path(tmp_path, 'beta_values_3.pkl'))
+        run_pipeline(tmp_path, manifest_filepath=str(manifest_path), betas=True, batch_size=1)
+        assert '999_R01C01' not in pd.read_pickle(Path(tmp_path, 'beta_values.pkl')).columns
+
+    @staticmethod
+    def test_run_settings(tmp_path, mocker):
+        manifest_path = write_synthetic_dataset(tmp_path, '27k', 1)
+        mocker.patch.object(RunJournal, 'remove') # keep the journal, as an interrupted run would
+        run_pipeline(tmp_path, manifest_filepath=str(manifest_path), batch_size=1, save_control=False,
+                     poobah_decimals=4)
+        settings = json.loads(Path(tmp_path, JOURNAL_FILENAME).read_text())['settings']
+        # everything that changes the output files is part of the settings a resumed run must match
+        assert settings['pneg_ecdf'] is False and settings['poobah_decimals'] == 4
+        assert settings['manifest_filepath'] == str(manifest_path) and settings['batches'] == [['Sample_1']]
@@ -0,0 +1,127 @@
+import numpy as np
+import pandas as pd
+import pytest
+from pathlib import Path
+# App
+from methylprep import load_values
+from methylprep.files.synthetic import write_synthetic_dataset
+from methylprep.processing import MatrixStore, run_pipeline
+from methylprep.processing.postprocess import sort_by_position, write_feather, _write_parquet_in_row_groups
+from methylprep.processing.encoding import (
+    encode_betas,
+    encode_intensities,
+    encode_pvalues,
+    encode_quality_mask,
+    UINT16_NAN,
+)
+
+
+def _part(samples, probes, seed=0):
+    values = np.random.default_rng(seed).random((len(probes), len(samples))).astype('float32')
+    return pd.DataFrame(values, index=pd.Index(probes, name='IlmnID'), columns=samples)
+
+
+class TestLoadValues():
+
+    @staticmethod
+    @pytest.mark.parametrize('file_format', ['pickle', 'parquet', 'npy', 'feather'])
+    def test_subset_of_unmerged_parts(tmp_path, file_format):
+        probes = [f'cg{i:04d}' for i in range(30)]
+        parts = [_part(['A', 'B'], probes, seed=1), _part(['C', 'D'], probes, seed=2)]
+        for num, part in enumerate(parts, 1):
+            if file_format == 'parquet':
+                part.to_parquet(Path(tmp_path, f'beta_values_{num}.parquet'), row_group_size=10)
+            elif file_format == 'npy':
+                MatrixStore.save(part, Path(tmp_path, f'beta_values_{num}.npy_blocks'))
+            elif file_format == 'feather':
+                write_feather(part, Path(tmp_path, f'beta_values_{num}.feather'))
+            else:
+                part.to_pickle(Path(tmp_path, f'beta_values_{num}.pkl'))
+        expected = pd.concat(parts, axis='columns')
+        result = load_values(tmp_path, kind='beta', probes=['cg0025', 'cg0002', 'cg9999'], samples=['D', 'A', 'X'])
+        assert list(result.columns) == ['D', 'A'] and list(result.index) == ['cg0025', 'cg0002']
+        assert result.equals(expected.loc[['cg0025', 'cg0002'], ['D', 'A']])
+        assert load_values(tmp_path).equals(expected)
+
+    @staticmethod
+    def test_missing_files(tmp_path):
+        with pytest.raises(FileNotFoundError):
+            load_values(tmp_path, kind='m')
+
+    @staticmethod
+    def test_quantized_betas(tmp_path):
+        betas = _part(['A', 'B'], ['cg01', 'cg02', 'cg03'])
+        betas.iloc[1, 0] = np.nan
+        encoded = encode_betas(betas)
+        assert encoded.dtypes.unique().tolist() == [np.dtype('uint16')] and encoded.iloc[1, 0] == UINT16_NAN
+        encoded.to_pickle(Path(tmp_path, 'beta_values.pkl'))
+        result = load_values(tmp_path, kind='beta')
+        assert result.dtypes.unique().tolist() == [np.dtype('float32')] and np.isnan(result.iloc[1, 0])
+        assert np.allclose(result.values, betas.values, atol=1e-5, equal_nan=True)
+
+    @staticmethod
+    def test_masked_uint16_intensities(tmp_path):
+        noob = pd.DataFrame({'A': [120.4, np.nan, 70000.0], 'B': [5.0, 6.0, 7.0]},
+                            index=pd.Index(['cg01', 'cg02', 'cg03'], name='IlmnID'))
+        encoded = encode_intensities(noob)
+        assert encoded.dtypes.unique().tolist() == [np.dtype('uint16')]
+        assert encoded['A'].tolist() == [120, UINT16_NAN, UINT16_NAN - 1]
+        encoded.to_pickle(Path(tmp_path, 'noob_meth_values.pkl'))
+        result = load_values(tmp_path, kind='noob_meth')
+        assert np.isnan(result.loc['cg02', 'A']) and result['A'].dtype == 'float32'
+        assert result['B'].dtype == 'float32' and result.loc['cg03', 'B'] == 7.0
+        noob['A'] = 1.0 # without missing values, uint16 files are left as-is
+        encode_intensities(noob).to_pickle(Path(tmp_path, 'noob_meth_values.pkl'))
+        assert load_values(tmp_path, kind='noob_meth').dtypes.unique().tolist() == [np.dtype('uint16')]
+
+    @staticmethod
+    def test_region_query(tmp_path):
+        probes = ['cg01', 'cg02', 'cg03', 'cg04']
+        manifest = pd.DataFrame({'CHR': ['7', '7', '1', '7'], 'MAPINFO': ['500', '100', '300', '900']},
+            index=pd.Index(probes, name='IlmnID'))
+        betas = sort_by_position(_part(['A', 'B'], probes), manifest)
+        _write_parquet_in_row_groups(betas, Path(tmp_path, 'beta_values.parquet'), rows_per_chunk=2)
+        result = load_values(tmp_path, region='chr7:1-600')
+        assert list(result.index) == ['cg02', 'cg01'] and result.index.name == 'IlmnID'
+        with pytest.raises(ValueError):
+            MatrixStore.save(_part(['A'], probes), Path(tmp_path, 'm_values.npy_blocks'))
+            load_values(tmp_path, kind='m', region='7')
+
+    @staticmethod
+    @pytest.mark.parametrize('file_format', ['pickle', 'parquet', 'feather'])
+    def test_deferred_masks(tmp_path, file_format):
+        betas = _part(['A', 'B'], ['cg01', 'cg02', 'cg03', 'cg04'])
+        pvals = pd.DataFrame({'A': [0.001, 0.049, 0.05, np.nan], 'B': [0.5, 0.01, 0.2, 0.0]}, index=betas.index,
+                             dtype='float32')
+        quality_mask = pd.DataFrame({'A': [1.0, 1.0, 1.0, 0.0], 'B': [1.0, 0.0, np.nan, 1.0]}, index=betas.index)
+        codes = encode_pvalues(pvals)
+        assert codes['A'].tolist() == [1, 49, 50, 255] and codes['B'].tolist() == [254, 10, 200, 0]
+        saved = {'beta_values': betas, 'poobah_codes': codes, 'quality_mask_values': encode_quality_mask(quality_mask)}
+        for stem, df in saved.items():
+            if file_format == 'parquet':
+                df.to_parquet(Path(tmp_path, f'{stem}.parquet'))
+            elif file_format == 'feather':
+                write_feather(df, Path(tmp_path, f'{stem}.feather'))
+            else:
+                df.to_pickle(Path(tmp_path, f'{stem}.pkl'))
+        assert load_values(tmp_path).equals(betas)
+        # same as masking with `p >= poobah_sig` and `quality_mask == 0` while processing
+        for poobah_sig in (0.05, 0.01, 0.2):
+            result = load_values(tmp_path, poobah_sig=poobah_sig, quality_mask=True)
+            expected = betas.mask((pvals >= poobah_sig) | (quality_mask == 0))
+            assert result.equals(expected)
+        result = load_values(tmp_path, probes=['cg04', 'cg02'], samples=['B'], poobah_sig=0.05)
+        assert result.equals(betas.loc[['cg04', 'cg02'], ['B']])
+        with pytest.raises(ValueError):
+            load_values(tmp_path, poobah_sig=0.3)
+
+    @staticmethod
+    def test_deferred_masking_run(tmp_path):
+        manifest_path = write_synthetic_dataset(tmp_path, '27k', 2)
+        betas = run_pipeline(tmp_path, manifest_filepath=str(manifest_path), betas=True, poobah=True,
+                             deferred_masking=True)
+        # the returned betas are unmasked, like the saved files; load_values applies the masks
+        saved = load_values(tmp_path)
+        assert betas.equals(saved.loc[betas.index, betas.columns].astype(betas.dtypes.iloc[0]))
+        masked = load_values(tmp_path, poobah_sig=0.05)
+        assert masked.isna().sum().sum() > betas.isna().sum().sum()
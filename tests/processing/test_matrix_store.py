@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+from pathlib import Path
+# App
+from methylprep.processing import MatrixStore
+from methylprep.processing.postprocess import merge_batches, existing_sample_ids, append_columns
+
+
+def _part(samples, probes, dtype='float32', seed=0):
+    values = np.random.default_rng(seed).integers(0, 1000, (len(probes), len(samples))).astype(dtype)
+    return pd.DataFrame(values, index=pd.Index(probes, name='IlmnID'), columns=samples)
+
+
+class TestMatrixStore():
+
+    @staticmethod
+    def test_save_and_slice(tmp_path):
+        probes = [f'cg{i:04d}' for i in range(20)]
+        df = _part(['A', 'B', 'C', 'D', 'E'], probes)
+        store = MatrixStore.save(df, Path(tmp_path, 'beta_values.npy_blocks'), block_size=2)
+        assert len(store.blocks) == 3 and store.shape == (20, 5)
+        reopened = MatrixStore(Path(tmp_path, 'beta_values.npy_blocks'))
+        assert reopened.to_frame().equals(df) and reopened.probes.name == 'IlmnID'
+        # each block is a memory-mapped, column-ordered probes x samples array
+        block = reopened.memmap(reopened.blocks[0])
+        assert isinstance(block, np.memmap) and block.shape == (20, 2) and block.flags['F_CONTIGUOUS']
+        subset = reopened.to_frame(probes=['cg0003', 'cg0001'], samples=['E', 'B'])
+        assert subset.equals(df.loc[['cg0003', 'cg0001'], ['E', 'B']])
+
+    @staticmethod
+    def test_merge_batches_moves_blocks(tmp_path):
+        probes = ['cg01', 'cg02', 'cg03']
+        parts = [_part(['A', 'B'], probes, dtype='uint16', seed=1), _part(['C'], probes, seed=2)]
+        for num, part in enumerate(parts, 1):
+            MatrixStore.save(part, Path(tmp_path, f'noob_meth_values_{num}.npy_blocks'))
+        merge_batches(2, tmp_path, 'noob_meth_values', 'npy')
+        assert sorted(path.name for path in Path(tmp_path).iterdir()) == ['noob_meth_values.npy_blocks']
+        store = MatrixStore(Path(tmp_path, 'noob_meth_values.npy_blocks'))
+        assert [block['dtype'] for block in store.blocks] == ['uint16', 'float32']
+        result = store.to_frame()
+        assert result.dtypes.unique().tolist() == [np.dtype('float32')]
+        assert np.array_equal(result.values, pd.concat(parts, axis='columns').values.astype('float32'))
+
+        # append mode: new samples become another block, aligned to the stored probes
+        assert existing_sample_ids(tmp_path, 'npy') == {'A', 'B', 'C'}
+        append_columns(store.path, _part(['C', 'D'], ['cg03', 'cg01', 'cg09'], seed=3), 'npy')
+        result = MatrixStore(store.path).to_frame(samples=['D'])
+        assert list(result.index) == probes and np.isnan(result.loc['cg02', 'D'])
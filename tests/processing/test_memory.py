@@ -0,0 +1,55 @@
+from pathlib import Path
+import pytest
+# App
+from methylprep.files.synthetic import write_synthetic_dataset
+from methylprep.models import ArrayType
+from methylprep.processing import run_pipeline
+from methylprep.processing import memory
+from methylprep.processing.memory import MemoryBudget, parse_memory_size
+
+GB = 1024**3
+
+
+class TestMemoryBudget():
+
+    @staticmethod
+    def test_parse_memory_size():
+        assert parse_memory_size('8GB') == 8 * GB
+        assert parse_memory_size('500 mb') == 500 * 1024**2
+        assert parse_memory_size('1.5G') == int(1.5 * GB)
+        assert parse_memory_size(1000) == 1000
+        with pytest.raises(ValueError):
+            parse_memory_size('lots')
+
+    @staticmethod
+    def test_batch_size_scales_with_budget_and_bit(mocker):
+        mocker.patch.object(memory, 'current_rss', return_value=GB)
+        small = MemoryBudget('4GB', '450k').get_batch_size()
+        large = MemoryBudget('16GB', '450k').get_batch_size()
+        assert 1 <= small < large
+        # half-size values fit more samples into the same budget
+        assert MemoryBudget('16GB', ArrayType.ILLUMINA_450K, bit='float16').get_batch_size() > large
+        # more probes per sample, fewer samples per batch
+        assert MemoryBudget('16GB', 'epic').get_batch_size() < large
+        # budget smaller than the fixed overhead still processes one sample at a time
+        assert MemoryBudget('1.1GB', 'epic').get_batch_size() == 1
+
+    @staticmethod
+    def test_observe_shrinks_batch_when_over_budget(mocker):
+        rss = mocker.patch.object(memory, 'current_rss', return_value=GB)
+        budget = MemoryBudget('8GB', '450k')
+        batch_size = budget.get_batch_size()
+        rss.return_value = 4 * GB
+        assert budget.observe(batch_size) == batch_size # under budget, no change
+        rss.return_value = 12 * GB
+        smaller = budget.observe(batch_size)
+        assert 1 <= smaller < batch_size
+        assert not budget.fits(batch_size)
+
+    @staticmethod
+    def test_small_run_in_a_large_budget(tmp_path):
+        # the batch_size picked from max_memory is capped at the number of samples, and the run returns its data
+        manifest_path = write_synthetic_dataset(tmp_path, '27k', 3)
+        betas = run_pipeline(tmp_path, manifest_filepath=str(manifest_path), betas=True, max_memory='4GB')
+        assert betas is not None and betas.shape == (ArrayType.ILLUMINA_27K.num_probes, 3)
+        assert Path(tmp_path, 'beta_values.pkl').exists() and list(tmp_path.glob('beta_values_*.pkl')) == []
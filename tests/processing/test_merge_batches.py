@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+from pathlib import Path
+# App
+from methylprep.processing.postprocess import (
+    merge_batches,
+    sort_by_position,
+    write_feather,
+    _write_parquet_in_row_groups,
+)
+
+
+def _part(samples, probes, dtype='float32', seed=0):
+    values = np.random.default_rng(seed).integers(0, 1000, (len(probes), len(samples))).astype(dtype)
+    return pd.DataFrame(values, index=pd.Index(probes, name='IlmnID'), columns=samples)
+
+
+class TestMergeBatches():
+
+    @staticmethod
+    def test_streaming_merge_matches_concat(tmp_path):
+        parts = [
+            _part(['A', 'B'], ['cg01', 'cg02', 'cg03', 'cg04'], dtype='uint16', seed=1),
+            # different order, one probe missing, and a wider dtype than the first part
+            _part(['C'], ['cg04', 'cg03', 'cg01', 'cg02'], dtype='float32', seed=2),
+            _part(['D', 'E'], ['cg01', 'cg02', 'cg04', 'cg05'], dtype='uint16', seed=3),
+        ]
+        for num, part in enumerate(parts, 1):
+            part.to_pickle(Path(tmp_path, f'noob_meth_values_{num}.pkl'))
+        merge_batches(3, tmp_path, 'noob_meth_values', 'pickle')
+        result = pd.read_pickle(Path(tmp_path, 'noob_meth_values.pkl'))
+        expected = pd.concat(parts, axis='columns', join='inner')
+        assert list(result.index) == ['cg01', 'cg02', 'cg04'] and result.index.name == 'IlmnID'
+        assert list(result.columns) == ['A', 'B', 'C', 'D', 'E']
+        assert result.dtypes.unique().tolist() == [np.dtype('float32')]
+        assert np.array_equal(result.values, expected.loc[result.index].values.astype('float32'))
+        assert sorted(path.name for path in Path(tmp_path).iterdir()) == ['noob_meth_values.pkl']
+
+    @staticmethod
+    def test_parquet_row_groups(tmp_path):
+        probes = [f'cg{i:04d}' for i in range(25)]
+        for num in (1, 2):
+            _part([f'S{num}'], probes, seed=num).to_parquet(Path(tmp_path, f'beta_values_{num}.parquet'))
+        merge_batches(2, tmp_path, 'beta_values', 'parquet', rows_per_chunk=10)
+        merged_file = Path(tmp_path, 'beta_values.parquet')
+        assert pq.ParquetFile(merged_file).num_row_groups == 3
+        result = pd.read_parquet(merged_file)
+        assert list(result.columns) == ['S1', 'S2'] and list(result.index) == probes
+        assert result['S2'].equals(_part(['S2'], probes, seed=2)['S2'])
+
+    @staticmethod
+    def test_parquet_by_position(tmp_path):
+        probes = [f'cg{i:04d}' for i in range(12)]
+        manifest = pd.DataFrame({'CHR': ['2', '10', 'X', '2', '1', '10', '1', '2', None, 'X', '1', '2'],
+            'MAPINFO': [str(100 - i) for i in range(12)]}, index=pd.Index(probes, name='IlmnID'))
+        for num in (1, 2):
+            part = sort_by_position(_part([f'S{num}'], probes, seed=num), manifest)
+            _write_parquet_in_row_groups(part, Path(tmp_path, f'beta_values_{num}.parquet'), rows_per_chunk=3)
+        merge_batches(2, tmp_path, 'beta_values', 'parquet', rows_per_chunk=3, compression='zstd')
+        parquet_file = pq.ParquetFile(Path(tmp_path, 'beta_values.parquet'))
+        # 1, 2, 10, X, then unmapped; chromosome 2 has 4 probes so it spans two row groups.
+        assert parquet_file.num_row_groups == 6
+        assert parquet_file.metadata.row_group(0).column(0).compression == 'ZSTD'
+        result = pd.read_parquet(Path(tmp_path, 'beta_values.parquet'))
+        assert list(result.index.names) == ['IlmnID', 'CHR', 'MAPINFO']
+        assert list(result.index.get_level_values('CHR')[:5]) == ['1', '1', '1', '2', '2']
+        assert list(result.index.get_level_values('MAPINFO')[:3]) == [90, 94, 96]
+        assert result.index.get_level_values(0)[-1] == 'cg0008'
+
+    @staticmethod
+    def test_feather_memory_mapped(tmp_path):
+        import pyarrow.feather as feather
+        probes = [f'cg{i:04d}' for i in range(10)]
+        for num in (1, 2):
+            write_feather(_part([f'S{num}'], probes, seed=num), Path(tmp_path, f'beta_values_{num}.feather'))
+        merge_batches(2, tmp_path, 'beta_values', 'feather')
+        assert sorted(path.name for path in Path(tmp_path).iterdir()) == ['beta_values.feather']
+        table = feather.read_table(Path(tmp_path, 'beta_values.feather'), memory_map=True)
+        assert table.column('S2').num_chunks == 1 # one record batch, so each column converts without copying
+        assert table.column('S2').chunk(0).to_numpy(zero_copy_only=True).shape == (10,)
+        assert feather.read_feather(Path(tmp_path, 'beta_values.feather')).equals(
+            pd.concat([_part(['S1'], probes, seed=1), _part(['S2'], probes, seed=2)], axis='columns'))
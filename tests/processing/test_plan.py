@@ -0,0 +1,53 @@
+import numpy as np
+# App
+from methylprep.files.synthetic import write_synthetic_dataset
+from methylprep.processing import make_pipeline
+from methylprep.processing.plan import compile_plan
+
+
+class TestPlan():
+
+    @staticmethod
+    def test_prunes_unrequested_stages():
+        plan = compile_plan(steps=['all'], exports=['noob_meth'], estimator=None)
+        assert [stage.name for stage in plan.stages] == ['read_idats', 'infer_channel_switch', 'poobah',
+            'quality_mask', 'intensities', 'noob', 'dye_bias']
+        assert 'beta_value' not in plan.outputs and 'm_value' not in plan.outputs
+        assert set(stage.name for stage in plan.pruned) == {'beta_value', 'm_value', 'mouse_values', 'control_snp'}
+        plan = compile_plan(steps=['all'], exports=['noob_meth'], estimator='m_value')
+        assert 'm_value' in plan and 'beta_value' not in plan
+
+    @staticmethod
+    def test_estimator_and_unselected_steps():
+        plan = compile_plan(steps=['noob'], exports=[], estimator='m_value')
+        assert 'm_value' in plan and 'beta_value' not in plan
+        # poobah was not selected, so noob does not wait for it and it is not in the plan
+        assert 'poobah' not in plan and 'poobah' in [stage.name for stage in plan.disabled]
+        plan = compile_plan(steps=[], exports=['control'], estimator=None)
+        assert [stage.name for stage in plan.stages] == ['read_idats', 'intensities', 'control_snp']
+
+    @staticmethod
+    def test_no_estimator_keeps_selected_steps():
+        # make_pipeline returns the SampleDataContainers, so the selected corrections run even with no exports
+        plan = compile_plan(steps=['noob', 'dye_bias'], exports=None, estimator=None)
+        assert 'noob' in plan and 'dye_bias' in plan and {'noob_meth', 'noob_unmeth'} <= plan.outputs
+        assert 'beta_value' not in plan and 'm_value' not in plan
+
+    @staticmethod
+    def test_no_estimator_containers(tmp_path):
+        manifest_path = write_synthetic_dataset(tmp_path, '27k', 1)
+        containers = make_pipeline(tmp_path, steps=['noob', 'dye_bias'], exports=None, estimator=None,
+            manifest_filepath=str(manifest_path), low_memory=False, save_control=False)
+        container = containers[0]
+        assert 'noob' in container.methylated.columns and 'noob' in container.unmethylated.columns
+        assert not np.allclose(container.methylated['noob'], container.methylated['Meth'], equal_nan=True)
+        assert {'noob_meth', 'noob_unmeth'} <= set(container._SampleDataContainer__data_frame.columns)
+
+    @staticmethod
+    def test_dry_run(capsys):
+        plan = make_pipeline('no/such/folder', steps=['poobah', 'noob'], exports=['csv'], estimator='beta',
+                             dry_run=True)
+        printed = capsys.readouterr().out
+        assert printed.startswith('methylprep plan:')
+        assert 'pruned (outputs not needed): mouse_values, control_snp' in printed
+        assert {'beta_value', 'm_value', 'poobah_pval'} <= plan.outputs
@@ -0,0 +1,52 @@
+import tracemalloc
+# App
+from methylprep.processing.profiling import RunProfiler, read_profile, summarize_profile, PROFILE_FILENAME
+
+
+class TestRunProfiler():
+
+    @staticmethod
+    def test_stages_are_saved_as_json_lines(tmp_path):
+        profiler = RunProfiler(tmp_path)
+        run_token = profiler.start('run')
+        for batch in (1, 2):
+            with profiler.stage('batch', batch=batch):
+                with profiler.stage('noob', sample=f'2001_R0{batch}C01'):
+                    sum(range(1000))
+        profiler.stop(run_token)
+        records = read_profile(tmp_path)
+        assert [r['stage'] for r in records] == ['noob', 'batch', 'noob', 'batch', 'run']
+        assert records[0]['sample'] == '2001_R01C01' and records[3]['batch'] == 2
+        assert {'wall_s', 'cpu_s', 'rss_mb', 'rss_delta_mb', 'peak_rss_mb'} <= set(records[0])
+        assert records[-1]['wall_s'] >= records[1]['wall_s'] + records[3]['wall_s'] - 0.001 # stages nest
+        summary = summarize_profile(records).splitlines()
+        assert summary[0].split()[:3] == ['stage', 'calls', 'wall']
+        assert [line.split()[:2] for line in summary[1:]] == [['noob', '2'], ['batch', '2'], ['run', '1']]
+        # a new run starts a new file; a resumed run adds to it
+        RunProfiler(tmp_path, append=True).stop(RunProfiler(tmp_path, append=True).start('run'))
+        assert len(read_profile(tmp_path)) == 6
+        RunProfiler(tmp_path)
+        assert read_profile(tmp_path) == []
+
+    @staticmethod
+    def test_traced_peak(tmp_path):
+        profiler = RunProfiler(tmp_path)
+        tracemalloc.start()
+        try:
+            with profiler.stage('outer'):
+                with profiler.stage('inner'):
+                    block = bytearray(8 * 1024 ** 2)
+                    del block
+        finally:
+            tracemalloc.stop()
+        inner, outer = read_profile(tmp_path)
+        assert inner['traced_peak_mb'] >= 8 and outer['traced_peak_mb'] >= 8 # the inner stage's peak counts for both
+
+    @staticmethod
+    def test_disabled(tmp_path):
+        profiler = RunProfiler(tmp_path, enabled=False)
+        with profiler.stage('noob', sample='2001_R01C01'):
+            pass
+        assert profiler.stop(profiler.start('run')) is None
+        assert profiler.records == [] and not (tmp_path / PROFILE_FILENAME).exists()
+        assert summarize_profile([]) == 'No profile records.'
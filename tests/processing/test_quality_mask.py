@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+# App
+from methylprep.files import Manifest
+from methylprep.models import ArrayType
+from methylprep.models.sketchy_probes import quality_mask_probes
+from methylprep.processing.pipeline import _join_by_position
+from methylprep.processing.preprocess import _apply_sesame_quality_mask
+
+
+def _manifest():
+    masked = list(quality_mask_probes('qualityMask450')[:3])
+    manifest = Manifest.__new__(Manifest) # without reading a manifest file
+    manifest.array_type = ArrayType.ILLUMINA_450K
+    manifest._Manifest__data_frame = pd.DataFrame({'probe_type': 'cg'},
+        index=pd.Index(['cg_good1', masked[0], 'rs_dropped', masked[1], 'cg_good2'], name='IlmnID'))
+    manifest._Manifest__snp_data_frame = pd.DataFrame({'IlmnID': ['rs01', masked[2]]})
+    return manifest, masked
+
+
+class TestQualityMask():
+
+    @staticmethod
+    def test_manifest_order_and_reuse():
+        manifest, masked = _manifest()
+        index, is_masked = manifest.get_quality_mask()
+        assert list(index) == ['cg_good1', masked[0], masked[1], 'cg_good2', 'rs01', masked[2]]
+        assert is_masked.tolist() == [False, True, True, False, False, True]
+        assert manifest.get_quality_mask()[1] is is_masked # matched once per manifest
+
+    @staticmethod
+    def test_same_as_matching_names():
+        manifest, _ = _manifest()
+        class Container():
+            array_type = ArrayType.ILLUMINA_450K
+            man = manifest.data_frame[~manifest.data_frame.index.str.startswith('rs')]
+            snp_man = manifest.snp_data_frame.set_index('IlmnID')
+        precomputed = _apply_sesame_quality_mask(Container(), manifest.get_quality_mask())
+        assert precomputed.equals(_apply_sesame_quality_mask(Container()))
+        assert precomputed['quality_mask'].tolist() == [1.0, 0.0, 0.0, 1.0, 1.0, 0.0]
+        Container.array_type = ArrayType.ILLUMINA_27K
+        assert _apply_sesame_quality_mask(Container()) is None
+
+    @staticmethod
+    def test_positions_are_reused():
+        manifest, masked = _manifest()
+        positions = manifest.get_probe_positions('quality_mask')
+        assert manifest.get_probe_positions('quality_mask') is positions # kept per manifest
+        index, is_masked = manifest.get_quality_mask()
+        mask_df = pd.DataFrame({'quality_mask': np.where(is_masked, 0.0, 1.0)}, index=index)
+        sample = pd.DataFrame({'noob_meth': [1.0, 2.0, 3.0, 4.0]},
+            index=pd.Index(['cg_good2', masked[1], 'rs01', 'cg_unknown'], name='IlmnID'))
+        joined = _join_by_position(sample, mask_df, positions)
+        assert joined.equals(sample.join(mask_df, how='inner'))
+        first = positions.get(sample.index)
+        assert positions.get(sample.index.copy()) is first # same probes: the positions are reused
+        other = sample.iloc[::-1]
+        assert _join_by_position(other, mask_df, positions).equals(other.join(mask_df, how='inner'))
+        assert positions.get(other.index) is not first
@@ -0,0 +1,65 @@
+import gc
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from types import SimpleNamespace
+# App
+from methylprep.processing import SampleDataContainer
+from methylprep.processing.spill import SpillStore, SPILL_DIRNAME
+
+
+def _container(sentrix_id, seed):
+    rng = np.random.default_rng(seed)
+    data_frame = pd.DataFrame({
+        'noob_meth': rng.integers(0, 5000, 4).astype('float64'),
+        'noob_unmeth': rng.integers(0, 5000, 4).astype('uint16'),
+        'beta_value': rng.random(4),
+    }, index=pd.Index(['cg01', 'cg02', 'cg03', 'rs01'], name='IlmnID'))
+    return SimpleNamespace(**{
+        'sample': SimpleNamespace(sentrix_id=sentrix_id, sentrix_position='R01C01'),
+        'quality_mask': True,
+        'poobah_sig': 0.05,
+        'ctrl_red': pd.DataFrame(), # probe subsets are not saved
+        '_SampleDataContainer__data_frame': data_frame,
+    })
+
+
+class TestSpillStore():
+
+    @staticmethod
+    def test_round_trip(tmp_path):
+        containers = [_container('2001', 0), _container('2002', 1)]
+        store = SpillStore(tmp_path)
+        artifacts = store.write_batch(1, containers)
+        assert f'{SPILL_DIRNAME}/batch_1.pkl' in artifacts
+        assert all(Path(tmp_path, artifact).exists() for artifact in artifacts)
+        # both samples have the same probes, so share one index file
+        assert len(list(Path(tmp_path, SPILL_DIRNAME).glob('index_*.npy'))) == 1
+
+        loaded = SpillStore(tmp_path).load_batch(1)
+        assert [type(container).__name__ for container in loaded] == ['SpilledSampleDataContainer'] * 2
+        assert isinstance(loaded[0], SampleDataContainer)
+        assert loaded[0].quality_mask is True and loaded[0].sample.sentrix_id == '2001'
+        assert not hasattr(loaded[0], 'ctrl_red')
+        assert loaded[0]._data_frame is None # not read until used
+        for original, spilled in zip(containers, loaded):
+            expected = original._SampleDataContainer__data_frame
+            result = spilled._SampleDataContainer__data_frame
+            assert result.index.equals(expected.index) and result.index.name == 'IlmnID'
+            assert result['noob_unmeth'].dtype == 'uint16'
+            assert result['beta_value'].dtype == 'float32' # float64 is stored at float32 precision
+            assert np.allclose(result.values.astype(float), expected.values.astype(float))
+
+    @staticmethod
+    def test_removed_when_unused(tmp_path):
+        store = SpillStore(tmp_path)
+        store.write_batch(1, [_container('2001', 0)])
+        loaded = store.load_batch(1)
+        store.remove_when_unused()
+        del store
+        gc.collect()
+        assert Path(tmp_path, SPILL_DIRNAME).exists() # the container still needs it
+        loaded[0]._SampleDataContainer__data_frame
+        del loaded
+        gc.collect()
+        assert not Path(tmp_path, SPILL_DIRNAME).exists()
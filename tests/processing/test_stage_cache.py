@@ -0,0 +1,41 @@
+import pandas as pd
+from pathlib import Path
+# App
+from methylprep.processing.stage_cache import StageCache, sigset_state, restore_sigset_state
+
+
+class TestStageCache():
+
+    @staticmethod
+    def test_keys_follow_params(tmp_path):
+        cache = StageCache(tmp_path).for_sample('2001_R01C01', 'raw-key', 'manifest-key')
+        assert cache.load('noob', poobah_sig=0.05) is None
+        cache.save('noob', {'value': 1}, poobah_sig=0.05)
+        assert cache.load('noob', poobah_sig=0.05) == {'value': 1}
+        # a changed setting is a miss, and saving it replaces the stage's older result
+        assert cache.load('noob', poobah_sig=0.1) is None
+        cache.save('noob', {'value': 2}, poobah_sig=0.1)
+        assert cache.load('noob', poobah_sig=0.05) is None and cache.load('noob', poobah_sig=0.1) == {'value': 2}
+        assert len(list(Path(tmp_path, '_stage_cache', '2001_R01C01').glob('noob-*.pkl'))) == 1
+        # other idats or manifests get other keys
+        other = StageCache(tmp_path).for_sample('2001_R01C01', 'raw-key', 'other-manifest')
+        assert other.load('noob', poobah_sig=0.1) is None
+        StageCache(tmp_path).clear()
+        assert not Path(tmp_path, '_stage_cache').exists()
+
+    @staticmethod
+    def test_sigset_state_round_trip(tmp_path):
+        class Container():
+            pass
+        container = Container()
+        container.methylated = pd.DataFrame({'noob_Meth': [1.0, 2.0]}, index=['cg01', 'cg02'])
+        container.ctrl_green = pd.DataFrame({'mean_value': [3.0]})
+        container._SigSet__preprocessed = True
+        container.unrelated = 'not cached'
+        state = sigset_state(container)
+        assert set(state) == {'methylated', 'ctrl_green', '_SigSet__preprocessed'}
+        cache = StageCache(tmp_path).for_sample('2001_R01C01', 'raw-key')
+        cache.save('noob', state, noob=True)
+        restored = Container()
+        restore_sigset_state(restored, cache.load('noob', noob=True))
+        assert restored.methylated.equals(container.methylated) and restored._SigSet__preprocessed is True